@@ -0,0 +1,143 @@
+# Tick-throughput benchmark for the alert path.
+#
+# Runs the bot's real TickHub, AlertEngine, notify_alert and EmailQueue against
+# a local fake Deriv server, fake Telegram bot and (with aiosmtpd installed) a
+# local SMTP sink, then reports ticks/second processed, tick-to-notification
+# latency, memory per alert and event-loop lag.
+#
+#   python -m bench.alerts --alerts 1000 10000 100000
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from bench.fake_deriv import FakeDerivServer
+from bench.fakes import FakeBot, SmtpSink
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# Measures how late the event loop wakes up a task that sleeps `interval`
+async def watch_loop_lag(lags, interval=0.01):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def run(main, count, instruments, rate, duration, port, smtp_port, telegram_rate):
+    from utils import TickHub, AlertEngine, EmailQueue, TelegramDispatcher, UserCache, Alert, ABOVE, BELOW
+
+    server = FakeDerivServer(rate=rate, seed=count)
+    url = await server.start(port=port)
+    sink = None
+    if smtp_port:
+        sink = SmtpSink(port=smtp_port)
+        sink.start()
+        main.email_queue = EmailQueue("bench@example.com", None, host=sink.host, port=smtp_port, use_ssl=False, workers=2)
+        main.email_queue.start()
+
+    main.tick_hub = TickHub(url)
+    main.alert_engine = AlertEngine(main.tick_hub)
+    main.users = UserCache(main.user_store)
+    bot = FakeBot()
+    main.notifier = TelegramDispatcher(global_rate=telegram_rate, chat_rate=telegram_rate, coalesce_window=0)
+    main.notifier.start(bot)
+    main.fanout = main.build_fanout()
+    latencies = []
+
+    async def on_fire(alert, price, received_at):
+        sent = server.sent_at.get((alert.instrument, price))
+        await main.notify_alert(alert, price, received_at)
+        if sent is not None:
+            latencies.append(time.perf_counter() - sent)
+
+    main.alert_engine.on_fire = on_fire
+
+    # Build the alerts: thresholds within 2% of the start price on both sides
+    symbols = [f"BENCH{number}" for number in range(instruments)]
+    chance = random.Random(count)
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    alerts = []
+    for number in range(count):
+        chat_id = str(number // 5)  # five alerts per chat
+        user = await main.get_user(chat_id)
+        user["email"] = "user@example.com" if sink else None
+        direction = chance.choice((ABOVE, BELOW))
+        offset = chance.uniform(0, 0.02) * server.start_price
+        threshold = server.start_price + offset if direction == ABOVE else server.start_price - offset
+        alert = Alert(user["next_alert_id"], chat_id, chance.choice(symbols), direction, threshold, "bench")
+        user["next_alert_id"] += 1
+        user["alerts"][alert.id] = alert
+        alerts.append((alert.instrument, alert.direction, alert.threshold, alert))
+    warmup_started = time.perf_counter()
+    await main.alert_engine.add_alerts(alerts)
+    warmup = time.perf_counter() - warmup_started
+    memory_per_alert = (tracemalloc.get_traced_memory()[0] - memory_before) / count
+    tracemalloc.stop()
+
+    ticks = [0]
+    for symbol in symbols:
+        await main.tick_hub.subscribe(symbol, lambda tick: ticks.__setitem__(0, ticks[0] + 1))
+    lags = []
+    lag_watcher = asyncio.create_task(watch_loop_lag(lags))
+    started = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - started
+    lag_watcher.cancel()
+
+    await main.user_store.flush()
+    await main.notifier.stop()
+    if sink:
+        await main.email_queue.stop()
+        sink.stop()
+    await main.tick_hub.close()
+    await server.stop()
+
+    fired = len(latencies)
+    print(f"alerts={count:>7} instruments={instruments} warmup={warmup:.2f}s "
+          f"ticks/s={ticks[0] / elapsed:,.0f} fired={fired} "
+          f"p50={percentile(latencies, 0.5) * 1000:.2f}ms p99={percentile(latencies, 0.99) * 1000:.2f}ms "
+          f"mem/alert={memory_per_alert:.0f}B "
+          f"loop lag p50={statistics.median(lags) * 1000 if lags else 0:.2f}ms max={max(lags, default=0) * 1000:.2f}ms "
+          f"emails={sink.received if sink else 'off'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DerivAlertTG alert path")
+    parser.add_argument("--alerts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--instruments", type=int, default=23)
+    parser.add_argument("--rate", type=float, default=10, help="ticks per second per instrument")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to stream per run")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--telegram-rate", type=float, default=1e9,
+                        help="messages per second allowed to the fake bot, globally and per chat")
+    parser.add_argument("--smtp-port", type=int, default=0, help="start an aiosmtpd sink on this port")
+    args = parser.parse_args()
+
+    # main.py reads its configuration at import time
+    workdir = tempfile.mkdtemp(prefix="derivalert-bench-")
+    os.environ["USER_STORE_PATH"] = os.path.join(workdir, "user_data.db")
+    os.environ["DERIV_API_URL"] = f"ws://localhost:{args.port}"
+    import main as bot_main
+    bot_main.setup()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for count in args.alerts:
+        asyncio.run(run(bot_main, count, args.instruments, args.rate, args.duration, args.port, args.smtp_port,
+                        args.telegram_rate))
+
+
+if __name__ == "__main__":
+    main()
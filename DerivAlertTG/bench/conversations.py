@@ -0,0 +1,133 @@
+# Conversation-flow load benchmark for the handlers and the user store.
+#
+# Drives the bot's real Application with synthetic Updates from many chats at
+# once, against a local fake Bot API and fake Deriv server. Every chat sets its
+# email and then sets price alerts step by step, waiting for each reply like a
+# user would. Reports latency percentiles per handler, bytes the user store
+# wrote per conversation and event-loop stalls, so persistence and state
+# changes can be compared on numbers.
+#
+#   python -m bench.conversations --chats 1000 --rounds 3
+#   python -m bench.conversations --store json
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from bench.alerts import percentile, watch_loop_lag
+from bench.fake_deriv import FakeDerivServer
+from bench.fake_telegram import FakeTelegramApi, message_update
+
+TOKEN = "123456:BENCH"
+
+
+# (handler the message reaches, text), for one round of a chat
+def conversation(chat_id, number):
+    return [("set_email", "/setemail"),
+            ("handle_email", f"user{chat_id}.{number}@example.com"),
+            ("set_alert", "/setalert"),
+            ("handle_instrument", "R_100"),
+            ("handle_condition", "price"),
+            ("handle_custom_message", f"bench alert {number}"),
+            ("handle_alert_price", f"above {10 ** 9 + number}")]
+
+
+class ChatDriver:
+    def __init__(self, application, api):
+        self.application = application
+        self.update_ids = iter(range(1, 10 ** 9))
+        self.waiters = {}  # chat_id -> future for its next reply
+        self.latencies = {}  # handler -> [seconds]
+        api.on_message = self._on_message
+
+    def _on_message(self, chat_id, text):
+        waiter = self.waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    async def say(self, chat_id, text):
+        from telegram import Update
+
+        waiter = self.waiters[chat_id] = asyncio.get_running_loop().create_future()
+        update = Update.de_json(message_update(next(self.update_ids), chat_id, text), self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_queue.put(update)
+        return await asyncio.wait_for(waiter, 30) - started
+
+    async def chat(self, chat_id, rounds):
+        for number in range(rounds):
+            for handler, text in conversation(chat_id, number):
+                self.latencies.setdefault(handler, []).append(await self.say(chat_id, text))
+
+
+async def run(main, chats, rounds, api_port, deriv_port, stall_ms):
+    from utils import TelegramDispatcher
+
+    deriv = FakeDerivServer(rate=10)
+    await deriv.start(port=deriv_port)
+    api = FakeTelegramApi()
+    base_url = await api.start(port=api_port)
+    application = main.build_application(TOKEN, base_url=base_url)
+    main.notifier = TelegramDispatcher(global_rate=1e9, chat_rate=1e9, coalesce_window=0)
+    driver = ChatDriver(application, api)
+
+    async with application:
+        main.notifier.start(application.bot)
+        await main.instrument_catalog.refresh()
+        await application.start()
+
+        bytes_before = main.user_store.bytes_written
+        lags = []
+        lag_watcher = asyncio.create_task(watch_loop_lag(lags))
+        started = time.perf_counter()
+        await asyncio.gather(*(driver.chat(chat_id, rounds) for chat_id in range(1000, 1000 + chats)))
+        elapsed = time.perf_counter() - started
+        lag_watcher.cancel()
+        await main.user_store.flush()
+        written = main.user_store.bytes_written - bytes_before
+
+        await application.stop()
+        await main.notifier.stop()
+    await main.tick_hub.close()
+    await api.stop()
+    await deriv.stop()
+
+    conversations = chats * rounds
+    stalls = [lag for lag in lags if lag * 1000 >= stall_ms]
+    print(f"store={main.USER_STORE} chats={chats} conversations={conversations} "
+          f"conversations/s={conversations / elapsed:,.1f} store bytes/conversation={written / conversations:,.0f}")
+    for handler, latencies in driver.latencies.items():
+        print(f"  {handler:<22} p50={percentile(latencies, 0.5) * 1000:7.2f}ms "
+              f"p99={percentile(latencies, 0.99) * 1000:7.2f}ms max={max(latencies) * 1000:7.2f}ms")
+    print(f"  loop lag p50={percentile(lags, 0.5) * 1000:.2f}ms max={max(lags, default=0) * 1000:.2f}ms "
+          f"stalls>={stall_ms}ms={len(stalls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the DerivAlertTG conversation handlers and user store")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3, help="email + alert conversations per chat")
+    parser.add_argument("--store", choices=["sqlite", "json"], default="sqlite")
+    parser.add_argument("--stall-ms", type=float, default=50, help="loop lag counted as a stall")
+    parser.add_argument("--api-port", type=int, default=8082)
+    parser.add_argument("--deriv-port", type=int, default=8766)
+    args = parser.parse_args()
+
+    # main.py reads its configuration at import time
+    workdir = tempfile.mkdtemp(prefix="derivalert-bench-")
+    os.environ["USER_STORE"] = args.store
+    os.environ["USER_STORE_PATH"] = os.path.join(workdir, "user_data.db" if args.store == "sqlite" else "user_data.json")
+    os.environ["INSTRUMENT_CACHE"] = os.path.join(workdir, "instruments.json")
+    os.environ["DERIV_API_URL"] = f"ws://localhost:{args.deriv_port}"
+    os.environ.setdefault("MAX_ALERTS_PER_CHAT", str(max(50, args.rounds)))
+    import main as bot_main
+    bot_main.setup()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    asyncio.run(run(bot_main, args.chats, args.rounds, args.api_port, args.deriv_port, args.stall_ms))
+
+
+if __name__ == "__main__":
+    main()
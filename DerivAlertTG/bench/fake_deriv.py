@@ -0,0 +1,121 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+import websockets
+
+logger = logging.getLogger(__name__)
+
+# What active_symbols answers with; ticks are streamed for any symbol asked for
+ACTIVE_SYMBOLS = [
+    ("R_10", "Volatility 10 Index"), ("R_25", "Volatility 25 Index"), ("R_50", "Volatility 50 Index"),
+    ("R_75", "Volatility 75 Index"), ("R_100", "Volatility 100 Index"),
+    ("1HZ10V", "Volatility 10 (1s) Index"), ("1HZ100V", "Volatility 100 (1s) Index"),
+    ("BOOM500", "Boom 500 Index"), ("CRASH500", "Crash 500 Index"), ("JD10", "Jump 10 Index"),
+]
+
+
+# Local stand-in for the Deriv websocket API. It answers "ticks" subscriptions
+# with a random walk per instrument at a fixed rate and one-off "ticks" with
+# the current quote, plus "forget", "ticks_history", "active_symbols" and
+# "ping", which is everything the bot uses.
+class FakeDerivServer:
+    def __init__(self, rate=10, start_price=1000.0, step=0.001, seed=None):
+        self.rate = rate  # ticks per second per instrument
+        self.start_price = start_price
+        self.step = step  # relative size of one random walk step
+        self.random = random.Random(seed)
+        self.prices = {}  # instrument -> last quote
+        self.history = {}  # instrument -> [(epoch, quote)]
+        self.sent_at = {}  # (instrument, quote) -> perf_counter when sent
+        self.ticks_sent = 0
+        self.connections = set()
+        self.server = None
+        self.subscription_ids = itertools.count(1)
+
+    async def start(self, host="localhost", port=8765):
+        self.server = await websockets.serve(self._handler, host, port, max_queue=None)
+        return f"ws://{host}:{port}"
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    # Drop every client connection, e.g. to exercise reconnects
+    async def disconnect_all(self):
+        for websocket in list(self.connections):
+            await websocket.close()
+
+    def _next_quote(self, instrument):
+        price = self.prices.get(instrument, self.start_price)
+        price = round(price * (1 + self.random.uniform(-self.step, self.step)), 4)
+        self.prices[instrument] = price
+        return price
+
+    async def _stream(self, websocket, instrument, req_id, subscription_id):
+        interval = 1 / self.rate
+        while True:
+            quote = self._next_quote(instrument)
+            epoch = int(time.time())
+            self.history.setdefault(instrument, []).append((epoch, quote))
+            self.sent_at[(instrument, quote)] = time.perf_counter()
+            await websocket.send(json.dumps({
+                "echo_req": {"ticks": instrument, "subscribe": 1, "req_id": req_id},
+                "msg_type": "tick",
+                "req_id": req_id,
+                "subscription": {"id": subscription_id},
+                "tick": {"epoch": epoch, "quote": quote, "symbol": instrument, "pip_size": 4},
+            }))
+            self.ticks_sent += 1
+            await asyncio.sleep(interval)
+
+    async def _handler(self, websocket):
+        self.connections.add(websocket)
+        streams = {}
+        try:
+            async for message in websocket:
+                request = json.loads(message)
+                req_id = request.get("req_id")
+                if "ticks" in request and not request.get("subscribe"):
+                    instrument = request["ticks"]
+                    quote = self.prices.get(instrument) or self._next_quote(instrument)
+                    await websocket.send(json.dumps({
+                        "msg_type": "tick", "req_id": req_id,
+                        "tick": {"epoch": int(time.time()), "quote": quote, "symbol": instrument, "pip_size": 4},
+                    }))
+                elif "ticks" in request:
+                    subscription_id = str(next(self.subscription_ids))
+                    streams[subscription_id] = asyncio.create_task(
+                        self._stream(websocket, request["ticks"], req_id, subscription_id))
+                elif "forget" in request:
+                    stream = streams.pop(request["forget"], None)
+                    if stream is not None:
+                        stream.cancel()
+                    await websocket.send(json.dumps({"msg_type": "forget", "forget": 1, "req_id": req_id}))
+                elif "ticks_history" in request:
+                    ticks = [(epoch, quote) for epoch, quote in self.history.get(request["ticks_history"], [])
+                             if request["start"] <= epoch <= request["end"]]
+                    await websocket.send(json.dumps({
+                        "msg_type": "history", "req_id": req_id,
+                        "history": {"times": [epoch for epoch, _ in ticks], "prices": [quote for _, quote in ticks]},
+                    }))
+                elif "active_symbols" in request:
+                    await websocket.send(json.dumps({
+                        "msg_type": "active_symbols", "req_id": req_id,
+                        "active_symbols": [{"symbol": symbol, "display_name": name, "market": "synthetic_index",
+                                            "market_display_name": "Derived", "submarket_display_name": "Continuous Indices",
+                                            "exchange_is_open": 1, "is_trading_suspended": 0, "pip": 0.0001}
+                                           for symbol, name in ACTIVE_SYMBOLS],
+                    }))
+                elif "ping" in request:
+                    await websocket.send(json.dumps({"msg_type": "ping", "ping": "pong", "req_id": req_id}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connections.discard(websocket)
+            for stream in streams.values():
+                stream.cancel()
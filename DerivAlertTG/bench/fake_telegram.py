@@ -0,0 +1,156 @@
+import asyncio
+import itertools
+import json
+import time
+from urllib.parse import parse_qs
+
+from utils.updates import read_request, write_response
+
+
+# Local stand-in for the Telegram Bot API. Point the bot at it with
+# base_url=f"http://127.0.0.1:{port}/bot". Updates handed to deliver() are
+# returned from getUpdates or, once setWebhook was called, POSTed to the
+# webhook over a few kept-alive connections, the way Telegram does. Every
+# sendMessage is recorded with the time it arrived.
+class FakeTelegramApi:
+    def __init__(self, webhook_connections=8):
+        self.webhook_connections = webhook_connections
+        self.server = None
+        self.pending = []  # updates not yet fetched by getUpdates
+        self.arrived = asyncio.Event()
+        self.webhook_url = None
+        self.secret_token = None
+        self.webhook_queue = asyncio.Queue()
+        self.pushers = []
+        self.handlers = set()
+        self.sent = []  # (perf_counter, chat_id, text)
+        self.on_message = None  # callable(chat_id, text) for every sendMessage
+        self.message_ids = itertools.count(1)
+
+    async def start(self, host="127.0.0.1", port=8081):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return f"http://{host}:{port}/bot"
+
+    async def stop(self):
+        for pusher in self.pushers:
+            pusher.cancel()
+        await asyncio.gather(*self.pushers, return_exceptions=True)
+        self.pushers.clear()
+        self.arrived.set()  # Answer any long poll still waiting
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def deliver(self, update):
+        if self.webhook_url:
+            self.webhook_queue.put_nowait(update)
+        else:
+            self.pending.append(update)
+            self.arrived.set()
+
+    async def _api(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if method == "deleteWebhook":
+            self._set_webhook(None, None)
+            return True
+        if method == "setWebhook":
+            self._set_webhook(params["url"], params.get("secret_token"))
+            return True
+        if method == "getUpdates":
+            return await self._get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0)))
+        if method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            self.sent.append((time.perf_counter(), chat_id, params["text"]))
+            if self.on_message is not None:
+                self.on_message(chat_id, params["text"])
+            return {"message_id": next(self.message_ids), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": params["text"]}
+        return True
+
+    async def _get_updates(self, offset, timeout):
+        self.pending = [update for update in self.pending if update["update_id"] >= offset]
+        if not self.pending and timeout:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:100]
+
+    def _set_webhook(self, url, secret_token):
+        self.webhook_url = url
+        self.secret_token = secret_token
+        for pusher in self.pushers:
+            pusher.cancel()
+        self.pushers = [asyncio.create_task(self._push()) for _ in range(self.webhook_connections)] if url else []
+
+    # One kept-alive connection POSTing queued updates to the webhook
+    async def _push(self):
+        host, _, rest = self.webhook_url.removeprefix("http://").partition("/")
+        hostname, _, port = host.partition(":")
+        reader, writer = await asyncio.open_connection(hostname, int(port or 80))
+        try:
+            while True:
+                update = await self.webhook_queue.get()
+                body = json.dumps(update).encode()
+                headers = (f"POST /{rest} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                           f"Content-Length: {len(body)}\r\n")
+                if self.secret_token:
+                    headers += f"X-Telegram-Bot-Api-Secret-Token: {self.secret_token}\r\n"
+                writer.write(headers.encode() + b"\r\n" + body)
+                await writer.drain()
+                await read_response(reader)
+        finally:
+            writer.close()
+
+    async def _handle(self, reader, writer):
+        self.handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                _, path, headers, body = request
+                method = path.split("?")[0].rsplit("/", 1)[-1]
+                if headers.get("content-type", "").startswith("application/json"):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+                result = await self._api(method, params)
+                write_response(writer, "200 OK", json.dumps({"ok": True, "result": result}).encode(),
+                               content_type="application/json")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            self.handlers.discard(asyncio.current_task())
+
+
+# Read one HTTP response and return (status code, body)
+async def read_response(reader):
+    status_line = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    body = await reader.readexactly(length) if length else b""
+    return int(status_line.split()[1]), body
+
+
+# A recorded private-chat text message, as Telegram delivers it
+def message_update(update_id, chat_id, text):
+    message = {"message_id": update_id, "date": int(time.time()), "text": text,
+               "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+               "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"}}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
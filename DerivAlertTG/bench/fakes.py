@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+
+# Stands in for telegram.Bot: records every message instead of sending it
+class FakeBot:
+    def __init__(self, delay=0):
+        self.delay = delay  # simulated Bot API round trip in seconds
+        self.messages = []  # (perf_counter, chat_id, text)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.messages.append((time.perf_counter(), chat_id, text))
+
+
+# Local SMTP server that accepts and counts every message (needs aiosmtpd)
+class SmtpSink:
+    def __init__(self, host="127.0.0.1", port=8025):
+        from aiosmtpd.controller import Controller
+        self.host = host
+        self.port = port
+        self.received = 0
+        self.peers = set()  # client (host, port) that sent mail: one per SMTP connection
+        self.controller = Controller(self, hostname=host, port=port)
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        self.peers.add(session.peer)
+        return "250 OK"
+
+    def start(self):
+        self.controller.start()
+
+    def stop(self):
+        self.controller.stop()
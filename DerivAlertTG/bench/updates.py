@@ -0,0 +1,128 @@
+# Update-handling latency benchmark: polling against webhook mode.
+#
+# Runs the bot's real handlers against a local fake Bot API. Every simulated
+# chat walks through /setemail and answers with an address, waiting for each
+# reply like a user would; latency is the time from Telegram having the
+# update to the bot's reply arriving. A burst phase then sends both messages
+# of every chat at once and checks each chat's replies came back in order.
+#
+#   python -m bench.updates --chats 50 --rounds 5
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from bench.alerts import percentile
+from bench.fake_telegram import FakeTelegramApi, message_update
+
+TOKEN = "123456:BENCH"
+
+
+class Conversations:
+    def __init__(self, api):
+        self.api = api
+        self.update_ids = iter(range(1, 10 ** 9))
+        self.waiters = {}  # chat_id -> future for its next reply
+        self.replies = {}  # chat_id -> [text]
+        api.on_message = self._on_message
+
+    def _on_message(self, chat_id, text):
+        self.replies.setdefault(chat_id, []).append(text)
+        waiter = self.waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    async def say(self, chat_id, text):
+        waiter = self.waiters[chat_id] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        self.api.deliver(message_update(next(self.update_ids), chat_id, text))
+        return await asyncio.wait_for(waiter, 30) - started
+
+    async def chat(self, chat_id, rounds, latencies):
+        for number in range(rounds):
+            latencies.append(await self.say(chat_id, "/setemail"))
+            latencies.append(await self.say(chat_id, f"user{chat_id}.{number}@example.com"))
+
+    # Send both steps of the conversation back to back for every chat
+    async def burst(self, chats):
+        self.replies.clear()
+        for chat_id in chats:
+            self.api.deliver(message_update(next(self.update_ids), chat_id, "/setemail"))
+            self.api.deliver(message_update(next(self.update_ids), chat_id, f"burst{chat_id}@example.com"))
+        deadline = time.perf_counter() + 30
+        while sum(len(self.replies.get(chat_id, ())) for chat_id in chats) < 2 * len(chats):
+            if time.perf_counter() > deadline:
+                break
+            await asyncio.sleep(0.01)
+        return all(self.replies.get(chat_id, [""])[0].startswith("Please enter") and
+                   self.replies[chat_id][-1].startswith("Email set") for chat_id in chats)
+
+
+async def run(main, mode, chats, rounds, api_port, webhook_port):
+    from utils import TelegramDispatcher, WebhookServer
+
+    api = FakeTelegramApi()
+    base_url = await api.start(port=api_port)
+    application = main.build_application(TOKEN, base_url=base_url)
+    main.notifier = TelegramDispatcher(global_rate=1e9, chat_rate=1e9, coalesce_window=0)
+    conversations = Conversations(api)
+    server = None
+
+    async with application:
+        main.notifier.start(application.bot)
+        await application.start()
+        if mode == "webhook":
+            server = WebhookServer(application, secret_token="bench-secret", port=webhook_port)
+            await server.start()
+            await application.bot.set_webhook(f"http://127.0.0.1:{webhook_port}/telegram", secret_token="bench-secret")
+        else:
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+
+        chat_ids = list(range(1000, 1000 + chats))
+        latencies = []
+        started = time.perf_counter()
+        await asyncio.gather(*(conversations.chat(chat_id, rounds, latencies) for chat_id in chat_ids))
+        elapsed = time.perf_counter() - started
+        ordered = await conversations.burst(chat_ids)
+
+        if server is not None:
+            await server.stop()
+        else:
+            await application.updater.stop()
+        await application.stop()
+        await main.notifier.stop()
+    await main.user_store.flush()
+    await api.stop()
+
+    print(f"mode={mode:<8} chats={chats} updates={len(latencies)} updates/s={len(latencies) / elapsed:,.0f} "
+          f"p50={percentile(latencies, 0.5) * 1000:.2f}ms p99={percentile(latencies, 0.99) * 1000:.2f}ms "
+          f"burst ordered={'yes' if ordered else 'NO'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare DerivAlertTG update handling in polling and webhook mode")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5, help="conversations per chat")
+    parser.add_argument("--modes", nargs="+", default=["polling", "webhook"])
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8443)
+    args = parser.parse_args()
+
+    # main.py reads its configuration at import time
+    workdir = tempfile.mkdtemp(prefix="derivalert-bench-")
+    os.environ["USER_STORE_PATH"] = os.path.join(workdir, "user_data.db")
+    import main as bot_main
+    bot_main.setup()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def run_all():
+        for mode in args.modes:
+            await run(bot_main, mode, args.chats, args.rounds, args.api_port, args.webhook_port)
+
+    asyncio.run(run_all())
+
+
+if __name__ == "__main__":
+    main()
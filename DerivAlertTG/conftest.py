@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tests import the bot's modules (utils, replay, bench) from this
+# directory, also when pytest is run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -1,230 +1,656 @@
 import os
+import asyncio
 import logging
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from telegram import Update
+import signal
+import time
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
 from telegram.ext import ConversationHandler
-import asyncio
-import websockets
-import json
-
-# File where user settings will be saved
+from utils import TickHub, AlertEngine, EmailQueue, Alert, ABOVE, BELOW, open_store, user_to_record
+from utils import TickRecorder, AlertRegistry, AlertLimitError, InstrumentCatalog, QuoteCache, QuoteUnavailable, UserCache
+from utils import PRICE, MOVE, MA_CROSS, VOLATILITY, CANDLE_CLOSE, KINDS, TIMEFRAMES
+from utils import MetricsServer, TelegramDispatcher, ShardedEngine, ChatOrderedUpdateProcessor, WebhookServer
+from utils import LoopDiagnostics, NotificationFanout, Notification, TelegramSink, EmailSink, WebhookSink, InvalidWebhook
+from utils import CHANNELS
+
+# Legacy file where user settings used to be saved; imported into the store on first start
 USER_DATA_FILE = "user_data.json"
 
+# Storage backend for user settings: "sqlite" or "json"
+USER_STORE = os.getenv("USER_STORE", "sqlite")
+USER_STORE_PATH = os.getenv("USER_STORE_PATH", "user_data.db" if USER_STORE == "sqlite" else USER_DATA_FILE)
+
+# How updates arrive: "polling" (getUpdates) or "webhook" (Telegram POSTs them to
+# WEBHOOK_URL, which must reach the local server on WEBHOOK_HOST:WEBHOOK_PORT,
+# with WEBHOOK_SECRET as the secret token; webhook mode refuses to start without it)
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling")
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+
+# Recurring alerts notify at most once per this many seconds, whatever the user asks for
+MIN_REPEAT_COOLDOWN = float(os.getenv("MIN_REPEAT_COOLDOWN", "60"))
+
+# Chats allowed to use /profile, /slowcallbacks, /tasks and /deliveries, comma-separated
+ADMIN_CHAT_IDS = [int(chat_id) for chat_id in os.getenv("ADMIN_CHAT_IDS", "").replace(",", " ").split()]
+
 # Enable logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Define constants for conversation states
-EMAIL, INSTRUMENT, ALERT_PRICE, CUSTOM_MESSAGE = range(4)
-
-# Load user data from file
-def load_user_data():
-    if os.path.exists(USER_DATA_FILE):
-        with open(USER_DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-# Save user data to file
-def save_user_data(user_data):
-    with open(USER_DATA_FILE, 'w') as f:
-        json.dump(user_data, f, indent=4)
-
-# Load the existing user data when the bot starts
-all_user_data = load_user_data()
-
-# Function to send an email
-def send_email(subject, body, receiver_email):
-    sender_email = os.getenv("EMAIL_ADDRESS")
-    sender_password = os.getenv("EMAIL_PASSWORD")
-
-    # Create the email content
-    msg = MIMEMultipart()
-    msg['From'] = sender_email
-    msg['To'] = receiver_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-
-    try:
-        # Connect to the Gmail SMTP server on port 465
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
-            logger.info("Email sent successfully.")
-    except Exception as e:
-        logger.error(f"Failed to send email: {e}")
-
-# Function to monitor price and send alerts using WebSocket
-async def monitor_price(instrument, alert_price, email, custom_message, chat_id, context):
-    deriv_api_url = os.getenv("DERIV_API_URL")  # Get the URL from the .env file
-
-    async with websockets.connect(deriv_api_url) as websocket:
-        # Subscribe to price updates for the selected instrument
-        subscribe_message = {
-            "ticks": instrument
-        }
-        await websocket.send(json.dumps(subscribe_message))
-
-        logger.info(f"Monitoring {instrument} for price {alert_price}")
-
-        while True:
-            response = await websocket.recv()
-            data = json.loads(response)
-
-            if "tick" in data:
-                current_price = data["tick"]["quote"]
-                logger.info(f"Current price of {instrument}: {current_price}")
-
-                if current_price >= alert_price:  # Check if the price level is reached
-                    # Send email and notify via Telegram
-                    send_email("Price Alert Triggered", f"{custom_message} - The price has reached your alert level: {current_price}.", email)
-                    await context.bot.send_message(chat_id=chat_id, text=f"Price Alert: {custom_message} - The price has reached {current_price}. An email alert has been sent.")
-                    break  # Exit the loop after sending the alert
+EMAIL, INSTRUMENT, ALERT_PRICE, CUSTOM_MESSAGE, CONDITION, CONDITION_PARAMS = range(6)
+
+# How to ask for the parameters of each indicator condition
+CONDITION_PROMPTS = {
+    MOVE: "Enter 'up' or 'down', the percentage and the minutes, e.g. 'up 2 5' for a 2% rise within 5 minutes:",
+    MA_CROSS: "Enter 'above' or 'below' and the number of ticks, e.g. 'above 50' to cross above the 50-tick average:",
+    VOLATILITY: "Enter how many times normal volatility and the number of ticks, e.g. '3 20' for 3x over 20 ticks:",
+    CANDLE_CLOSE: "Enter the timeframe (1m, 5m, 15m or 1h) and the price, e.g. '5m above 4300' or '1h below 4200':",
+}
+
+# Optional archive of every received tick, one file per instrument per day
+TICK_ARCHIVE_DIR = os.getenv("TICK_ARCHIVE_DIR")
+
+# Every alert is evaluated by one engine fed from the shared tick hub, or with
+# ENGINE_WORKERS set, by that many engine processes each owning some instruments
+ENGINE_WORKERS = int(os.getenv("ENGINE_WORKERS", "0"))
+
+# Optional Prometheus endpoint at http://127.0.0.1:METRICS_PORT/metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Each fired alert goes out on Telegram, email and the user's webhook at once.
+# Every channel has its own deadline (seconds) and the webhook is retried
+# WEBHOOK_ATTEMPTS times; a channel that fails or hangs does not delay the others.
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "60"))
+EMAIL_TIMEOUT = float(os.getenv("EMAIL_TIMEOUT", "60"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "5"))
+WEBHOOK_ATTEMPTS = int(os.getenv("WEBHOOK_ATTEMPTS", "3"))
+
+# The bot's shared services, built by setup(). Engine worker processes are
+# spawned and import this module again, so importing it must not open the
+# store or connect to anything.
+user_store = users = tick_hub = instrument_catalog = quote_cache = None
+alert_engine = alert_registry = tick_recorder = email_queue = metrics_server = None
+notifier = webhook_sink = fanout = diagnostics = None
+
+# Build the shared services from the configuration above
+def setup():
+    global user_store, users, tick_hub, instrument_catalog, quote_cache, alert_engine, alert_registry
+    global tick_recorder, email_queue, metrics_server, notifier, webhook_sink, fanout, diagnostics
+
+    # Users with alerts are loaded when the bot starts; everyone else when they
+    # next talk to the bot, and kept in memory up to USER_CACHE_MB
+    user_store = open_store(USER_STORE, USER_STORE_PATH, legacy_json_path=USER_DATA_FILE)
+    users = UserCache(user_store, max_bytes=int(float(os.getenv("USER_CACHE_MB", "64")) * 1024 * 1024))
+    users.load_pinned()
+
+    # One shared Deriv connection for every alert
+    tick_hub = TickHub(os.getenv("DERIV_API_URL"), codec=os.getenv("DERIV_CODEC"))
+
+    # Deriv's symbols with their open/closed status, cached on disk and refreshed
+    # in the background over the shared connection
+    instrument_catalog = InstrumentCatalog(tick_hub, path=os.getenv("INSTRUMENT_CACHE", "instruments.json"),
+                                           ttl=int(os.getenv("INSTRUMENT_CACHE_TTL", "3600")))
+
+    # Newest quote per instrument, fed by the open tick streams; /price and /view
+    # only ask Deriv when it is older than QUOTE_MAX_AGE seconds
+    quote_cache = QuoteCache(tick_hub, max_age=float(os.getenv("QUOTE_MAX_AGE", "5")))
+
+    if ENGINE_WORKERS:
+        alert_engine = ShardedEngine(os.getenv("DERIV_API_URL"), ENGINE_WORKERS, archive_dir=TICK_ARCHIVE_DIR)
+    else:
+        alert_engine = AlertEngine(tick_hub)
+
+    # Every armed alert goes through the registry, which refuses duplicates and
+    # caps how many alerts one chat, and the whole bot, can have
+    alert_registry = AlertRegistry(alert_engine, max_per_chat=int(os.getenv("MAX_ALERTS_PER_CHAT", "50")),
+                                   max_total=int(os.getenv("MAX_ALERTS", "200000")))
+
+    # Sharded engines record in their own processes; otherwise tap the shared hub
+    tick_recorder = TickRecorder(TICK_ARCHIVE_DIR) if TICK_ARCHIVE_DIR and not ENGINE_WORKERS else None
+    if tick_recorder is not None:
+        tick_hub.taps.append(tick_recorder.record)
+
+    # Alert emails go through a queue so SMTP never blocks the event loop
+    email_queue = EmailQueue(os.getenv("EMAIL_ADDRESS"), os.getenv("EMAIL_PASSWORD"),
+                             host=os.getenv("SMTP_HOST", "smtp.gmail.com"),
+                             port=int(os.getenv("SMTP_PORT", "465")),
+                             use_ssl=os.getenv("SMTP_SSL", "1") == "1",
+                             workers=int(os.getenv("EMAIL_WORKERS", "1")))
+
+    metrics_server = MetricsServer(METRICS_PORT, host=os.getenv("METRICS_HOST", "127.0.0.1")) if METRICS_PORT else None
+
+    # Everything sent to Telegram goes through one rate-limited dispatcher
+    notifier = TelegramDispatcher(global_rate=float(os.getenv("TELEGRAM_RATE", "25")),
+                                  chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+                                  coalesce_window=float(os.getenv("ALERT_COALESCE_WINDOW", "0.25")))
+
+    webhook_sink = WebhookSink(timeout=WEBHOOK_TIMEOUT, attempts=WEBHOOK_ATTEMPTS,
+                               max_connections=int(os.getenv("WEBHOOK_CONNECTIONS", "100")),
+                               allow_private=os.getenv("WEBHOOK_ALLOW_PRIVATE", "0") == "1")
+    fanout = build_fanout()
+
+    # Event-loop profiling and task dumps for the admin commands
+    diagnostics = LoopDiagnostics()
+
+# The sinks hold the notifier and email queue, so build them after those
+def build_fanout():
+    return NotificationFanout([TelegramSink(notifier, timeout=TELEGRAM_TIMEOUT),
+                               EmailSink(email_queue, timeout=EMAIL_TIMEOUT),
+                               webhook_sink])
+
+# Alert warm-up, running in the background while the bot already serves updates
+background_tasks = set()
+
+# Get a user's settings, creating an empty entry on first contact
+async def get_user(chat_id):
+    return await users.get_or_create(chat_id)
+
+# Save one user's settings and alerts to persistent storage
+async def save_user(user):
+    users.update(user)
+    await user_store.upsert(user["chat_id"], user_to_record(user))
+
+# Function to send the alerts once the engine sees their price level crossed
+async def notify_alert(alert, current_price, received_at=None):
+    user = await users.get(alert.chat_id)
+    if user is None or alert.id not in user["alerts"]:
+        return
+    # A one-shot alert has fired: drop it so it is not restored on the next
+    # start. A recurring one stays armed on the stream.
+    if not alert.recurring:
+        del user["alerts"][alert.id]
+        await save_user(user)
+
+    # Send it on every channel the alert uses, all at once
+    if alert.kind == PRICE:
+        email_text = f"{alert.message} - The price has reached your alert level: {current_price}."
+        text = f"Price Alert: {alert.message} - The price has reached {current_price}."
+    else:
+        email_text = f"{alert.message} - {alert.instrument} {alert.condition()} at {current_price}."
+        text = f"Price Alert: {alert.message} - {alert.instrument} {alert.condition()} at {current_price}."
+    notification = Notification(alert, current_price, user, received_at, text, "Price Alert Triggered", email_text)
+    await fanout.notify(notification, alert.channels)
+
+# Tell users their alerts were dropped because the instrument's stream failed
+async def cancel_alerts(alerts, reason):
+    for alert in alerts:
+        user = await users.get(alert.chat_id)
+        if user is None or user["alerts"].pop(alert.id, None) is None:
+            continue
+        await save_user(user)
+        await notifier.notify(alert.chat_id, f"Alert #{alert.id} on {alert.instrument} was cancelled: {reason}")
+
+# Answer the user in the chat an update came from
+async def reply(update, text, reply_markup=None):
+    await notifier.reply(str(update.message.chat_id), text, reply_markup)
+
+# Parse "4300", "above 4300", ">= 4300", "below 4300" or "<= 4300" into a direction and price
+def parse_alert_price(text):
+    text = text.strip().lower()
+    direction = ABOVE
+    for prefix, prefix_direction in ((">=", ABOVE), ("<=", BELOW), (">", ABOVE), ("<", BELOW), ("above", ABOVE), ("below", BELOW)):
+        if text.startswith(prefix):
+            direction = prefix_direction
+            text = text[len(prefix):]
+            break
+    return direction, float(text)
+
+# Parse the "repeat <band> [minutes]" suffix of an alert price into the
+# hysteresis band and the cooldown in seconds
+def parse_repeat(text):
+    words = text.split()
+    if len(words) not in (1, 2):
+        raise ValueError(f"Invalid repeat: {text}")
+    hysteresis = float(words[0])
+    minutes = float(words[1]) if len(words) == 2 else 0
+    if hysteresis <= 0 or minutes < 0:
+        raise ValueError(f"Invalid repeat: {text}")
+    return hysteresis, max(MIN_REPEAT_COOLDOWN, minutes * 60)
+
+# Parse the parameters of an indicator condition into direction, threshold and window
+def parse_condition(kind, text):
+    words = text.strip().lower().split()
+    if kind == MOVE and len(words) == 3 and words[0] in ("up", "down"):
+        percent, minutes = float(words[1]), float(words[2])
+        if percent > 0 and 0 < minutes <= 24 * 60:
+            return (ABOVE if words[0] == "up" else BELOW), percent, int(minutes * 60)
+    elif kind == MA_CROSS and len(words) == 2 and words[0] in (ABOVE, BELOW):
+        period = int(words[1])
+        if 2 <= period <= 10000:
+            return words[0], 0, period
+    elif kind == VOLATILITY and len(words) == 2:
+        factor, period = float(words[0]), int(words[1])
+        if factor > 0 and 2 <= period <= 1000:
+            return ABOVE, factor, period
+    elif kind == CANDLE_CLOSE and len(words) >= 2 and words[0] in TIMEFRAMES:
+        direction, price = parse_alert_price(" ".join(words[1:]))
+        return direction, price, TIMEFRAMES[words[0]]
+    raise ValueError(f"Invalid {kind} condition: {text}")
 
 # Start command handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.message.chat_id)
-    context.user_data["chat_id"] = chat_id  # Store chat_id automatically
-
-    # Check if user data exists and load settings
-    if chat_id in all_user_data:
-        user_settings = all_user_data[chat_id]
-        context.user_data.update(user_settings)  # Load saved data into the current session
-        await context.bot.send_message(chat_id=chat_id, text=f"Welcome back! Your saved settings are:\n"
-                                                              f"Email: {user_settings.get('email')}\n"
-                                                              f"Instrument: {user_settings.get('instrument')}\n"
-                                                              f"Alert Price: {user_settings.get('alert_price')}\n"
-                                                              f"Custom Message: {user_settings.get('custom_message')}")
+
+    # Check if user data exists and show the saved settings
+    user = await users.get(chat_id)
+    if user is not None:
+        await notifier.reply(chat_id, f"Welcome back! Your saved settings are:\n"
+                                      f"Email: {user['email']}\n"
+                                      f"Webhook: {user['webhook']}\n"
+                                      f"Active alerts: {len(user['alerts'])} (see /view)")
     else:
-        await context.bot.send_message(chat_id=chat_id, text="Welcome! Use /setemail to set your email address.")
+        await notifier.reply(chat_id, "Welcome! Use /setemail to set your email address.")
 
 # Command to set email address
 async def set_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Please enter your email address:")
+    await reply(update, "Please enter your email address:")
     return EMAIL
 
 # Handle user input for email
 async def handle_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
     email = update.message.text
     chat_id = str(update.message.chat_id)
-    context.user_data["email"] = email  # Store email in user_data
+    user = await get_user(chat_id)
+    user["email"] = email
 
     # Save email to persistent storage
-    all_user_data[chat_id] = context.user_data
-    save_user_data(all_user_data)
+    await save_user(user)
 
-    await update.message.reply_text(f"Email set to: {email}. You can now set an alert using /setalert.")
+    await reply(update, f"Email set to: {email}. You can now set an alert using /setalert.")
     return ConversationHandler.END
 
+# The instrument list and a keyboard of the open symbols, from the catalog
+def instrument_picker():
+    instruments = instrument_catalog.open_instruments()
+    if not instruments:
+        return "Please enter the instrument symbol, for example R_100.", None
+    lines = ["Please choose an instrument or enter its name:"]
+    submarket = None
+    for instrument in instruments:
+        if instrument.submarket != submarket:
+            submarket = instrument.submarket
+            lines.append(f"\n{instrument.market} - {submarket}")
+        lines.append(f"{instrument.display_name.upper()} = '{instrument.symbol}'")
+    text = "\n".join(lines)
+    if len(text) > 4000:  # Telegram's message limit; the keyboard still has every symbol
+        text = "Please choose an instrument or enter its name or symbol."
+    symbols = [instrument.symbol for instrument in instruments]
+    keyboard = [symbols[i:i + 4] for i in range(0, len(symbols), 4)]
+    return text, ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+
+# Keys of the draft alert kept in user_data while /setalert lasts
+DRAFT_KEYS = ("instrument", "kind", "condition", "custom_message")
+
+# Forget the draft when the conversation ends, so user_data does not keep growing
+def clear_draft(context):
+    for key in DRAFT_KEYS:
+        context.user_data.pop(key, None)
+
 # Command to set an alert
 async def set_alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    instrument_hint = ("Please enter the instrument name from the following list:\n\n"
-                       "VOLATILITY 10 INDEX = 'R_10'\n"
-                       "VOLATILITY 25 INDEX = 'R_25'\n"
-                       "VOLATILITY 50 INDEX = 'R_50'\n"
-                       "VOLATILITY 75 INDEX = 'R_75'\n"
-                       "VOLATILITY 100 INDEX = 'R_100'\n"
-                       "VOLATILITY 10(1S) INDEX = '1HZ10V'\n"
-                       "VOLATILITY 25(1S) INDEX = '1HZ25V'\n"
-                       "VOLATILITY 50(1S) INDEX = '1HZ50V'\n"
-                       "VOLATILITY 75(1S) INDEX = '1HZ75V'\n"
-                       "VOLATILITY 100(1S) INDEX = '1HZ100V'\n"
-                       "VOLATILITY 150(1S) INDEX = '1HZ150V'\n"
-                       "VOLATILITY 250(1S) INDEX = '1HZ250V'\n"
-                       "BOOM 300 INDEX = 'BOOM300N'\n"
-                       "BOOM 500 INDEX = 'BOOM500N'\n"
-                       "BOOM 1000 INDEX = 'BOOM1000'\n"
-                       "CRASH 300 INDEX = 'CRASH300N'\n"
-                       "CRASH 500 INDEX = 'CRASH500'\n"
-                       "CRASH 1000 INDEX = 'CRASH1000'\n"
-                       "JUMP 10 INDEX = 'JD10'\n"
-                       "JUMP 25 INDEX = 'JD25'\n"
-                       "JUMP 50 INDEX = 'JD50'\n"
-                       "JUMP 75 INDEX = 'JD75'\n"
-                       "JUMP 100 INDEX = 'JD100'\n")
-
-    await update.message.reply_text(instrument_hint)
+    clear_draft(context)  # Left over if an earlier /setalert was never finished
+    text, keyboard = instrument_picker()
+    await reply(update, text, keyboard)
     return INSTRUMENT
 
-# Handle user input for instrument
+# Handle user input for instrument. Until the catalog has loaded once the
+# symbol cannot be checked and is taken as entered.
 async def handle_instrument(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    instrument = update.message.text
-    chat_id = str(update.message.chat_id)
-    context.user_data["instrument"] = instrument  # Store instrument in user_data
-
-    # Save instrument to persistent storage
-    all_user_data[chat_id] = context.user_data
-    save_user_data(all_user_data)
+    text = update.message.text.strip()
+    instrument = instrument_catalog.lookup(text)
+    if instrument is None and len(instrument_catalog):
+        suggestions = instrument_catalog.suggestions(text)
+        hint = f" Did you mean {' or '.join(suggestions)}?" if suggestions else ""
+        await reply(update, f"Unknown instrument '{text}'.{hint} Please choose one from the list.")
+        return INSTRUMENT
+    if instrument is not None and not instrument.is_open:
+        await reply(update, f"{instrument.display_name} is closed right now, please choose another instrument.")
+        return INSTRUMENT
+    # Keep the draft alert in user_data until it is complete
+    context.user_data["instrument"] = instrument.symbol if instrument is not None else text.upper()
+
+    await reply(update, "Choose the condition:\n"
+                        "price - the price reaches a level\n"
+                        "move - the price moves by a percentage within some minutes\n"
+                        "ma - the price crosses its moving average\n"
+                        "volatility - volatility spikes above normal\n"
+                        "close - a 1m/5m/15m/1h candle closes beyond a price, ignoring wicks",
+                ReplyKeyboardRemove())
+    return CONDITION
+
+# Handle user input for the condition type
+async def handle_condition(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    kind = update.message.text.strip().lower()
+    if kind not in KINDS:
+        await reply(update, f"Unknown condition. Please enter one of: {', '.join(KINDS)}")
+        return CONDITION
+    context.user_data["kind"] = kind  # Keep the draft alert in user_data until it is complete
+
+    if kind == PRICE:
+        await reply(update, "Please enter your custom message:")
+        return CUSTOM_MESSAGE
+    await reply(update, CONDITION_PROMPTS[kind])
+    return CONDITION_PARAMS
+
+# Handle user input for the parameters of an indicator condition
+async def handle_condition_params(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        context.user_data["condition"] = parse_condition(context.user_data["kind"], update.message.text)
+    except ValueError:
+        await reply(update, "Invalid condition. " + CONDITION_PROMPTS[context.user_data["kind"]])
+        return CONDITION_PARAMS
 
-    await update.message.reply_text("Please enter your custom message:")
+    await reply(update, "Please enter your custom message:")
     return CUSTOM_MESSAGE
 
 # Handle user input for custom message
 async def handle_custom_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     custom_message = update.message.text
-    chat_id = str(update.message.chat_id)
-    context.user_data["custom_message"] = custom_message  # Store custom message in user_data
-
-    # Save custom message to persistent storage
-    all_user_data[chat_id] = context.user_data
-    save_user_data(all_user_data)
-
-    await update.message.reply_text("Please enter the price at which you want to set the alert:")
+    context.user_data["custom_message"] = custom_message  # Keep the draft alert in user_data until it is complete
+
+    kind = context.user_data.get("kind", PRICE)
+    if kind != PRICE:
+        direction, threshold, window = context.user_data["condition"]
+        await arm_alert(update, context, direction, threshold, kind, window)
+        return ConversationHandler.END
+
+    await reply(update, "Please enter the price at which you want to set the alert.\n"
+                        "Prefix it with 'below' (or '<=') to be alerted when the price falls to it.\n"
+                        "Add 'repeat <band> [minutes]' to be alerted again every time the price comes back "
+                        "by the band and crosses again, at most every so many minutes, "
+                        "e.g. 'above 4300 repeat 5 30':")
     return ALERT_PRICE
 
 # Handle user input for alert price
 async def handle_alert_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text, repeat, band = update.message.text.lower().partition("repeat")
     try:
-        price = float(update.message.text)
-        chat_id = str(update.message.chat_id)
-        context.user_data["alert_price"] = price  # Store alert price in user_data
-
-        # Save alert price to persistent storage
-        all_user_data[chat_id] = context.user_data
-        save_user_data(all_user_data)
-
-        # Notify user of alert setup
-        await update.message.reply_text(f"Alert set for {context.user_data['instrument']} at price: {price}.\n"
-                                         f"You will be notified via email and Telegram with your message: {context.user_data['custom_message']}.")
-
-        # Start monitoring price in the background
-        asyncio.create_task(monitor_price(context.user_data['instrument'], price, context.user_data["email"], context.user_data["custom_message"], context.user_data["chat_id"], context))
-
+        direction, price = parse_alert_price(text)
+        hysteresis, cooldown = parse_repeat(band) if repeat else (None, 0)
     except ValueError:
-        await update.message.reply_text("Invalid price. Please enter a numeric value.")
+        await reply(update, "Invalid price. Please enter a numeric value, "
+                            "optionally followed by 'repeat <band> [minutes]'.")
         return ALERT_PRICE
 
+    await arm_alert(update, context, direction, price, hysteresis=hysteresis, cooldown=cooldown)
     return ConversationHandler.END
 
+# Save the finished draft alert and hand it to the engine
+async def arm_alert(update, context, direction, threshold, kind=PRICE, window=None, hysteresis=None, cooldown=0):
+    chat_id = str(update.message.chat_id)
+    user = await get_user(chat_id)
+    alert = Alert(user["next_alert_id"], chat_id, context.user_data["instrument"], direction, threshold,
+                  context.user_data["custom_message"], kind, window, hysteresis=hysteresis, cooldown=cooldown)
+    clear_draft(context)  # The conversation ends here whether or not the alert is accepted
+
+    # Hand the alert to the engine, which watches the shared tick stream. It is
+    # in the user's alerts first, in case it fires before add() returns.
+    user["alerts"][alert.id] = alert
+    try:
+        duplicate = await alert_registry.add(alert)
+    except AlertLimitError as e:
+        refusal = str(e)
+    else:
+        refusal = duplicate and f"You already have this alert as #{duplicate.id}: {duplicate.describe()}."
+    if refusal:
+        del user["alerts"][alert.id]
+        await reply(update, refusal)
+        return
+    user["next_alert_id"] += 1
+
+    # Save the new alert to persistent storage
+    await save_user(user)
+
+    # Notify user of alert setup
+    repeats = f" It {alert.repeats()}." if alert.recurring else ""
+    await reply(update, f"Alert #{alert.id} set for {alert.instrument}: {alert.condition()}.{repeats}\n"
+                        f"You will be notified with your message: {alert.message}.\n"
+                        f"Use /channels {alert.id} to choose how, and /delete {alert.id} to remove it.")
+
+# Format a quote with the instrument's pip size when the catalog knows it
+def format_price(symbol, price):
+    instrument = instrument_catalog.lookup(symbol)
+    return instrument.format(price) if instrument is not None else str(price)
+
+# Current quotes of some instruments, None for those Deriv has none for
+async def current_prices(symbols):
+    symbols = list(set(symbols))
+    results = await asyncio.gather(*(quote_cache.get(symbol) for symbol in symbols), return_exceptions=True)
+    return {symbol: None if isinstance(result, Exception) else result[0] for symbol, result in zip(symbols, results)}
+
+# One /view line: the alert, the current price and how far it is from the level
+def describe_with_price(alert, price):
+    line = alert.describe()
+    if price is None:
+        return line
+    line += f"\n    now {format_price(alert.instrument, price)}"
+    if alert.kind in (PRICE, CANDLE_CLOSE) and price:
+        distance = alert.threshold - price
+        line += f", {format_price(alert.instrument, abs(distance))} ({abs(distance) / price * 100:.2f}%) to go"
+    return line
+
+# Command to show an instrument's current price: /price <symbol>
+async def price(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await reply(update, "Usage: /price <instrument>, for example /price R_100.")
+        return
+    text = " ".join(context.args)
+    instrument = instrument_catalog.lookup(text)
+    if instrument is None and len(instrument_catalog):
+        suggestions = instrument_catalog.suggestions(text)
+        hint = f" Did you mean {' or '.join(suggestions)}?" if suggestions else ""
+        await reply(update, f"Unknown instrument '{text}'.{hint}")
+        return
+    symbol = instrument.symbol if instrument is not None else text.upper()
+    try:
+        quote, epoch = await quote_cache.get(symbol)
+    except QuoteUnavailable as e:
+        await reply(update, f"No price for {symbol}: {e}")
+        return
+    name = f"{instrument.display_name} ({symbol})" if instrument is not None else symbol
+    await reply(update, f"{name}: {format_price(symbol, quote)} at {time.strftime('%H:%M:%S', time.gmtime(epoch))} UTC")
+
 # Command to view current settings
 async def view(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.message.chat_id)
-    if chat_id in all_user_data:
-        user_settings = all_user_data[chat_id]
+    user = await users.get(chat_id)
+    if user is not None:
+        prices = await current_prices(alert.instrument for alert in user["alerts"].values())
+        alert_lines = "\n".join(describe_with_price(alert, prices[alert.instrument])
+                                for alert in user["alerts"].values()) or "None"
         settings_message = (f"Your current settings are:\n"
-                            f"Email: {user_settings.get('email')}\n"
-                            f"Instrument: {user_settings.get('instrument')}\n"
-                            f"Alert Price: {user_settings.get('alert_price')}\n"
-                            f"Custom Message: {user_settings.get('custom_message')}")
-        await context.bot.send_message(chat_id=chat_id, text=settings_message)
+                            f"Email: {user['email']}\n"
+                            f"Webhook: {user['webhook']}\n"
+                            f"Alerts:\n{alert_lines}")
+        await notifier.reply(chat_id, settings_message)
     else:
-        await context.bot.send_message(chat_id=chat_id, text="No settings found. Please set your email and alert.")
+        await notifier.reply(chat_id, "No settings found. Please set your email and alert.")
+
+# Command to delete an alert: /delete <id>
+async def delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.message.chat_id)
+    user = await users.get(chat_id)
+    try:
+        alert_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await reply(update, "Usage: /delete <alert id>. Use /view to see your alerts.")
+        return
+    alert = user["alerts"].pop(alert_id, None) if user else None
+    if alert is None:
+        await reply(update, f"No alert #{alert_id} found.")
+        return
+    await alert_registry.remove(alert)
+    await save_user(user)
+    await reply(update, f"Alert #{alert_id} deleted.")
+
+# Command to set a URL every alert is POSTed to as JSON: /setwebhook <url|off>
+async def set_webhook(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if len(context.args) != 1:
+        await reply(update, "Usage: /setwebhook <https://...> to POST your alerts there, or /setwebhook off.")
+        return
+    user = await get_user(str(update.message.chat_id))
+    if context.args[0].lower() == "off":
+        user["webhook"] = None
+        await save_user(user)
+        await reply(update, "Webhook removed.")
+        return
+    try:
+        user["webhook"] = webhook_sink.validate(context.args[0])
+    except InvalidWebhook as e:
+        await reply(update, str(e))
+        return
+    await save_user(user)
+    await reply(update, f"Alerts will also be POSTed to {user['webhook']}.")
+
+# Command to choose where an alert is delivered: /channels <id> [telegram,email,webhook|all]
+async def set_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    usage = f"Usage: /channels <alert id> [{','.join(CHANNELS)}|all]"
+    user = await users.get(str(update.message.chat_id))
+    try:
+        alert_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await reply(update, usage)
+        return
+    alert = user["alerts"].get(alert_id) if user else None
+    if alert is None:
+        await reply(update, f"No alert #{alert_id} found.")
+        return
+    if len(context.args) == 1:
+        await reply(update, f"Alert #{alert_id} is sent by {', '.join(alert.channels or ['every channel you set up'])}.")
+        return
+    names = " ".join(context.args[1:]).lower().replace(",", " ").split()
+    if names == ["all"]:
+        channels = None
+    elif names and all(name in CHANNELS for name in names):
+        channels = tuple(name for name in CHANNELS if name in names)
+    else:
+        await reply(update, usage)
+        return
+    alert.channels = channels
+    await save_user(user)
+    await reply(update, f"Alert #{alert_id} will be sent by {', '.join(channels or ['every channel you set up'])}.")
+
+# Admin command: /deliveries shows delivery counts and latencies per channel
+async def deliveries(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply_long(update, fanout.report())
 
 # Command to modify email
 async def modify(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Please enter your new email address:")
+    await reply(update, "Please enter your new email address:")
     return EMAIL
 
 # Command to cancel conversation
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Operation cancelled.")
+    clear_draft(context)
+    await reply(update, "Operation cancelled.")
     return ConversationHandler.END
 
-def main():
-    # Create the Application and pass it your bot's token
-    application = ApplicationBuilder().token(os.getenv("TELEGRAM_BOT_TOKEN")).build()
+# Send a long report as several messages, split between lines
+async def reply_long(update, text, limit=4000):
+    chunk = []
+    size = 0
+    for line in text.splitlines():
+        if chunk and size + len(line) + 1 > limit:
+            await reply(update, "\n".join(chunk))
+            chunk, size = [], 0
+        chunk.append(line[:limit])
+        size += len(line[:limit]) + 1
+    if chunk:
+        await reply(update, "\n".join(chunk))
+
+# Admin command: /profile [seconds] samples the event loop and reports where it spends its time
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        seconds = min(120.0, float(context.args[0])) if context.args else 10.0
+    except ValueError:
+        await reply(update, "Usage: /profile [seconds]")
+        return
+    await reply(update, f"Profiling for {seconds:g}s...")
+    try:
+        report = await diagnostics.profile(seconds)
+    except RuntimeError as e:
+        await reply(update, str(e))
+        return
+    await reply_long(update, report)
+
+# Admin command: /slowcallbacks [ms|off] turns on asyncio's slow-callback
+# warnings over ms milliseconds, or shows the latest ones
+async def slow_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args:
+        try:
+            diagnostics.watch_slow_callbacks(None if context.args[0] == "off" else float(context.args[0]) / 1000)
+        except ValueError:
+            await reply(update, "Usage: /slowcallbacks [milliseconds|off]")
+            return
+    await reply_long(update, diagnostics.slow_callback_report())
+
+# Admin command: /tasks lists every live task with its age and await point
+async def tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await reply_long(update, diagnostics.task_report())
+
+# Re-arm every alert that had not fired yet when the bot last stopped. Copies
+# of an alert the chat already has are dropped from its saved alerts.
+async def restore_alerts():
+    started = time.perf_counter()
+    alerts = [alert for user in users.with_alerts() for alert in user["alerts"].values()]
+    restored, duplicates = await alert_registry.add_many(alerts, batch_size=int(os.getenv("WARMUP_BATCH_SIZE", "50")))
+    for alert in duplicates:
+        users.resident(alert.chat_id)["alerts"].pop(alert.id, None)
+    for chat_id in {alert.chat_id for alert in duplicates}:
+        await save_user(users.resident(chat_id))
+    logger.info(f"Restored {restored} alerts on {len(alert_engine.instruments())} instruments in {time.perf_counter() - started:.2f}s")
+
+# Start background workers once the bot's event loop is running
+async def post_init(application):
+    diagnostics.install()
+    if metrics_server is not None:
+        await metrics_server.start()
+    email_queue.start()
+    notifier.start(application.bot)
+    await fanout.start()
+    instrument_catalog.start()
+    if tick_recorder is not None:
+        tick_recorder.start()
+    if ENGINE_WORKERS:
+        await alert_engine.start()
+    # Every alert is armed before the task first yields, i.e. before any
+    # update is handled; only the upstream subscriptions go on in the background
+    task = asyncio.create_task(restore_alerts(), name="restore-alerts")
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+# On exit, stop the ticks first so no new alert fires, let the notifications
+# already fired finish, then let queued messages and emails go out before the
+# store is flushed
+async def post_shutdown(application):
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await instrument_catalog.stop()
+    if ENGINE_WORKERS:
+        await alert_engine.close()
+    await tick_hub.close()
+    await alert_registry.drain()
+    await fanout.close()
+    await notifier.stop()
+    await email_queue.stop()
+    if tick_recorder is not None:
+        await tick_recorder.stop()
+    await user_store.flush()
+    user_store.close()
+    if metrics_server is not None:
+        await metrics_server.stop()
+
+# Create the Application with every handler. Updates from different chats are
+# handled concurrently, but each chat's updates one at a time and in order.
+def build_application(token, base_url=None):
+    builder = ApplicationBuilder().token(token).post_init(post_init).post_shutdown(post_shutdown)
+    builder.concurrent_updates(ChatOrderedUpdateProcessor(UPDATE_WORKERS))
+    if base_url:
+        builder.base_url(base_url)
+    application = builder.build()
+    alert_registry.on_fire = notify_alert
+    alert_registry.on_cancel = cancel_alerts
 
     # Set up conversation handler
     conv_handler = ConversationHandler(
@@ -235,6 +661,8 @@ def main():
         states={
             EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_email)],
             INSTRUMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_instrument)],
+            CONDITION: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_condition)],
+            CONDITION_PARAMS: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_condition_params)],
             CUSTOM_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_custom_message)],
             ALERT_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_alert_price)],
         },
@@ -243,9 +671,58 @@ def main():
 
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("delete", delete))
+    application.add_handler(CommandHandler("price", price))
+    application.add_handler(CommandHandler("setwebhook", set_webhook))
+    application.add_handler(CommandHandler("channels", set_channels))
+    if ADMIN_CHAT_IDS:
+        admins = filters.Chat(chat_id=ADMIN_CHAT_IDS)
+        application.add_handler(CommandHandler("profile", profile, filters=admins))
+        application.add_handler(CommandHandler("slowcallbacks", slow_callbacks, filters=admins))
+        application.add_handler(CommandHandler("tasks", tasks, filters=admins))
+        application.add_handler(CommandHandler("deliveries", deliveries, filters=admins))
+    return application
+
+# Serve updates from the local webhook server until SIGTERM/SIGINT. post_init
+# and post_shutdown are only called by run_polling/run_webhook, so call them here.
+async def run_webhook(application):
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl-C still raises KeyboardInterrupt
+    secret_token = os.getenv("WEBHOOK_SECRET")
+    server = WebhookServer(application, path=os.getenv("WEBHOOK_PATH", "/telegram"), secret_token=secret_token,
+                           host=os.getenv("WEBHOOK_HOST", "127.0.0.1"), port=int(os.getenv("WEBHOOK_PORT", "8443")))
+    async with application:
+        await post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(os.getenv("WEBHOOK_URL"), secret_token=secret_token,
+                                          allowed_updates=Update.ALL_TYPES)
+        try:
+            await stopping.wait()
+        finally:
+            await server.stop()
+            await application.stop()
+            await post_shutdown(application)
+
+def main():
+    if UPDATE_MODE == "webhook" and not os.getenv("WEBHOOK_SECRET"):
+        raise SystemExit("UPDATE_MODE=webhook needs WEBHOOK_SECRET, or anyone could post updates to the bot")
+    setup()
+    application = build_application(os.getenv("TELEGRAM_BOT_TOKEN"))
 
     # Run the bot until the user presses Ctrl-C
-    application.run_polling()
+    if UPDATE_MODE == "webhook":
+        try:
+            asyncio.run(run_webhook(application))
+        except KeyboardInterrupt:
+            pass
+    else:
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,163 @@
+# Replay historical ticks through the live alert engine.
+#
+# Ticks come from the tick archive (TICK_ARCHIVE_DIR) or from saved Deriv
+# ticks_history responses, alerts from the user store or a JSON file. Ticks
+# are fed as fast as the CPU allows and notifications are captured instead of
+# sent, then every fired alert is listed with the tick that fired it.
+#
+#   python replay.py --archive ticks --alerts-from user_data.db --chat 12345
+#   python replay.py --history crash500.json --alerts alerts.json
+import argparse
+import asyncio
+import calendar
+import heapq
+import json
+import os
+import time
+
+from utils import AlertEngine, Alert, TickArchive, open_store, user_from_record
+
+
+# Stands in for TickHub: subscriptions are just callbacks and ticks come from
+# feed() instead of a websocket
+class ReplayHub:
+    def __init__(self):
+        self.subscribers = {}  # instrument -> set of callbacks
+        self.taps = []
+        self.on_error = None
+
+    async def subscribe(self, instrument, callback):
+        self.subscribers.setdefault(instrument, set()).add(callback)
+
+    async def subscribe_many(self, pairs, batch_size=50, timeout=10):
+        for instrument, callback in pairs:
+            await self.subscribe(instrument, callback)
+        return len(pairs)
+
+    async def unsubscribe(self, instrument, callback):
+        callbacks = self.subscribers.get(instrument)
+        if callbacks:
+            callbacks.discard(callback)
+
+    async def close(self):
+        pass
+
+    # The tick's epoch stands in for its receive time, so fired alerts know
+    # when they would have fired
+    def feed(self, instrument, epoch, quote):
+        tick = {"symbol": instrument, "epoch": epoch, "quote": quote, "received_at": epoch}
+        for callback in list(self.subscribers.get(instrument, ())):
+            callback(tick)
+
+
+# Ticks from a saved ticks_history response ({"echo_req": {"ticks_history": ...},
+# "history": {"times": [...], "prices": [...]}}), or a list of them
+def history_ticks(path):
+    with open(path, 'r') as f:
+        data = json.load(f)
+    for response in data if isinstance(data, list) else [data]:
+        instrument = response.get("echo_req", {}).get("ticks_history") or response.get("symbol")
+        history = response["history"]
+        yield from ((epoch, instrument, quote) for epoch, quote in zip(history["times"], history["prices"]))
+
+
+def archive_ticks(root, instrument, start, end):
+    return ((epoch, instrument, quote) for epoch, quote in TickArchive(root).iter_ticks(instrument, start, end))
+
+
+def load_alerts(args):
+    if args.alerts:
+        with open(args.alerts, 'r') as f:
+            return [Alert.from_dict(str(data.get("chat_id")), data) for data in json.load(f)]
+    backend = "json" if args.alerts_from.endswith(".json") else "sqlite"
+    store = open_store(backend, args.alerts_from)
+    try:
+        users = [user_from_record(chat_id, record) for chat_id, record in store.load_all().items()]
+    finally:
+        store.close()
+    return [alert for user in users for alert in user["alerts"].values()]
+
+
+def parse_time(text):
+    if text is None:
+        return None
+    if text.isdigit():
+        return int(text)
+    return calendar.timegm(time.strptime(text, "%Y-%m-%dT%H:%M:%S" if "T" in text else "%Y-%m-%d"))
+
+
+def format_time(epoch):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+async def replay(alerts, sources, yield_every=1000):
+    hub = ReplayHub()
+    engine = AlertEngine(hub)
+    fired = []
+
+    async def on_fire(alert, price, epoch):
+        fired.append((epoch, alert, price))
+
+    async def on_cancel(alerts, reason):
+        pass
+
+    engine.on_fire = on_fire
+    engine.on_cancel = on_cancel
+    await engine.add_alerts([(alert.instrument, alert.direction, alert.threshold, alert) for alert in alerts])
+
+    ticks = 0
+    started = time.perf_counter()
+    for epoch, instrument, quote in heapq.merge(*sources):
+        hub.feed(instrument, epoch, quote)
+        ticks += 1
+        if ticks % yield_every == 0:
+            await asyncio.sleep(0)  # Let fired alerts be captured
+    await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    return sorted(fired, key=lambda item: item[0]), ticks, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay historical ticks through the DerivAlertTG alert engine")
+    ticks = parser.add_mutually_exclusive_group(required=True)
+    ticks.add_argument("--archive", help="tick archive directory (TICK_ARCHIVE_DIR)")
+    ticks.add_argument("--history", nargs="+", help="saved Deriv ticks_history responses")
+    alerts = parser.add_mutually_exclusive_group()
+    alerts.add_argument("--alerts", help="JSON list of alerts, each with chat_id")
+    alerts.add_argument("--alerts-from", default=os.getenv("USER_STORE_PATH", "user_data.db"),
+                        help="user store to take the saved alerts from (.db or .json)")
+    parser.add_argument("--chat", help="only replay this chat's alerts")
+    parser.add_argument("--start", help="first tick time, YYYY-MM-DD[THH:MM:SS] UTC or epoch")
+    parser.add_argument("--end", help="last tick time, YYYY-MM-DD[THH:MM:SS] UTC or epoch")
+    args = parser.parse_args()
+
+    alerts = load_alerts(args)
+    if args.chat:
+        alerts = [alert for alert in alerts if alert.chat_id == args.chat]
+    if not alerts:
+        parser.error("no alerts to replay")
+    start, end = parse_time(args.start), parse_time(args.end)
+
+    if args.archive:
+        sources = [archive_ticks(args.archive, instrument, start, end)
+                   for instrument in sorted({alert.instrument for alert in alerts})]
+    else:
+        # A dump may hold several instruments, so order each file by epoch first
+        sources = [sorted((epoch, instrument, quote) for epoch, instrument, quote in history_ticks(path)
+                          if (start is None or epoch >= start) and (end is None or epoch <= end))
+                   for path in args.history]
+
+    fired, ticks, elapsed = asyncio.run(replay(alerts, sources))
+
+    for epoch, alert, price in fired:
+        print(f"{format_time(epoch)}  chat {alert.chat_id}  {alert.describe()}  fired at {price}")
+    fired_alerts = {id(alert) for _, alert, _ in fired}
+    for alert in alerts:
+        if id(alert) not in fired_alerts:
+            print(f"{'never fired':<19}  chat {alert.chat_id}  {alert.describe()}")
+    print(f"{len(fired)}/{len(alerts)} alerts fired over {ticks:,} ticks in {elapsed:.2f}s "
+          f"({ticks / elapsed if elapsed else 0:,.0f} ticks/s)")
+
+
+if __name__ == "__main__":
+    main()
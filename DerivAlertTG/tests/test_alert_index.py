@@ -0,0 +1,55 @@
+import unittest
+
+from utils.alert_index import ABOVE, BELOW, AlertIndex
+
+
+def index_of(*alerts):
+    index = AlertIndex()
+    for name, direction, threshold in alerts:
+        index.add(threshold, direction, name)
+    return index
+
+
+class ProcessRangeTest(unittest.TestCase):
+    def test_gap_fires_every_level_jumped_over(self):
+        index = index_of(("a100", ABOVE, 100), ("a105", ABOVE, 105), ("a120", ABOVE, 120),
+                         ("b95", BELOW, 95), ("b80", BELOW, 80))
+        # One tick at 99, the next at 110: everything between fires, nothing else
+        self.assertEqual(sorted(index.process_range(99, 110)), ["a100", "a105"])
+        self.assertEqual(sorted(index.alerts()), ["a120", "b80", "b95"])
+        self.assertEqual(sorted(index.process_range(70, 110)), ["b80", "b95"])
+        self.assertEqual(index.alerts(), ["a120"])
+
+    def test_price_equal_to_threshold_fires(self):
+        index = index_of(("above", ABOVE, 100), ("below", BELOW, 100))
+        self.assertEqual(sorted(index.process(100)), ["above", "below"])
+        self.assertEqual(len(index), 0)
+
+    def test_range_ending_just_short_of_threshold_does_not_fire(self):
+        index = index_of(("above", ABOVE, 100), ("below", BELOW, 90))
+        self.assertEqual(index.process_range(90.01, 99.99), [])
+        self.assertEqual(len(index), 2)
+
+    def test_alerts_at_the_same_level_all_fire(self):
+        index = index_of(("first", ABOVE, 100), ("second", ABOVE, 100), ("third", ABOVE, 101))
+        self.assertEqual(index.process(100), ["first", "second"])
+        self.assertEqual(index.alerts(), ["third"])
+
+
+class RemoveTest(unittest.TestCase):
+    def test_removes_only_the_given_alert_at_a_shared_level(self):
+        first, second = object(), object()
+        index = AlertIndex()
+        index.add(100, ABOVE, first)
+        index.add(100, ABOVE, second)
+        self.assertTrue(index.remove(100, ABOVE, second))
+        self.assertFalse(index.remove(100, ABOVE, second))
+        self.assertEqual(index.process(100), [first])
+
+    def test_unknown_direction_is_refused(self):
+        with self.assertRaises(ValueError):
+            AlertIndex().add(100, "sideways", object())
+
+
+if __name__ == "__main__":
+    unittest.main()
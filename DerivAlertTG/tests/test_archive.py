@@ -0,0 +1,105 @@
+import asyncio
+import calendar
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from utils.archive import TickArchive, TickRecorder
+
+DAY = 86400
+NOV_14 = calendar.timegm((2023, 11, 14, 0, 0, 0))
+
+
+def write(root, ticks, instrument="X"):
+    recorder = TickRecorder(root)
+    for epoch in ticks:
+        recorder.record(instrument, {"epoch": epoch, "quote": float(epoch)})
+    asyncio.run(recorder.flush())
+    return recorder
+
+
+class CrossDaySpanTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        # A tick every 2s over two full UTC days
+        write(self.root, range(NOV_14, NOV_14 + 2 * DAY, 2))
+        self.archive = TickArchive(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def count(self, start, end):
+        return sum(1 for _ in self.archive.iter_ticks("X", start, end))
+
+    def test_whole_day_across_midnight(self):
+        self.assertEqual(self.count(NOV_14, NOV_14 + DAY), 43201)
+
+    def test_start_on_previous_day(self):
+        self.assertEqual(self.count(NOV_14 - 3600, NOV_14 + 3600), 1801)
+
+    def test_range_around_midnight(self):
+        midnight = NOV_14 + DAY
+        ticks = list(self.archive.iter_ticks("X", midnight - 10, midnight + 10))
+        self.assertEqual([epoch for epoch, _ in ticks], list(range(midnight - 10, midnight + 11, 2)))
+
+    def test_range_inside_one_day(self):
+        self.assertEqual(self.count(NOV_14 + 3600, NOV_14 + 3659), 30)
+
+
+class RecorderHandoverTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    # An instrument moved A -> B -> A: each recorder must append after what
+    # the other one wrote and keep the minute index pointing at it
+    def test_recorders_take_turns_on_one_file(self):
+        first = TickRecorder(self.root)
+        second = TickRecorder(self.root)
+        for recorder, minute in ((first, 0), (second, 1), (first, 2), (first, 1)):
+            recorder.record("X", {"epoch": NOV_14 + minute * 60, "quote": float(minute)})
+            asyncio.run(recorder.flush())
+        self.assertEqual(first.stats["dropped"], 1)  # Older than what the other recorder wrote
+        with TickArchive(self.root).open("X", "2023-11-14") as ticks:
+            self.assertEqual(len(ticks), 3)
+            self.assertEqual(list(ticks.index[:3]), [0, 1, 2])
+        self.assertEqual(os.path.getsize(os.path.join(self.root, "2023-11-14", "X.ticks")), 3 * 16)
+
+    # Old and new owner flushing at the same time must not erase each other's records
+    def test_concurrent_appends_keep_every_record(self):
+        recorders = [TickRecorder(self.root), TickRecorder(self.root)]
+        epochs = itertools.count(NOV_14)
+
+        def append(recorder):
+            for _ in range(1000):
+                recorder._append("2023-11-14", "X", [(next(epochs), 1.0)])
+
+        threads = [threading.Thread(target=append, args=(recorder,)) for recorder in recorders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        written = sum(recorder.stats["written"] for recorder in recorders)
+        dropped = sum(recorder.stats["dropped"] for recorder in recorders)
+        self.assertEqual(written + dropped, 2000)
+        with TickArchive(self.root).open("X", "2023-11-14") as ticks:
+            self.assertEqual(len(ticks), written)
+            self.assertEqual(list(ticks.epochs), sorted(ticks.epochs))
+
+    def test_flush_only_the_given_instruments(self):
+        recorder = TickRecorder(self.root)
+        for instrument in ("X", "Y"):
+            recorder.record(instrument, {"epoch": NOV_14, "quote": 1.0})
+        asyncio.run(recorder.flush(["X"]))
+        self.assertEqual(list(recorder.buffers), ["Y"])
+        self.assertTrue(os.path.exists(os.path.join(self.root, "2023-11-14", "X.ticks")))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "2023-11-14", "Y.ticks")))
+
+
+if __name__ == "__main__":
+    unittest.main()
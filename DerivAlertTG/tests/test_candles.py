@@ -0,0 +1,43 @@
+import unittest
+
+from utils.candles import CandleSeries
+
+
+def feed(series, ticks):
+    return [candle for candle in (series.update(epoch, price) for epoch, price in ticks) if candle is not None]
+
+
+class CandleSeriesTest(unittest.TestCase):
+    def test_builds_ohlc_and_closes_on_the_next_period(self):
+        series = CandleSeries(60)
+        closed = feed(series, [(0, 10.0), (10, 12.0), (20, 9.0), (59, 11.0), (60, 11.5), (130, 13.0)])
+        self.assertEqual(closed, [(0, 10.0, 12.0, 9.0, 11.0), (60, 11.5, 11.5, 11.5, 11.5)])
+        self.assertEqual(series.history(), closed)
+        self.assertEqual(len(series), 2)
+
+    def test_late_tick_from_a_closed_period_is_ignored(self):
+        series = CandleSeries(60)
+        feed(series, [(0, 10.0), (60, 11.0)])
+        self.assertIsNone(series.update(30, 50.0))
+        self.assertEqual(feed(series, [(120, 12.0)]), [(60, 11.0, 11.0, 11.0, 11.0)])
+
+    # A backfilled tick older than the newest one in the open candle widens
+    # the range but must not become the close
+    def test_older_tick_in_the_open_period_does_not_move_the_close(self):
+        series = CandleSeries(60)
+        closed = feed(series, [(0, 10.0), (40, 11.0), (20, 14.0), (30, 8.0), (120, 12.0)])
+        self.assertEqual(closed, [(0, 10.0, 14.0, 8.0, 11.0)])
+
+    def test_tick_with_the_same_epoch_sets_the_close(self):
+        series = CandleSeries(60)
+        self.assertEqual(feed(series, [(0, 10.0), (5, 11.0), (5, 10.5), (60, 1.0)]), [(0, 10.0, 11.0, 10.0, 10.5)])
+
+    def test_history_keeps_the_newest_candles_up_to_capacity(self):
+        series = CandleSeries(60, capacity=3)
+        feed(series, [(minute * 60, float(minute)) for minute in range(6)])
+        self.assertEqual([candle[0] for candle in series.history()], [120, 180, 240])
+        self.assertEqual([candle[0] for candle in series.history(limit=2)], [180, 240])
+
+
+if __name__ == "__main__":
+    unittest.main()
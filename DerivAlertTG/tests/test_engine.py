@@ -0,0 +1,45 @@
+import asyncio
+import math
+import unittest
+
+from replay import replay
+from utils import Alert
+
+
+# 1 tick a second for 6 hours, swinging 90..110 around 100 every 20 minutes
+def sine_ticks(instrument="X", hours=6, period=1200):
+    return iter((epoch, instrument, 100 + 10 * math.sin(2 * math.pi * epoch / period))
+                for epoch in range(hours * 3600))
+
+
+def fired_epochs(alerts):
+    fired, _, _ = asyncio.run(replay(alerts, [sine_ticks()]))
+    epochs = {}
+    for epoch, alert, _ in fired:
+        epochs.setdefault(alert.id, []).append(epoch)
+    return epochs
+
+
+class RecurringAlertReplayTest(unittest.TestCase):
+    # Cooldowns run on tick time, so a replay at full speed fires every swing
+    def test_fires_every_crossing_after_moving_back(self):
+        epochs = fired_epochs([Alert(1, "c", "X", "above", 105.0, "m", hysteresis=5, cooldown=60)])
+        self.assertEqual(len(epochs[1]), 18)
+
+    def test_cooldown_limits_notifications(self):
+        epochs = fired_epochs([Alert(1, "c", "X", "above", 105.0, "m", hysteresis=5, cooldown=3600)])
+        self.assertEqual(len(epochs[1]), 6)
+        self.assertTrue(all(later - earlier >= 3600 for earlier, later in zip(epochs[1], epochs[1][1:])))
+
+    def test_no_refire_inside_the_band(self):
+        # The price never falls back to 89, so the alert is never re-armed
+        epochs = fired_epochs([Alert(1, "c", "X", "above", 105.0, "m", hysteresis=16, cooldown=0)])
+        self.assertEqual(len(epochs[1]), 1)
+
+    def test_one_shot_fires_once(self):
+        epochs = fired_epochs([Alert(1, "c", "X", "below", 95.0, "m")])
+        self.assertEqual(len(epochs[1]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import random
+import statistics
+import unittest
+
+from utils import Alert
+from utils.alert_index import ABOVE, BELOW
+from utils.indicators import (MA_CROSS, MOVE, VOLATILITY, InstrumentIndicators, MoveIndicator, MovingAverageCross,
+                              RollingMinMax, RollingWindow, VolatilitySpike)
+
+
+def alert(id, kind, direction, threshold, window):
+    return Alert(id, "c", "X", direction, threshold, "m", kind, window)
+
+
+class RollingWindowTest(unittest.TestCase):
+    def test_matches_the_last_values_across_wraps(self):
+        rng = random.Random(1)
+        window = RollingWindow(20)
+        values = []
+        for i in range(250):
+            value = 1000 + rng.gauss(0, 5)
+            values.append(value)
+            window.push(value)
+            last = values[-20:]
+            self.assertEqual(window.full(), i >= 19)
+            self.assertAlmostEqual(window.mean(), statistics.fmean(last), places=9)
+            if len(last) > 1:
+                self.assertAlmostEqual(window.stdev(), statistics.pstdev(last), places=6)
+
+    def test_empty_and_single_value(self):
+        window = RollingWindow(5)
+        self.assertEqual((window.mean(), window.stdev()), (0.0, 0.0))
+        window.push(3.0)
+        self.assertEqual((window.mean(), window.stdev()), (3.0, 0.0))
+
+
+class RollingMinMaxTest(unittest.TestCase):
+    def test_matches_brute_force_over_the_time_window(self):
+        rng = random.Random(2)
+        window = RollingMinMax(30)
+        ticks = []
+        epoch = 0
+        for _ in range(500):
+            epoch += rng.choice((1, 1, 2, 7))
+            price = rng.uniform(90, 110)
+            ticks.append((epoch, price))
+            window.push(epoch, price)
+            inside = [p for e, p in ticks if e >= epoch - 30]
+            self.assertEqual(window.low(), min(inside))
+            self.assertEqual(window.high(), max(inside))
+
+
+class MoveIndicatorTest(unittest.TestCase):
+    def test_fires_on_a_move_within_the_window_only(self):
+        indicator = MoveIndicator(60)
+        rise, fall = alert(1, MOVE, ABOVE, 2, 60), alert(2, MOVE, BELOW, 2, 60)
+        indicator.add(rise)
+        indicator.add(fall)
+        self.assertEqual(indicator.process(0, 100.0), [])
+        self.assertEqual(indicator.process(30, 101.5), [])
+        self.assertEqual(indicator.process(40, 102.0), [rise])
+        # 102 -> 99.9 is a 2.06% fall, but only once 102 is in the window
+        self.assertEqual(indicator.process(200, 102.0), [])
+        self.assertEqual(indicator.process(210, 99.9), [fall])
+        self.assertEqual(len(indicator), 0)
+
+    def test_old_low_leaves_the_window(self):
+        indicator = MoveIndicator(60)
+        rise = alert(1, MOVE, ABOVE, 2, 60)
+        indicator.add(rise)
+        indicator.process(0, 100.0)
+        indicator.process(61, 101.0)
+        self.assertEqual(indicator.process(62, 102.0), [])  # 100 is older than 60s by now
+
+
+class MovingAverageCrossTest(unittest.TestCase):
+    def test_fires_on_the_crossing_tick(self):
+        indicator = MovingAverageCross(3)
+        up, down = alert(1, MA_CROSS, ABOVE, 0, 3), alert(2, MA_CROSS, BELOW, 0, 3)
+        indicator.add(up)
+        indicator.add(down)
+        fired = [indicator.process(epoch, price) for epoch, price in enumerate([10, 9, 8, 7, 6, 9, 10, 11, 5])]
+        self.assertEqual(fired, [[], [], [], [], [], [up], [], [], [down]])
+
+
+class VolatilitySpikeTest(unittest.TestCase):
+    def test_fires_when_short_volatility_exceeds_the_baseline(self):
+        indicator = VolatilitySpike(5)
+        spike = alert(1, VOLATILITY, ABOVE, 3, 5)
+        indicator.add(spike)
+        fired = []
+        for epoch in range(60):
+            fired += indicator.process(epoch, 100 + 0.01 * (epoch % 2))
+        self.assertEqual(fired, [])
+        for epoch, price in enumerate((101, 99, 101, 99), 60):
+            fired += indicator.process(epoch, price)
+        self.assertEqual(fired, [spike])
+
+
+class InstrumentIndicatorsTest(unittest.TestCase):
+    def test_alerts_with_the_same_window_share_one_indicator(self):
+        indicators = InstrumentIndicators()
+        first, second, other = (alert(1, MOVE, ABOVE, 1, 60), alert(2, MOVE, ABOVE, 5, 60),
+                                alert(3, MOVE, ABOVE, 1, 30))
+        for item in (first, second, other):
+            indicators.add(item)
+        self.assertEqual(len(indicators.indicators), 2)
+        self.assertTrue(indicators.remove(other))
+        self.assertFalse(indicators.remove(other))
+        self.assertEqual(list(indicators.indicators), [(MOVE, 60)])
+        indicators.process(0, 100.0)
+        self.assertEqual(indicators.process(1, 101.0), [first])
+        self.assertEqual(indicators.process(2, 105.0), [second])
+        self.assertEqual(indicators.indicators, {})  # Dropped with its last alert
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import socket
+import unittest
+from unittest import mock
+
+try:
+    import aiosmtpd
+except ImportError:
+    aiosmtpd = None
+
+from utils.mailer import EmailQueue, SmtpConnection
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Against a local aiosmtpd server (bench/fakes.SmtpSink)
+@unittest.skipIf(aiosmtpd is None, "needs aiosmtpd, see requirements-test.txt")
+class EmailQueueSmtpTest(unittest.TestCase):
+    def setUp(self):
+        from bench.fakes import SmtpSink
+        self.port = free_port()
+        self.sink = SmtpSink(port=self.port)
+        self.sink.start()
+
+    def tearDown(self):
+        if self.sink is not None:
+            self.sink.stop()
+
+    def queue(self, **kwargs):
+        return EmailQueue("bench@example.com", None, host="127.0.0.1", port=self.port, use_ssl=False, **kwargs)
+
+    def test_queued_emails_go_out_in_batches_over_one_connection(self):
+        batches = []
+        send_batch = SmtpConnection.send_batch
+
+        def spy(connection, messages):
+            batches.append(len(messages))
+            return send_batch(connection, messages)
+
+        async def scenario():
+            emails = self.queue(batch_size=8)
+            for i in range(20):
+                await emails.send(f"Alert {i}", "body", "user@example.com")
+            emails.start()
+            await emails.stop()
+
+        with mock.patch.object(SmtpConnection, "send_batch", spy):
+            asyncio.run(scenario())
+        self.assertEqual(batches, [8, 8, 4])
+        self.assertEqual(self.sink.received, 20)
+        self.assertEqual(len(self.sink.peers), 1)
+
+    def test_reconnects_after_the_server_drops_the_connection(self):
+        from bench.fakes import SmtpSink
+
+        async def scenario():
+            emails = self.queue()
+            emails.start()
+            first = await emails.send("Before", "body", "user@example.com", wait=True)
+            # The server restarts, closing the connection the worker keeps open
+            await asyncio.to_thread(self.sink.stop)
+            self.sink = SmtpSink(port=self.port)
+            await asyncio.to_thread(self.sink.start)
+            second = await emails.send("After", "body", "user@example.com", wait=True)
+            await emails.stop()
+            return first, second
+
+        self.assertEqual(asyncio.run(scenario()), (True, True))
+        self.assertEqual(self.sink.received, 1)
+
+    def test_unreachable_server_fails_the_email(self):
+        self.sink.stop()
+        self.sink = None
+
+        async def scenario():
+            emails = self.queue()
+            emails.start()
+            sent = await emails.send("Alert", "body", "user@example.com", wait=True)
+            await emails.stop()
+            return sent
+
+        with self.assertLogs("utils.mailer", "ERROR"):
+            self.assertFalse(asyncio.run(scenario()))
+
+
+if __name__ == "__main__":
+    unittest.main()
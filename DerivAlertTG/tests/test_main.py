@@ -0,0 +1,25 @@
+import importlib
+import os
+import sys
+import tempfile
+import unittest
+
+
+class ImportTest(unittest.TestCase):
+    # Spawned engine workers import main again; that must not open the store
+    def test_import_has_no_side_effects(self):
+        workdir = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            sys.modules.pop("main", None)
+            main = importlib.import_module("main")
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(os.listdir(workdir), [])
+        self.assertIsNone(main.user_store)
+        self.assertIsNone(main.tick_hub)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+
+from telegram.error import BadRequest, NetworkError
+
+from bench.fakes import FakeBot
+from utils.notifier import MAX_MESSAGE_LENGTH, TelegramDispatcher, TokenBucket
+
+
+# A bot whose every send fails with `error`
+class FailingBot:
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+async def notify_all(dispatcher, bot, alerts, timeout=5):
+    dispatcher.start(bot)
+    try:
+        return await asyncio.wait_for(asyncio.gather(*(dispatcher.notify(chat_id, text)
+                                                       for chat_id, text in alerts)), timeout)
+    finally:
+        await dispatcher.stop(0)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_starts_full_and_refills_at_rate(self):
+        bucket = TokenBucket(2, capacity=2)
+        now = bucket.updated
+        for _ in range(2):
+            self.assertEqual(bucket.delay(now), 0)
+            bucket.take()
+        self.assertAlmostEqual(bucket.delay(now), 0.5)
+        self.assertEqual(bucket.delay(now + 0.5), 0)
+
+    def test_does_not_fill_past_capacity(self):
+        bucket = TokenBucket(1, capacity=3)
+        bucket.delay(bucket.updated + 3600)
+        self.assertEqual(bucket.tokens, 3)
+
+
+class CoalescingTest(unittest.TestCase):
+    def test_alerts_within_the_window_go_out_together(self):
+        bot = FakeBot()
+        alerts = [(1, "a"), (2, "b"), (1, "c"), (1, "d")]
+        results = asyncio.run(notify_all(TelegramDispatcher(coalesce_window=0.05), bot, alerts))
+        self.assertEqual(results, [True] * 4)
+        texts = {chat_id: text for _, chat_id, text in bot.messages}
+        self.assertEqual(len(bot.messages), 2)
+        self.assertEqual(texts[1], "3 price alerts:\n\na\n\nc\n\nd")
+        self.assertEqual(texts[2], "b")
+
+    def test_merged_message_is_capped_by_count(self):
+        bot = FakeBot()
+        dispatcher = TelegramDispatcher(chat_rate=100, coalesce_window=0.05, max_coalesced=50)
+        results = asyncio.run(notify_all(dispatcher, bot, [(1, f"alert {i}") for i in range(60)]))
+        self.assertEqual(results, [True] * 60)
+        self.assertEqual([text.split(":")[0] for _, _, text in bot.messages], ["50 price alerts", "10 price alerts"])
+
+    def test_merged_message_stays_under_telegram_limit(self):
+        bot = FakeBot()
+        dispatcher = TelegramDispatcher(chat_rate=100, coalesce_window=0.05)
+        results = asyncio.run(notify_all(dispatcher, bot, [(1, "x" * 300) for _ in range(30)]))
+        self.assertEqual(results, [True] * 30)
+        self.assertGreater(len(bot.messages), 1)
+        self.assertTrue(all(len(text) <= 4096 for _, _, text in bot.messages))
+        self.assertLess(MAX_MESSAGE_LENGTH, 4096)
+
+
+class FailureTest(unittest.TestCase):
+    def test_bad_request_is_not_retried(self):
+        bot = FailingBot(BadRequest("Message is too long"))
+        with self.assertLogs("utils.notifier", "ERROR"):
+            results = asyncio.run(notify_all(TelegramDispatcher(coalesce_window=0), bot, [(1, "a")]))
+        self.assertEqual(results, [False])
+        self.assertEqual(bot.calls, 1)
+
+    def test_network_error_is_retried(self):
+        bot = FailingBot(NetworkError("connection reset"))
+        dispatcher = TelegramDispatcher(chat_rate=100, coalesce_window=0, max_attempts=3)
+        with self.assertLogs("utils.notifier", "WARNING"):
+            results = asyncio.run(notify_all(dispatcher, bot, [(1, "a")]))
+        self.assertEqual(results, [False])
+        self.assertEqual(bot.calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+
+from utils import Alert
+from utils.registry import AlertLimitError, AlertRegistry
+
+
+# Records what the registry arms and removes
+class FakeEngine:
+    def __init__(self):
+        self.on_fire = self.on_cancel = None
+        self.armed = []
+
+    async def add_alert(self, instrument, direction, threshold, alert):
+        self.armed.append(alert)
+
+    async def add_alerts(self, alerts, batch_size=50):
+        self.armed.extend(alert for _, _, _, alert in alerts)
+
+    async def remove_alert(self, instrument, direction, threshold, alert):
+        self.armed.remove(alert)
+
+    async def drain(self, timeout):
+        return 0
+
+
+def price_alert(id, chat_id="c", threshold=100.0, **kwargs):
+    return Alert(id, chat_id, "X", "above", threshold, "m", **kwargs)
+
+
+class AlertRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.registry = AlertRegistry(self.engine, max_per_chat=3, max_total=5)
+
+    def add(self, alert):
+        return asyncio.run(self.registry.add(alert))
+
+    def test_identical_alert_is_refused_per_chat(self):
+        first = price_alert(1)
+        self.assertIsNone(self.add(first))
+        self.assertIs(self.add(price_alert(2)), first)
+        self.assertIsNone(self.add(price_alert(2, chat_id="other")))
+        self.assertIsNone(self.add(price_alert(3, threshold=101.0)))
+        self.assertEqual(len(self.engine.armed), 3)
+
+    def test_repeat_settings_are_part_of_the_signature(self):
+        one_shot = price_alert(1)
+        recurring = price_alert(2, hysteresis=5, cooldown=60)
+        self.assertIsNone(self.add(one_shot))
+        self.assertIsNone(self.add(recurring))
+        self.assertIsNone(self.add(price_alert(3, hysteresis=5, cooldown=600)))
+        self.assertIs(self.add(price_alert(4, hysteresis=5, cooldown=60)), recurring)
+
+    def test_alert_can_be_set_again_once_removed(self):
+        first = price_alert(1)
+        self.add(first)
+        self.assertTrue(asyncio.run(self.registry.remove(first)))
+        self.assertFalse(asyncio.run(self.registry.remove(first)))
+        self.assertIsNone(self.add(price_alert(2)))
+
+    def test_per_chat_and_total_caps(self):
+        for i in range(3):
+            self.add(price_alert(i, threshold=100.0 + i))
+        with self.assertRaises(AlertLimitError):
+            self.add(price_alert(3, threshold=200.0))
+        self.add(price_alert(4, chat_id="other", threshold=1.0))
+        self.add(price_alert(5, chat_id="other", threshold=2.0))
+        with self.assertRaises(AlertLimitError):
+            self.add(price_alert(6, chat_id="third"))
+        self.assertEqual(len(self.registry), 5)
+
+    def test_fired_one_shot_alert_frees_its_slot(self):
+        fired = []
+
+        async def on_fire(alert, price, received_at):
+            fired.append(alert)
+
+        self.registry.on_fire = on_fire
+        alerts = [price_alert(i, threshold=100.0 + i) for i in range(3)]
+        for alert in alerts:
+            self.add(alert)
+        asyncio.run(self.engine.on_fire(alerts[0], 101.0, None))
+        asyncio.run(self.engine.on_fire(alerts[0], 101.0, None))  # Already gone: not notified twice
+        self.assertEqual(fired, [alerts[0]])
+        self.assertIsNone(self.add(price_alert(3, threshold=200.0)))
+
+    def test_stored_alerts_skip_caps_but_not_dedup(self):
+        alerts = [price_alert(i, threshold=100.0 + i) for i in range(4)] + [price_alert(9)]
+        armed, duplicates = asyncio.run(self.registry.add_many(alerts))
+        self.assertEqual(armed, 4)
+        self.assertEqual([alert.id for alert in duplicates], [9])
+
+    def test_no_alerts_taken_while_draining(self):
+        asyncio.run(self.registry.drain())
+        with self.assertRaises(AlertLimitError):
+            self.add(price_alert(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utils.storage import JsonFileStore, SqliteStore, open_store
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+
+class GroupCommitTest(StoreTestCase):
+    def stores(self):
+        yield JsonFileStore(self.path("users.json"))
+        yield SqliteStore(self.path("users.db"))
+
+    def test_concurrent_writes_share_one_commit(self):
+        for store in self.stores():
+            with self.subTest(store=type(store).__name__):
+                commits = []
+                commit = store._commit
+                store._commit = lambda batch: (commits.append(sorted(batch)), commit(batch))
+
+                async def scenario():
+                    await asyncio.gather(*(store.upsert(str(i), {"n": i}) for i in range(20)),
+                                         store.delete("5"))
+                    await store.upsert("20", {"n": 20})
+                    return {key: await store.load(key) for key in ("1", "5", "20")}
+
+                self.assertEqual(asyncio.run(scenario()), {"1": {"n": 1}, "5": None, "20": {"n": 20}})
+                self.assertEqual(len(commits), 2)
+                self.assertEqual(len(commits[0]), 20)
+                store.close()
+
+    def test_record_is_copied_when_saved(self):
+        store = SqliteStore(self.path("users.db"))
+        record = {"alerts": []}
+
+        async def scenario():
+            saving = asyncio.ensure_future(store.upsert("1", record))
+            await asyncio.sleep(0)
+            record["alerts"].append("changed after saving")
+            await saving
+            return await store.load("1")
+
+        self.assertEqual(asyncio.run(scenario()), {"alerts": []})
+        store.close()
+
+    def test_commit_task_is_referenced_until_done(self):
+        store = SqliteStore(self.path("users.db"), commit_delay=0)
+
+        async def scenario():
+            saving = asyncio.ensure_future(store.upsert("1", {}))
+            while not store.flush_tasks:
+                await asyncio.sleep(0)
+            await saving
+            await asyncio.sleep(0)
+            return len(store.flush_tasks)
+
+        self.assertEqual(asyncio.run(scenario()), 0)
+        store.close()
+
+    def test_failed_commit_reaches_every_writer(self):
+        store = SqliteStore(self.path("users.db"))
+        store._commit = mock.Mock(side_effect=OSError("disk full"))
+
+        async def scenario():
+            return await asyncio.gather(store.upsert("1", {}), store.upsert("2", {}), return_exceptions=True)
+
+        with self.assertLogs("utils.storage", "ERROR"):
+            results = asyncio.run(scenario())
+        self.assertTrue(all(isinstance(result, OSError) for result in results))
+        store.close()
+
+
+class JsonFileStoreTest(StoreTestCase):
+    def test_crash_while_writing_keeps_the_old_file(self):
+        path = self.path("users.json")
+        store = JsonFileStore(path)
+        asyncio.run(store.upsert("1", {"email": "old@example.com"}))
+        with mock.patch("utils.storage.os.fsync", side_effect=OSError("power cut")):
+            with self.assertLogs("utils.storage", "ERROR"), self.assertRaises(OSError):
+                asyncio.run(store.upsert("1", {"email": "new@example.com"}))
+        with open(path) as f:
+            self.assertEqual(json.load(f), {"1": {"email": "old@example.com"}})
+
+    def test_reload_sees_committed_records(self):
+        path = self.path("users.json")
+        asyncio.run(JsonFileStore(path).upsert("1", {"email": "a@example.com"}))
+        self.assertEqual(JsonFileStore(path).load_all(), {"1": {"email": "a@example.com"}})
+        self.assertFalse(os.path.exists(path + ".tmp"))
+
+
+class MigrationTest(StoreTestCase):
+    def test_json_is_imported_into_an_empty_database_once(self):
+        legacy = self.path("user_data.json")
+        with open(legacy, "w") as f:
+            json.dump({"1": {"email": "a@example.com"}}, f)
+        store = open_store("sqlite", self.path("users.db"), legacy_json_path=legacy)
+        self.assertEqual(store.load_all(), {"1": {"email": "a@example.com"}})
+        self.assertEqual(store.migrate_from_json(legacy), 0)
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
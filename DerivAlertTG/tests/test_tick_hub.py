@@ -0,0 +1,74 @@
+import asyncio
+import json
+import unittest
+
+import websockets
+
+from utils.tick_hub import TickHub
+
+
+def tick_message(epoch, quote, instrument="X"):
+    return {"msg_type": "tick", "tick": {"symbol": instrument, "epoch": epoch, "quote": quote},
+            "subscription": {"id": "s1"}}
+
+
+def broken(*args):
+    raise KeyError("broken")
+
+
+class FanOutIsolationTest(unittest.TestCase):
+    def setUp(self):
+        self.hub = TickHub("ws://unused")
+        self.hub.subscriptions["X"] = "s1"
+
+    def test_failing_subscriber_and_tap_do_not_stop_the_others(self):
+        seen, tapped = [], []
+        self.hub.subscribers["X"] = [broken, seen.append]
+        self.hub.taps = [broken, lambda instrument, tick: tapped.append(tick["epoch"])]
+        with self.assertLogs("utils.tick_hub", "ERROR"):
+            self.hub._dispatch_batch([tick_message(1, 1.0)])
+            self.hub._dispatch_batch([tick_message(2, 2.0)])
+        self.assertEqual([tick["epoch"] for tick in seen], [1, 2])
+        self.assertEqual(tapped, [1, 2])
+
+    def test_undecodable_message_is_skipped(self):
+        messages = [json.dumps(tick_message(1, 1.0)), "{not json", json.dumps(tick_message(2, 2.0))]
+        with self.assertLogs("utils.tick_hub", "ERROR"):
+            decoded = self.hub._decode(messages)
+        self.assertEqual([data["tick"]["epoch"] for data in decoded], [1, 2])
+        self.assertEqual(self.hub.stats["undecodable"], 1)
+
+
+class SupervisorRestartTest(unittest.TestCase):
+    # An unexpected error while handling messages drops the connection and
+    # the supervisor connects again instead of dying
+    def test_reconnects_after_unexpected_error(self):
+        async def scenario():
+            connections = []
+
+            async def handler(websocket, *args):
+                connections.append(websocket)
+                await websocket.send(json.dumps({"msg_type": "ping"}))
+                await websocket.wait_closed()
+
+            async with websockets.serve(handler, "127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                hub = TickHub(f"ws://127.0.0.1:{port}", min_backoff=0.01, max_backoff=0.01)
+                hub._dispatch_batch = broken
+                hub._start()
+                try:
+                    for _ in range(200):
+                        if len(connections) >= 2:
+                            break
+                        await asyncio.sleep(0.01)
+                    self.assertFalse(hub.supervisor_task.done())
+                finally:
+                    await hub.close()
+            return len(connections)
+
+        with self.assertLogs("utils.tick_hub", "ERROR"):
+            self.assertGreaterEqual(asyncio.run(scenario()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
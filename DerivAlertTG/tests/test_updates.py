@@ -0,0 +1,64 @@
+import asyncio
+import random
+import unittest
+
+from telegram import Update
+
+from utils.updates import ChatOrderedUpdateProcessor
+
+
+def message_update(update_id, chat_id):
+    return Update.de_json({"update_id": update_id,
+                           "message": {"message_id": update_id, "date": 0, "text": "x",
+                                       "chat": {"id": chat_id, "type": "private"}}}, None)
+
+
+class ChatOrderedUpdateProcessorTest(unittest.TestCase):
+    def test_each_chat_in_order_chats_concurrently(self):
+        rng = random.Random(3)
+        handled = {}  # chat_id -> update ids in the order they were handled
+        running = {"now": 0, "max": 0, "per_chat": {}}
+
+        async def handle(update):
+            chat_id = update.effective_chat.id
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            running["per_chat"][chat_id] = running["per_chat"].get(chat_id, 0) + 1
+            self.assertEqual(running["per_chat"][chat_id], 1)
+            await asyncio.sleep(rng.uniform(0, 0.005))
+            handled.setdefault(chat_id, []).append(update.update_id)
+            running["per_chat"][chat_id] -= 1
+            running["now"] -= 1
+
+        async def scenario():
+            processor = ChatOrderedUpdateProcessor(workers=4)
+            await processor.initialize()
+            updates = [message_update(update_id, rng.randrange(8)) for update_id in range(200)]
+            await asyncio.gather(*(processor.do_process_update(update, handle(update)) for update in updates))
+            return processor, updates
+
+        processor, updates = asyncio.run(scenario())
+        for chat_id, update_ids in handled.items():
+            self.assertEqual(update_ids, [update.update_id for update in updates
+                                          if update.effective_chat.id == chat_id])
+        self.assertGreater(running["max"], 1)
+        self.assertLessEqual(running["max"], 4)
+        self.assertEqual(processor.chats, {})  # Locks of idle chats are dropped
+
+    def test_update_without_chat_still_runs(self):
+        async def scenario():
+            processor = ChatOrderedUpdateProcessor(workers=1)
+            await processor.initialize()
+            done = []
+
+            async def handle():
+                done.append(True)
+
+            await processor.do_process_update(Update.de_json({"update_id": 1}, None), handle())
+            return done
+
+        self.assertEqual(asyncio.run(scenario()), [True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import asyncio
+import unittest
+
+from utils import Alert, user_to_record
+from utils.users import USER_BYTES, UserCache
+
+
+# Records in a dict, counting loads
+class DictStore:
+    def __init__(self, records=None):
+        self.records = records or {}
+        self.loads = 0
+
+    def items(self):
+        return iter(self.records.items())
+
+    async def load(self, key):
+        self.loads += 1
+        return self.records.get(key)
+
+
+def record(chat_id, alerts=0):
+    user = {"chat_id": chat_id, "email": None, "webhook": None, "next_alert_id": alerts + 1,
+            "alerts": {i: Alert(i, chat_id, "X", "above", 100.0, "m") for i in range(1, alerts + 1)}}
+    return user_to_record(user)
+
+
+class UserCacheTest(unittest.TestCase):
+    def test_only_users_with_alerts_are_loaded_at_start(self):
+        store = DictStore({"1": record("1", alerts=2), "2": record("2")})
+        users = UserCache(store)
+        self.assertEqual(users.load_pinned(), 1)
+        self.assertEqual([user["chat_id"] for user in users.with_alerts()], ["1"])
+        self.assertIsNone(users.resident("2"))
+
+    def test_least_recently_used_is_evicted_first(self):
+        store = DictStore({str(i): record(str(i)) for i in range(4)})
+        users = UserCache(store, max_bytes=3 * USER_BYTES)
+
+        async def scenario():
+            for chat_id in ("0", "1", "2"):
+                await users.get(chat_id)
+            await users.get("0")  # Now the most recently used
+            await users.get("3")
+
+        asyncio.run(scenario())
+        self.assertEqual(list(users.recent), ["2", "0", "3"])
+        self.assertEqual(users.stats["evictions"], 1)
+        self.assertEqual(users.recent_bytes, 3 * USER_BYTES)
+
+    def test_users_with_alerts_are_never_evicted(self):
+        store = DictStore({str(i): record(str(i)) for i in range(10)})
+        users = UserCache(store, max_bytes=USER_BYTES)
+
+        async def scenario():
+            user = await users.get("0")
+            user["alerts"][1] = Alert(1, "0", "X", "above", 100.0, "m")
+            users.update(user)
+            for i in range(1, 10):
+                await users.get(str(i))
+
+        asyncio.run(scenario())
+        self.assertIn("0", users.pinned)
+        self.assertEqual(list(users.recent), ["9"])
+
+    def test_alert_added_without_update_is_pinned_on_eviction(self):
+        store = DictStore({str(i): record(str(i)) for i in range(3)})
+        users = UserCache(store, max_bytes=2 * USER_BYTES)
+
+        async def scenario():
+            user = await users.get("0")
+            user["alerts"][1] = Alert(1, "0", "X", "above", 100.0, "m")
+            await users.get("1")
+            await users.get("2")
+
+        asyncio.run(scenario())
+        self.assertIn("0", users.pinned)
+        self.assertEqual(users.stats["evictions"], 0)
+
+    def test_resident_users_are_not_loaded_again(self):
+        store = DictStore({"1": record("1")})
+        users = UserCache(store)
+
+        async def scenario():
+            return [await users.get("1") for _ in range(3)] + [await users.get("unknown")]
+
+        first, second, third, unknown = asyncio.run(scenario())
+        self.assertIs(first, third)
+        self.assertIsNone(unknown)
+        self.assertEqual(store.loads, 2)
+        self.assertEqual(users.stats, {"hits": 2, "misses": 2, "evictions": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,20 @@
+from .tick_hub import TickHub
+from .alert_index import AlertIndex, ABOVE, BELOW
+from .engine import AlertEngine
+from .mailer import EmailQueue
+from .storage import UserStore, JsonFileStore, SqliteStore, open_store
+from .models import Alert, user_from_record, user_to_record
+from .metrics import MetricsServer, Registry, registry
+from .notifier import TelegramDispatcher, TokenBucket
+from .sharding import ShardedEngine
+from .updates import ChatOrderedUpdateProcessor, WebhookServer
+from .indicators import PRICE, MOVE, MA_CROSS, VOLATILITY, CANDLE_CLOSE, KINDS, InstrumentIndicators
+from .candles import CandleSeries, TIMEFRAMES
+from .archive import TickRecorder, TickArchive, TickFile
+from .registry import AlertRegistry, AlertLimitError
+from .catalog import InstrumentCatalog, Instrument
+from .quotes import QuoteCache, QuoteUnavailable
+from .users import UserCache
+from .codec import load_codec
+from .diagnostics import LoopDiagnostics, SamplingProfiler
+from .channels import NotificationFanout, Notification, TelegramSink, EmailSink, WebhookSink, InvalidWebhook, CHANNELS
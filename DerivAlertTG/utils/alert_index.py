@@ -0,0 +1,67 @@
+from bisect import bisect_left, bisect_right
+
+ABOVE = "above"
+BELOW = "below"
+
+
+# Alerts for one instrument kept sorted by threshold, one list per direction.
+# "above" alerts fire once the price is at or over their level and "below"
+# alerts once it is at or under it, so a tick only has to bisect each list and
+# cut off the crossed end: O(log n + k) for k fired alerts. Because the check
+# is against the level rather than for an exact hit, a price that gaps straight
+# past a level between two ticks still fires it.
+class AlertIndex:
+    def __init__(self):
+        self.above_levels = []
+        self.above_alerts = []
+        self.below_levels = []
+        self.below_alerts = []
+
+    def __len__(self):
+        return len(self.above_alerts) + len(self.below_alerts)
+
+    def alerts(self):
+        return self.above_alerts + self.below_alerts
+
+    def _lists(self, direction):
+        if direction == ABOVE:
+            return self.above_levels, self.above_alerts
+        if direction == BELOW:
+            return self.below_levels, self.below_alerts
+        raise ValueError(f"Unknown alert direction: {direction}")
+
+    def add(self, threshold, direction, alert):
+        levels, alerts = self._lists(direction)
+        position = bisect_right(levels, threshold)
+        levels.insert(position, threshold)
+        alerts.insert(position, alert)
+
+    def remove(self, threshold, direction, alert):
+        levels, alerts = self._lists(direction)
+        position = bisect_left(levels, threshold)
+        while position < len(levels) and levels[position] == threshold:
+            if alerts[position] is alert:
+                del levels[position]
+                del alerts[position]
+                return True
+            position += 1
+        return False
+
+    # Fire and remove every alert crossed by a single price
+    def process(self, price):
+        return self.process_range(price, price)
+
+    # Fire and remove every alert crossed anywhere inside [low, high]
+    def process_range(self, low, high):
+        fired = []
+        if self.above_levels and self.above_levels[0] <= high:
+            position = bisect_right(self.above_levels, high)
+            fired.extend(self.above_alerts[:position])
+            del self.above_levels[:position]
+            del self.above_alerts[:position]
+        if self.below_levels and self.below_levels[-1] >= low:
+            position = bisect_left(self.below_levels, low)
+            fired.extend(self.below_alerts[position:])
+            del self.below_levels[position:]
+            del self.below_alerts[position:]
+        return fired
@@ -0,0 +1,253 @@
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, and no forked engine workers sharing files either
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# One tick on disk: epoch (int64) and quote (float64), little-endian, 16 bytes.
+# Files hold one instrument for one UTC day, in epoch order:
+#   <root>/<YYYY-MM-DD>/<instrument>.ticks
+# and next to each, <instrument>.idx: 1440 int64 record numbers, the first
+# tick of every minute of the day (-1 for minutes with no tick yet).
+RECORD = struct.Struct("<qd")
+MINUTES = 1440
+NUMPY_DTYPE = [("epoch", "<i8"), ("quote", "<f8")]
+
+
+def _day(epoch):
+    return time.strftime("%Y-%m-%d", time.gmtime(epoch))
+
+
+def _paths(root, day, instrument):
+    base = os.path.join(root, day, instrument)
+    return base + ".ticks", base + ".idx"
+
+
+# Appends every tick it is given to the archive. Ticks are buffered and
+# written every flush_interval seconds in a worker thread; each buffer is
+# sorted first, so backfilled ticks that arrive shortly after the gap they
+# fill still land in order. A tick older than the last one in its file is
+# dropped rather than break the ordering. The file and its index are re-read
+# before every append, under an exclusive lock on the file, since sharded
+# engines hand instruments between processes and the old and new owner may
+# both be writing to it around the handover.
+class TickRecorder:
+    def __init__(self, root, flush_interval=5):
+        self.root = root
+        self.flush_interval = flush_interval
+        self.buffers = {}  # instrument -> [(epoch, quote)]
+        self.flush_task = None
+        self.flush_lock = asyncio.Lock()
+        self.stats = {"written": 0, "dropped": 0}
+
+    # Hub tap: called with every tick the bot receives
+    def record(self, instrument, tick):
+        buffer = self.buffers.get(instrument)
+        if buffer is None:
+            buffer = self.buffers[instrument] = []
+        buffer.append((int(tick["epoch"]), float(tick["quote"])))
+
+    def start(self):
+        self.flush_task = asyncio.create_task(self._flush_periodically(), name="tick-recorder")
+
+    async def stop(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+            self.flush_task = None
+        await self.flush()
+
+    # Write the buffered ticks, of every instrument or only the given ones
+    async def flush(self, instruments=None):
+        if instruments is None:
+            buffers, self.buffers = self.buffers, {}
+        else:
+            buffers = {instrument: self.buffers.pop(instrument) for instrument in instruments
+                       if instrument in self.buffers}
+        if not buffers:
+            return
+        async with self.flush_lock:
+            try:
+                await asyncio.to_thread(self._write, buffers)
+            except OSError as e:
+                logger.error(f"Failed to write tick archive: {e}")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _write(self, buffers):
+        for instrument, ticks in buffers.items():
+            ticks.sort()
+            by_day = {}
+            for epoch, quote in ticks:
+                by_day.setdefault(_day(epoch), []).append((epoch, quote))
+            for day, day_ticks in by_day.items():
+                self._append(day, instrument, day_ticks)
+
+    def _append(self, day, instrument, ticks):
+        ticks_path, index_path = _paths(self.root, day, instrument)
+        os.makedirs(os.path.dirname(ticks_path), exist_ok=True)
+        with open(ticks_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file is closed
+            count = f.seek(0, os.SEEK_END) // RECORD.size
+            if count:
+                f.seek((count - 1) * RECORD.size)
+                last = RECORD.unpack(f.read(RECORD.size))[0]
+                start = bisect.bisect_right(ticks, (last, float("inf")))
+                self.stats["dropped"] += start
+                ticks = ticks[start:]
+            if not ticks:
+                return
+            index = array("q")
+            if os.path.exists(index_path):
+                with open(index_path, "rb") as index_file:
+                    index.frombytes(index_file.read())
+            if len(index) != MINUTES:
+                index = array("q", [-1]) * MINUTES
+            data = bytearray(RECORD.size * len(ticks))
+            for offset, (epoch, quote) in enumerate(ticks):
+                RECORD.pack_into(data, offset * RECORD.size, epoch, quote)
+                minute = epoch % 86400 // 60
+                if index[minute] < 0:
+                    index[minute] = count + offset
+            f.truncate(count * RECORD.size)  # Drop a partial record left by a crash
+            f.write(data)
+            f.flush()
+            temp_path = f"{index_path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as index_file:
+                index_file.write(index.tobytes())
+            os.replace(temp_path, index_path)
+        self.stats["written"] += len(ticks)
+
+
+# Ticks of one instrument and day, memory-mapped. epochs and quotes are
+# NumPy arrays when NumPy is installed and strided memoryviews otherwise;
+# either way no Python object is created per tick until one is read.
+class TickFile:
+    def __init__(self, ticks_path, index_path):
+        self.file = open(ticks_path, "rb")
+        size = os.fstat(self.file.fileno()).st_size // RECORD.size * RECORD.size
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        self.count = size // RECORD.size
+        self.index = array("q")
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                self.index.frombytes(f.read())
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if self.map is None:
+            self.records = None
+            self.epochs = self.quotes = ()
+        elif numpy is not None:
+            self.records = numpy.frombuffer(self.map, dtype=NUMPY_DTYPE)
+            self.epochs = self.records["epoch"]
+            self.quotes = self.records["quote"]
+        else:
+            view = memoryview(self.map)
+            self.records = None
+            self.epochs = view.cast("q")[0::2]
+            self.quotes = view.cast("d")[1::2]
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Views into the map must be released before it can be closed
+        self.records = None
+        self.epochs = self.quotes = ()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # A caller still holds a slice; the map closes when it is freed
+            self.map = None
+        self.file.close()
+
+    # Record range [first, last) holding epochs in [start, end], narrowed
+    # with the minute index and then a binary search inside those minutes.
+    # Bounds outside the file's UTC day take the whole file on that side.
+    def span(self, start=None, end=None):
+        first, last = 0, self.count
+        if not self.count:
+            return 0, 0
+        day_start = int(self.epochs[0]) // 86400 * 86400
+        if start is not None and start > day_start:
+            if start >= day_start + 86400:
+                return self.count, self.count
+            first = bisect.bisect_left(self.epochs, start, self._minute_floor(start), last)
+        if end is not None and end < day_start + 86400:
+            if end < day_start:
+                return first, first
+            last = bisect.bisect_right(self.epochs, end, first, max(first, self._minute_ceiling(end)))
+        return first, max(first, last)
+
+    def _minute_floor(self, epoch):
+        if len(self.index) != MINUTES:
+            return 0
+        minute = epoch % 86400 // 60
+        for position in range(minute, -1, -1):
+            if self.index[position] >= 0:
+                return min(self.index[position], self.count)
+        return 0
+
+    def _minute_ceiling(self, epoch):
+        if len(self.index) != MINUTES:
+            return self.count
+        minute = epoch % 86400 // 60
+        for position in range(minute + 1, MINUTES):
+            if self.index[position] >= 0:
+                return min(self.index[position], self.count)
+        return self.count
+
+
+# Read side of the archive
+class TickArchive:
+    def __init__(self, root):
+        self.root = root
+
+    def days(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def instruments(self, day):
+        directory = os.path.join(self.root, day)
+        return sorted(name[:-len(".ticks")] for name in os.listdir(directory) if name.endswith(".ticks"))
+
+    def open(self, instrument, day):
+        ticks_path, index_path = _paths(self.root, day, instrument)
+        return TickFile(ticks_path, index_path)
+
+    # Yield (epoch, quote) for an instrument between two epochs, day by day
+    def iter_ticks(self, instrument, start=None, end=None):
+        for day in self.days():
+            if start is not None and day < _day(start) or end is not None and day > _day(end):
+                continue
+            ticks_path, _ = _paths(self.root, day, instrument)
+            if not os.path.exists(ticks_path):
+                continue
+            with self.open(instrument, day) as ticks:
+                first, last = ticks.span(start, end)
+                for position in range(first, last):
+                    yield int(ticks.epochs[position]), float(ticks.quotes[position])
@@ -0,0 +1,73 @@
+from array import array
+
+# Candle timeframes users can pick, in seconds
+TIMEFRAMES = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600}
+
+
+# OHLC candles of one instrument and timeframe, built incrementally from
+# ticks. Closed candles are kept in fixed-size array-backed rings (one flat
+# array per field) rather than per-candle objects, so history costs 40 bytes
+# a candle. A candle closes on the first tick of the next period. A late tick
+# (e.g. a backfill) can still widen the open candle's high and low, but only
+# the newest tick sets its close.
+class CandleSeries:
+    __slots__ = ("timeframe", "capacity", "starts", "opens", "highs", "lows", "closes",
+                 "position", "count", "start", "open", "high", "low", "close", "epoch")
+
+    def __init__(self, timeframe, capacity=500):
+        self.timeframe = timeframe
+        self.capacity = capacity
+        self.starts = array("q", bytes(8 * capacity))
+        self.opens = array("d", bytes(8 * capacity))
+        self.highs = array("d", bytes(8 * capacity))
+        self.lows = array("d", bytes(8 * capacity))
+        self.closes = array("d", bytes(8 * capacity))
+        self.position = 0  # slot the next closed candle goes to
+        self.count = 0
+        self.start = None  # open candle, if any
+        self.open = self.high = self.low = self.close = 0.0
+        self.epoch = None  # newest tick in the open candle
+
+    def __len__(self):
+        return self.count
+
+    # Add a tick; returns the candle it closed as (start, open, high, low, close)
+    def update(self, epoch, price):
+        start = epoch - epoch % self.timeframe
+        if start == self.start:
+            if price > self.high:
+                self.high = price
+            elif price < self.low:
+                self.low = price
+            if epoch >= self.epoch:
+                self.epoch = epoch
+                self.close = price
+            return None
+        if self.start is not None and start < self.start:
+            return None  # Late tick from an already closed period, e.g. a backfill
+        closed = self._close()
+        self.start = start
+        self.epoch = epoch
+        self.open = self.high = self.low = self.close = price
+        return closed
+
+    def _close(self):
+        if self.start is None:
+            return None
+        slot = self.position
+        self.starts[slot] = self.start
+        self.opens[slot] = self.open
+        self.highs[slot] = self.high
+        self.lows[slot] = self.low
+        self.closes[slot] = self.close
+        self.position = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return self.start, self.open, self.high, self.low, self.close
+
+    # The closed candles, oldest first
+    def history(self, limit=None):
+        count = self.count if limit is None else min(limit, self.count)
+        first = (self.position - count) % self.capacity
+        slots = [(first + offset) % self.capacity for offset in range(count)]
+        return [(self.starts[slot], self.opens[slot], self.highs[slot], self.lows[slot], self.closes[slot])
+                for slot in slots]
@@ -0,0 +1,154 @@
+import asyncio
+import difflib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# One tradable Deriv symbol, as reported by active_symbols
+class Instrument:
+    __slots__ = ("symbol", "display_name", "market", "submarket", "is_open", "pip")
+
+    def __init__(self, symbol, display_name, market, submarket, is_open, pip):
+        self.symbol = symbol
+        self.display_name = display_name
+        self.market = market
+        self.submarket = submarket
+        self.is_open = is_open
+        self.pip = pip
+
+    def __repr__(self):
+        return f"Instrument({self.symbol})"
+
+    @classmethod
+    def from_active_symbol(cls, data):
+        return cls(data["symbol"], data.get("display_name", data["symbol"]), data.get("market_display_name", ""),
+                   data.get("submarket_display_name", ""),
+                   bool(data.get("exchange_is_open")) and not data.get("is_trading_suspended"),
+                   float(data.get("pip", 0.01)))
+
+    def to_dict(self):
+        return {"symbol": self.symbol, "display_name": self.display_name, "market": self.market,
+                "submarket": self.submarket, "is_open": self.is_open, "pip": self.pip}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["symbol"], data["display_name"], data["market"], data["submarket"], data["is_open"],
+                   data["pip"])
+
+    # Digits after the decimal point in a quote, from the pip size
+    def decimals(self):
+        text = f"{self.pip:.10f}".rstrip("0")
+        return len(text.split(".")[1]) if "." in text else 0
+
+    def format(self, price):
+        return f"{price:.{self.decimals()}f}"
+
+
+def _key(text):
+    return "".join(text.split()).strip("'\"").upper()
+
+
+# Every symbol Deriv offers, from one active_symbols request over the shared
+# TickHub connection. The list is kept in memory and in a JSON file, so a
+# restart within ttl seconds needs no request at all, and is refreshed in the
+# background every ttl seconds since market open/closed status changes.
+class InstrumentCatalog:
+    def __init__(self, hub, path=None, ttl=3600, retry_interval=60):
+        self.hub = hub
+        self.path = path
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.instruments = {}  # symbol -> Instrument
+        self.names = {}  # normalized symbol or display name -> Instrument
+        self.fetched_at = 0
+        self.refresh_task = None
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def stale(self):
+        return time.time() - self.fetched_at >= self.ttl
+
+    def start(self):
+        self.load()
+        self.refresh_task = asyncio.create_task(self._refresh_periodically(), name="instrument-catalog")
+
+    async def stop(self):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            await asyncio.gather(self.refresh_task, return_exceptions=True)
+            self.refresh_task = None
+
+    # Take the cached list from disk, however old; the refresh replaces it
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self._replace([Instrument.from_dict(item) for item in data["instruments"]], data["fetched_at"])
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring instrument cache {self.path}: {e}")
+
+    async def refresh(self):
+        response = await self.hub.request({"active_symbols": "brief", "product_type": "basic"})
+        if "error" in response:
+            raise ConnectionError(response["error"].get("message"))
+        self._replace([Instrument.from_active_symbol(item) for item in response["active_symbols"]], time.time())
+        if self.path:
+            try:
+                await asyncio.to_thread(self._save)
+            except OSError as e:
+                logger.error(f"Failed to write instrument cache {self.path}: {e}")
+        logger.info(f"Loaded {len(self.instruments)} instruments from Deriv")
+
+    # Find an instrument by symbol or display name, ignoring case and spaces
+    def lookup(self, text):
+        return self.names.get(_key(text))
+
+    def suggestions(self, text, limit=3):
+        matches = difflib.get_close_matches(_key(text), list(self.names), n=limit * 2, cutoff=0.6)
+        symbols = []
+        for match in matches:
+            symbol = self.names[match].symbol
+            if symbol not in symbols:
+                symbols.append(symbol)
+        return symbols[:limit]
+
+    # Open instruments grouped by market and submarket, in display order
+    def open_instruments(self):
+        return sorted((instrument for instrument in self.instruments.values() if instrument.is_open),
+                      key=lambda instrument: (instrument.market, instrument.submarket, instrument.display_name))
+
+    def _replace(self, instruments, fetched_at):
+        self.instruments = {instrument.symbol: instrument for instrument in instruments}
+        names = {}
+        for instrument in instruments:
+            names[_key(instrument.display_name)] = instrument
+        for instrument in instruments:
+            names[_key(instrument.symbol)] = instrument
+        self.names = names
+        self.fetched_at = fetched_at
+
+    def _save(self):
+        data = {"fetched_at": self.fetched_at,
+                "instruments": [instrument.to_dict() for instrument in self.instruments.values()]}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    async def _refresh_periodically(self):
+        while True:
+            if self.stale():
+                try:
+                    await self.refresh()
+                except (ConnectionError, asyncio.TimeoutError, KeyError) as e:
+                    logger.warning(f"Failed to load instruments from Deriv: {e}")
+                    await asyncio.sleep(self.retry_interval)
+                    continue
+            await asyncio.sleep(max(1, self.fetched_at + self.ttl - time.time()))
@@ -0,0 +1,297 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from collections import deque
+from urllib.parse import urlsplit
+import httpx
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Where a fired alert can be delivered
+TELEGRAM = "telegram"
+EMAIL = "email"
+WEBHOOK = "webhook"
+CHANNELS = (TELEGRAM, EMAIL, WEBHOOK)
+
+# Outcome of one delivery
+DELIVERED = "delivered"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+DELIVERY_SECONDS = registry.histogram("notification_delivery_seconds",
+                                      "Time to deliver an alert notification, retries included, by channel",
+                                      ["channel"])
+DELIVERIES = registry.counter("notification_deliveries_total", "Alert notifications by channel and outcome",
+                              ["channel", "result"])
+DELIVERY_RETRIES = registry.counter("notification_retries_total", "Alert notification attempts that were retried",
+                                    ["channel"])
+
+
+# Raised by a sink when a delivery failed; retry=False when trying again
+# cannot help, e.g. the receiver refused the request
+class DeliveryError(Exception):
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+# One fired alert on its way to the user: the texts are rendered once and
+# shared by every channel
+class Notification:
+    __slots__ = ("alert", "price", "user", "received_at", "text", "subject", "body")
+
+    def __init__(self, alert, price, user, received_at, text, subject, body):
+        self.alert = alert
+        self.price = price
+        self.user = user
+        self.received_at = received_at  # perf_counter time of the tick, or None
+        self.text = text
+        self.subject = subject
+        self.body = body
+
+
+# A delivery channel. deliver() runs send() with a deadline per attempt and
+# retries with a growing delay up to `attempts` times. It never raises, so a
+# slow or broken channel cannot hold up or break the others.
+class Sink:
+    name = None
+
+    def __init__(self, timeout=10, attempts=1, retry_delay=1):
+        self.timeout = timeout
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.stats = {DELIVERED: 0, FAILED: 0, TIMEOUT: 0, "retries": 0}
+        self.latencies = deque(maxlen=1000)  # seconds, of the latest deliveries
+
+    # Whether the user has this channel set up
+    def applies(self, notification):
+        return True
+
+    async def send(self, notification):
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def deliver(self, notification):
+        started = time.perf_counter()
+        error = None
+        for attempt in range(1, self.attempts + 1):
+            if attempt > 1:
+                self.stats["retries"] += 1
+                DELIVERY_RETRIES.labels(self.name).inc()
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 2))
+            try:
+                await asyncio.wait_for(self.send(notification), self.timeout)
+            except asyncio.TimeoutError:
+                error = None
+                continue
+            except DeliveryError as e:
+                error = e
+                if not e.retry:
+                    break
+                continue
+            except Exception as e:
+                logger.exception(f"{self.name} delivery of alert #{notification.alert.id} failed")
+                error = e
+                continue
+            return self._record(DELIVERED, started)
+        alert = notification.alert
+        reason = error or f"no answer within {self.timeout}s"
+        logger.warning(f"Could not deliver alert #{alert.id} to chat {alert.chat_id} by {self.name}: {reason}")
+        return self._record(TIMEOUT if error is None else FAILED, started)
+
+    def _record(self, result, started):
+        self.stats[result] += 1
+        DELIVERIES.labels(self.name, result).inc()
+        if result == DELIVERED:
+            elapsed = time.perf_counter() - started
+            self.latencies.append(elapsed)
+            DELIVERY_SECONDS.labels(self.name).observe(elapsed)
+        return result
+
+
+# Telegram messages through the rate-limited dispatcher, which already waits
+# out flood limits. A timed-out message may still go out later, so it is not
+# retried by default.
+class TelegramSink(Sink):
+    name = TELEGRAM
+
+    def __init__(self, notifier, timeout=60, attempts=1, retry_delay=1):
+        super().__init__(timeout, attempts, retry_delay)
+        self.notifier = notifier
+
+    async def send(self, notification):
+        if not await self.notifier.notify(notification.alert.chat_id, notification.text, notification.received_at):
+            raise DeliveryError("Telegram refused the message", retry=False)
+
+
+# Emails through the SMTP queue, for users who set an address
+class EmailSink(Sink):
+    name = EMAIL
+
+    def __init__(self, email_queue, timeout=60, attempts=1, retry_delay=5):
+        super().__init__(timeout, attempts, retry_delay)
+        self.email_queue = email_queue
+
+    def applies(self, notification):
+        return bool(notification.user["email"])
+
+    async def send(self, notification):
+        sent = await self.email_queue.send(notification.subject, notification.body, notification.user["email"],
+                                           notification.received_at, wait=True)
+        if not sent:
+            raise DeliveryError("the SMTP server did not accept it")
+
+
+# Raised for webhook URLs the bot will not call
+class InvalidWebhook(ValueError):
+    pass
+
+
+# Whether an address is on the public internet, including IPv4 written as IPv6
+def _is_public(address):
+    address = ipaddress.ip_address(address.split("%")[0])
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global
+
+
+# JSON POSTs to the user's own URL, for users who set one. Every webhook
+# shares one pooled HTTP client, so connections to the same host are reused.
+# Connection errors, 429 and 5xx answers are retried; other 4xx are not.
+#
+# Unless allow_private, the host is resolved before every request and refused
+# if any of its addresses is loopback or private; the request then goes to the
+# address that was checked (with the original Host header and TLS server
+# name), so neither numeric spellings like 127.1 nor a DNS answer that changes
+# between the check and the connection can reach internal services.
+class WebhookSink(Sink):
+    name = WEBHOOK
+
+    def __init__(self, timeout=5, attempts=3, retry_delay=1, max_connections=100, allow_private=False):
+        super().__init__(timeout, attempts, retry_delay)
+        self.max_connections = max_connections
+        self.allow_private = allow_private
+        self.client = None
+
+    # Refuse URLs that are not http(s), and unless allow_private, hosts that
+    # are obviously this machine or a private network. Names are only checked
+    # when sending, as what they resolve to can change.
+    def validate(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise InvalidWebhook("The webhook must be an http:// or https:// URL")
+        if self.allow_private:
+            return url
+        if parts.hostname == "localhost" or parts.hostname.endswith(".localhost"):
+            raise InvalidWebhook("The webhook cannot point at this server")
+        try:
+            address = socket.inet_ntoa(socket.inet_aton(parts.hostname))  # Also reads 127.1, 0x7f000001...
+        except OSError:
+            address = parts.hostname
+        try:
+            public = _is_public(address)
+        except ValueError:
+            return url
+        if not public:
+            raise InvalidWebhook("The webhook cannot point at a private address")
+        return url
+
+    def applies(self, notification):
+        return bool(notification.user["webhook"])
+
+    async def start(self):
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        self.client = httpx.AsyncClient(limits=limits, timeout=self.timeout, follow_redirects=False, trust_env=False)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    @staticmethod
+    def payload(notification):
+        alert = notification.alert
+        return {"chat_id": alert.chat_id, "alert_id": alert.id, "instrument": alert.instrument,
+                "kind": alert.kind, "direction": alert.direction, "threshold": alert.threshold,
+                "condition": alert.condition(), "message": alert.message, "price": notification.price,
+                "time": time.time(), "text": notification.text}
+
+    # The checked address to connect to, or None to let the client resolve
+    async def _public_address(self, url):
+        if self.allow_private:
+            return None
+        port = url.port or (443 if url.scheme == "https" else 80)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(url.host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise DeliveryError(f"cannot resolve {url.host}: {e}") from e
+        addresses = [info[4][0] for info in infos]
+        if not addresses or not all(_is_public(address) for address in addresses):
+            raise DeliveryError(f"{url.host} resolves to a private address", retry=False)
+        return addresses[0]
+
+    async def send(self, notification):
+        url = httpx.URL(notification.user["webhook"])
+        headers = {}
+        extensions = {}
+        address = await self._public_address(url)
+        if address is not None:
+            headers["Host"] = url.netloc.decode("ascii")
+            if url.scheme == "https":
+                extensions["sni_hostname"] = url.host
+            url = url.copy_with(host=address)
+        try:
+            response = await self.client.post(url, json=self.payload(notification), headers=headers,
+                                              extensions=extensions)
+        except httpx.TransportError as e:
+            raise DeliveryError(f"{type(e).__name__}: {e}") from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise DeliveryError(f"HTTP {response.status_code}")
+        if response.status_code >= 300:
+            raise DeliveryError(f"HTTP {response.status_code}", retry=False)
+
+
+# Sends each fired alert on all of its channels at once. A channel the user
+# has not set up is skipped; if that leaves none, Telegram is used so an alert
+# is never silently lost.
+class NotificationFanout:
+    def __init__(self, sinks):
+        self.sinks = {sink.name: sink for sink in sinks}  # channel -> sink
+
+    async def start(self):
+        for sink in self.sinks.values():
+            await sink.start()
+
+    async def close(self):
+        for sink in self.sinks.values():
+            await sink.close()
+
+    # Deliver on the chosen channels (None for all) and return channel -> result
+    async def notify(self, notification, channels=None):
+        sinks = [sink for name, sink in self.sinks.items()
+                 if (channels is None or name in channels) and sink.applies(notification)]
+        if not sinks and TELEGRAM in self.sinks:
+            sinks = [self.sinks[TELEGRAM]]
+        results = await asyncio.gather(*(sink.deliver(notification) for sink in sinks))
+        return {sink.name: result for sink, result in zip(sinks, results)}
+
+    # Per-channel delivery counts and latencies, for operators
+    def report(self):
+        lines = []
+        for name, sink in self.sinks.items():
+            lines.append(f"{name}: " + ", ".join(f"{key} {value}" for key, value in sink.stats.items()))
+            latencies = sorted(sink.latencies)
+            if latencies:
+                p50 = latencies[len(latencies) // 2]
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                lines.append(f"  latest {len(latencies)}: p50 {p50 * 1000:.0f}ms, p99 {p99 * 1000:.0f}ms, "
+                             f"max {latencies[-1] * 1000:.0f}ms")
+        return "\n".join(lines)
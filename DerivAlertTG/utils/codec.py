@@ -0,0 +1,43 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _orjson():
+    import orjson
+    return orjson.loads
+
+
+def _msgspec():
+    import msgspec
+    return msgspec.json.Decoder().decode
+
+
+def _json():
+    return json.loads
+
+
+# JSON decoders for Deriv messages, fastest first. All of them take str or
+# bytes and return plain dicts and lists.
+CODECS = {"orjson": _orjson, "msgspec": _msgspec, "json": _json}
+
+
+# Return (name, loads) for the named codec, or the fastest one installed.
+# A named codec that is not installed falls back the same way.
+def load_codec(name=None):
+    names = [name] if name else []
+    names += [candidate for candidate in CODECS if candidate != name]
+    for candidate in names:
+        factory = CODECS.get(candidate)
+        if factory is None:
+            logger.warning(f"Unknown JSON codec {candidate}")
+            continue
+        try:
+            loads = factory()
+        except ImportError:
+            if candidate == name:
+                logger.warning(f"JSON codec {name} is not installed")
+            continue
+        return candidate, loads
+    raise RuntimeError("No JSON codec available")
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, deque
+
+
+def _where(code, lineno=None):
+    path = "/".join(code.co_filename.replace("\\", "/").split("/")[-2:])
+    return f"{code.co_name} ({path}:{lineno or code.co_firstlineno})"
+
+
+# Statistical profiler for the event loop thread: a background thread looks at
+# the loop thread's stack every `interval` seconds and counts the functions on
+# it. Costs nothing while stopped and little while running, and unlike
+# cProfile it also shows time spent outside Python code, e.g. in select().
+# The GIL switch interval is shortened while sampling; otherwise the sampler
+# mostly gets to run when the loop thread is idle in select() and the profile
+# hides the busy code.
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.running = False
+
+    # Sample the calling thread for `seconds` and return the report
+    async def profile(self, seconds, limit=20):
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        target = threading.get_ident()
+        stop = threading.Event()
+        samples = []
+        thread = threading.Thread(target=self._sample, args=(target, stop, samples), name="sampling-profiler",
+                                  daemon=True)
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, self.interval / 20))
+        try:
+            thread.start()
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            sys.setswitchinterval(switch_interval)
+            await asyncio.to_thread(thread.join)
+            self.running = False
+        return self._report(samples, seconds, limit)
+
+    def _sample(self, target, stop, samples):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            samples.append(stack)
+
+    def _report(self, samples, seconds, limit):
+        own = Counter()
+        total = Counter()
+        for stack in samples:
+            if stack:
+                own[stack[0]] += 1
+            total.update(set(stack))
+        count = len(samples) or 1
+        lines = [f"{len(samples)} samples over {seconds}s, every {self.interval * 1000:g}ms", "", "Own time:"]
+        lines += [f"{hits / count:6.1%}  {_where(code)}" for code, hits in own.most_common(limit)]
+        # Frames on every sample (the loop's own run_forever...) say nothing
+        lines += ["", "Including callees:"]
+        lines += [f"{hits / count:6.1%}  {_where(code)}"
+                  for code, hits in total.most_common(limit + 10) if hits < len(samples)][:limit]
+        return "\n".join(lines)
+
+
+# Keeps the asyncio "Executing <Handle ...> took 0.2 seconds" warnings that
+# debug mode logs for slow callbacks, so they can be shown on demand
+class _SlowCallbackLog(logging.Handler):
+    def __init__(self, size=20):
+        super().__init__(logging.WARNING)
+        self.records = deque(maxlen=size)
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith("Executing"):
+            self.records.append(f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {message}")
+
+
+# Live view of the event loop for operators: a sampling profile, asyncio's
+# slow-callback detection, and every task with its age and where it is
+# waiting. install() must run on the loop so task ages are known.
+class LoopDiagnostics:
+    def __init__(self, profile_interval=0.005):
+        self.profiler = SamplingProfiler(profile_interval)
+        self.created = weakref.WeakKeyDictionary()  # task -> monotonic time created
+        self.slow_callbacks = _SlowCallbackLog()
+        self.loop = None
+
+    def install(self):
+        self.loop = asyncio.get_running_loop()
+        previous = self.loop.get_task_factory()
+
+        def factory(loop, coro, **kwargs):
+            task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+            self.created[task] = time.monotonic()
+            return task
+
+        self.loop.set_task_factory(factory)
+        logging.getLogger("asyncio").addHandler(self.slow_callbacks)
+
+    async def profile(self, seconds, limit=20):
+        return await self.profiler.profile(seconds, limit)
+
+    # Log callbacks and task steps that hold the loop longer than threshold
+    # seconds, or stop with None. Debug mode slows asyncio down a little.
+    def watch_slow_callbacks(self, threshold):
+        if threshold is None:
+            self.loop.set_debug(False)
+            return
+        self.loop.slow_callback_duration = threshold
+        self.loop.set_debug(True)
+
+    def slow_callback_report(self):
+        if not self.loop.get_debug():
+            state = "off"
+        else:
+            state = f"on, over {self.loop.slow_callback_duration * 1000:g}ms"
+        return "\n".join([f"Slow callback detection is {state}."] + list(self.slow_callbacks.records))
+
+    # Every live task, oldest first: age, name and its await chain
+    def task_report(self):
+        now = time.monotonic()
+        tasks = sorted(asyncio.all_tasks(self.loop), key=lambda task: self.created.get(task, 0))
+        lines = [f"{len(tasks)} tasks"]
+        for task in tasks:
+            created = self.created.get(task)
+            age = f"{now - created:9.1f}s" if created is not None else "        ?"
+            lines.append(f"{age}  {task.get_name()}  {self._await_point(task)}")
+        return "\n".join(lines)
+
+    # Where the task waits: the last few coroutines of its await chain
+    @staticmethod
+    def _await_point(task, depth=3):
+        coro = task.get_coro()
+        chain = []
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            chain.append(_where(frame.f_code, frame.f_lineno))
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        return " > ".join(chain[-depth:]) or "running"
@@ -0,0 +1,233 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from .alert_index import AlertIndex, ABOVE, BELOW
+from .indicators import InstrumentIndicators, PRICE
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+ALERTS_ARMED = registry.gauge("alerts_armed", "Alerts waiting for their level to be crossed")
+ALERTS_FIRED = registry.counter("alerts_fired_total", "Alerts whose level was crossed", ["instrument"])
+
+
+# Where a recurring alert that fired waits to be re-armed: it is filed in the
+# index on the other side of its level, hysteresis away, and is crossed once
+# the price has come back that far
+class _Rearm:
+    __slots__ = ("alert", "level", "direction", "fired_at")
+
+    def __init__(self, alert, level, direction, fired_at):
+        self.alert = alert
+        self.level = level
+        self.direction = direction
+        self.fired_at = fired_at  # epoch of the tick that last notified
+
+
+# Evaluates every alert against the shared tick stream. Each instrument has one
+# AlertIndex for price alerts, shared rolling-window indicators for the other
+# kinds, and one hub subscription; the subscription is dropped when the last
+# alert on that instrument fires or is removed. Recurring price alerts never
+# leave the instrument: after firing they wait in the index to be re-armed,
+# then sit out the rest of their cooldown. Cooldowns are measured in tick
+# epochs rather than wall time, so a replay at full speed fires exactly as
+# live trading would have.
+class AlertEngine:
+    def __init__(self, hub, on_fire=None):
+        self.hub = hub
+        self.on_fire = on_fire  # async callable(alert, price, received_at)
+        self.on_cancel = None  # async callable(alerts, reason) when Deriv rejects an instrument
+        self.indexes = {}  # instrument -> AlertIndex
+        self.indicators = {}  # instrument -> InstrumentIndicators
+        self.callbacks = {}  # instrument -> hub callback
+        self.rearms = {}  # recurring alert -> its _Rearm while the price has not come back
+        self.cooling = {}  # instrument -> heap of (epoch the cooldown ends, sequence, recurring alert)
+        self.sequence = itertools.count()  # tie-breaker, so the heap never compares alerts
+        self.tasks = set()  # fire/cancel callbacks and unsubscribes in flight
+        hub.on_error = self._on_stream_error
+        ALERTS_ARMED.set_function(self.armed_count)
+
+    def instruments(self):
+        return list(self.callbacks)
+
+    def armed_count(self):
+        return (sum(len(index) for index in self.indexes.values()) +
+                sum(len(indicators) for indicators in self.indicators.values()) +
+                sum(len(cooling) for cooling in self.cooling.values()))
+
+    # Wait for the callbacks already started, e.g. notifications, at shutdown
+    async def drain(self, timeout=30):
+        if self.tasks:
+            await asyncio.wait(set(self.tasks), timeout=timeout)
+        return len(self.tasks)
+
+    async def add_alert(self, instrument, direction, threshold, alert):
+        new = instrument not in self.callbacks
+        self._arm(instrument, direction, threshold, alert)
+        if new:
+            await self.hub.subscribe(instrument, self.callbacks[instrument])
+
+    # File an alert under its instrument, creating the callback on first use
+    def _arm(self, instrument, direction, threshold, alert):
+        if instrument not in self.callbacks:
+            self.callbacks[instrument] = self._make_callback(instrument)
+        if alert.kind == PRICE:
+            index = self.indexes.get(instrument)
+            if index is None:
+                index = self.indexes[instrument] = AlertIndex()
+            index.add(threshold, direction, alert)
+        else:
+            indicators = self.indicators.get(instrument)
+            if indicators is None:
+                indicators = self.indicators[instrument] = InstrumentIndicators()
+            indicators.add(alert)
+
+    # Load many alerts at once, e.g. when restoring them at startup. Indexes
+    # are filled first and upstream subscriptions are then made in batches.
+    async def add_alerts(self, alerts, batch_size=50):
+        new_pairs = []
+        count = 0
+        for instrument, direction, threshold, alert in alerts:
+            new = instrument not in self.callbacks
+            self._arm(instrument, direction, threshold, alert)
+            if new:
+                new_pairs.append((instrument, self.callbacks[instrument]))
+            count += 1
+        await self.hub.subscribe_many(new_pairs, batch_size=batch_size)
+        return count
+
+    async def remove_alert(self, instrument, direction, threshold, alert):
+        if alert.kind == PRICE:
+            if not self._remove_price(instrument, direction, threshold, alert):
+                return False
+        else:
+            indicators = self.indicators.get(instrument)
+            if indicators is None or not indicators.remove(alert):
+                return False
+        if not self._armed(instrument):
+            await self._drop(instrument)
+        return True
+
+    # Take a price alert out wherever it is: at its level, waiting for the
+    # price to come back, or cooling down
+    def _remove_price(self, instrument, direction, threshold, alert):
+        index = self.indexes.get(instrument)
+        if index is not None and index.remove(threshold, direction, alert):
+            return True
+        rearm = self.rearms.pop(alert, None)
+        if rearm is not None:
+            return index is not None and index.remove(rearm.level, rearm.direction, rearm)
+        cooling = self.cooling.get(instrument)
+        entry = next((entry for entry in cooling if entry[2] is alert), None) if cooling else None
+        if entry is None:
+            return False
+        cooling.remove(entry)
+        heapq.heapify(cooling)
+        if not cooling:
+            del self.cooling[instrument]
+        return True
+
+    def _armed(self, instrument):
+        return (bool(self.indexes.get(instrument)) or bool(self.indicators.get(instrument)) or
+                bool(self.cooling.get(instrument)))
+
+    async def _drop(self, instrument):
+        if instrument not in self.callbacks or self._armed(instrument):  # A new alert may have arrived meanwhile
+            return
+        self.indexes.pop(instrument, None)
+        self.indicators.pop(instrument, None)
+        callback = self.callbacks.pop(instrument, None)
+        if callback is not None:
+            await self.hub.unsubscribe(instrument, callback)
+
+    # Keep a reference to every task started from a tick, so none is garbage
+    # collected mid-flight and drain() can wait for them
+    def _spawn(self, coroutine, name=None):
+        task = asyncio.create_task(coroutine, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _make_callback(self, instrument):
+        return lambda tick: self._on_tick(instrument, tick)
+
+    # A conflated tick (see TickHub) is checked against its batch's low and
+    # high, so a level crossed by any tick in the batch fires, reported at the
+    # extreme that crossed it. Indicators still see every tick of the batch.
+    def _on_tick(self, instrument, tick):
+        price = tick["quote"]
+        batch = tick.get("batch")
+        epoch = tick["epoch"]
+        index = self.indexes.get(instrument)
+        cooling = self.cooling.get(instrument)
+        if cooling and cooling[0][0] <= epoch:
+            self._cooled(instrument, epoch)
+        fired = []
+        if index:
+            low, high = (price, price) if batch is None else (tick["low"], tick["high"])
+            for alert in index.process_range(low, high):
+                if alert.__class__ is _Rearm:
+                    self._rearm(instrument, alert, epoch)
+                    continue
+                fired.append((alert, high if alert.direction == ABOVE else low))
+                if alert.recurring:
+                    self._wait_rearm(index, alert, epoch)
+        indicators = self.indicators.get(instrument)
+        if indicators:
+            for tick_epoch, quote in batch or ((epoch, price),):
+                fired.extend((alert, quote) for alert in indicators.process(tick_epoch, quote))
+        if not fired:
+            return
+        ALERTS_FIRED.labels(instrument).inc(len(fired))
+        received_at = tick.get("received_at")
+        for alert, fired_at in fired:
+            self._spawn(self.on_fire(alert, fired_at, received_at),
+                        f"notify-{alert.chat_id}-{instrument}-{alert.id}")
+        if not self._armed(instrument):
+            self._spawn(self._drop(instrument), f"drop-{instrument}")
+
+    # File a recurring alert that just fired on the other side of its level
+    def _wait_rearm(self, index, alert, fired_at):
+        if alert.direction == ABOVE:
+            rearm = _Rearm(alert, alert.threshold - alert.hysteresis, BELOW, fired_at)
+        else:
+            rearm = _Rearm(alert, alert.threshold + alert.hysteresis, ABOVE, fired_at)
+        self.rearms[alert] = rearm
+        index.add(rearm.level, rearm.direction, rearm)
+
+    # The price is back past the band: put the alert at its level again, now
+    # or with the first tick after its cooldown since the last notification
+    def _rearm(self, instrument, rearm, epoch):
+        alert = rearm.alert
+        del self.rearms[alert]
+        ready = rearm.fired_at + alert.cooldown
+        if ready <= epoch:
+            self.indexes[instrument].add(alert.threshold, alert.direction, alert)
+            return
+        heapq.heappush(self.cooling.setdefault(instrument, []), (ready, next(self.sequence), alert))
+
+    # Arm the alerts whose cooldown is over by this tick
+    def _cooled(self, instrument, epoch):
+        cooling = self.cooling[instrument]
+        index = self.indexes[instrument]
+        while cooling and cooling[0][0] <= epoch:
+            alert = heapq.heappop(cooling)[2]
+            index.add(alert.threshold, alert.direction, alert)
+        if not cooling:
+            del self.cooling[instrument]
+
+    # Deriv refused the subscription (unknown symbol, market closed...): drop
+    # the instrument and hand its alerts back instead of waiting forever
+    def _on_stream_error(self, instrument, message):
+        index = self.indexes.pop(instrument, None)
+        indicators = self.indicators.pop(instrument, None)
+        cooling = self.cooling.pop(instrument, [])
+        callback = self.callbacks.pop(instrument, None)
+        if callback is not None:
+            self._spawn(self.hub.unsubscribe(instrument, callback), f"unsubscribe-{instrument}")
+        alerts = [item.alert if item.__class__ is _Rearm else item for item in (index.alerts() if index else [])]
+        for alert in alerts:
+            self.rearms.pop(alert, None)
+        alerts += [alert for _, _, alert in cooling] + (indicators.alerts() if indicators else [])
+        if alerts and self.on_cancel is not None:
+            self._spawn(self.on_cancel(alerts, message), f"cancel-{instrument}")
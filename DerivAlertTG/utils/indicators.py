@@ -0,0 +1,253 @@
+import math
+from collections import deque
+from .alert_index import AlertIndex, ABOVE, BELOW
+from .candles import CandleSeries
+
+# Alert kinds. "price" alerts live in the engine's AlertIndex; the others are
+# evaluated here against values derived from a rolling window.
+PRICE = "price"
+MOVE = "move"  # moves threshold% within window seconds (above: up, below: down)
+MA_CROSS = "ma"  # crosses its window-tick moving average (above: upwards, below: downwards)
+VOLATILITY = "volatility"  # stdev of returns over window ticks reaches threshold x its 10x longer baseline
+CANDLE_CLOSE = "close"  # a window-second candle closes above/below threshold
+KINDS = (PRICE, MOVE, MA_CROSS, VOLATILITY, CANDLE_CLOSE)
+
+VOLATILITY_BASELINE = 10
+
+
+# Fixed-size ring buffer keeping a running sum and sum of squares, so the
+# mean and standard deviation of the last `size` values are O(1) per push.
+# The sums are recomputed exactly each time the ring wraps so float error
+# cannot build up.
+class RollingWindow:
+    __slots__ = ("size", "values", "position", "count", "sum", "sum_squares")
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size
+        self.position = 0
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+
+    def push(self, value):
+        old = self.values[self.position]
+        self.values[self.position] = value
+        self.position += 1
+        if self.count < self.size:
+            self.count += 1
+            self.sum += value
+            self.sum_squares += value * value
+        else:
+            self.sum += value - old
+            self.sum_squares += value * value - old * old
+        if self.position == self.size:
+            self.position = 0
+            self.sum = math.fsum(self.values)
+            self.sum_squares = math.fsum(v * v for v in self.values)
+
+    def full(self):
+        return self.count == self.size
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def stdev(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.sum / self.count
+        return math.sqrt(max(0.0, self.sum_squares / self.count - mean * mean))
+
+
+# Minimum and maximum of the prices seen in the last `seconds`, kept with
+# monotonic deques so each tick is amortised O(1)
+class RollingMinMax:
+    __slots__ = ("seconds", "lows", "highs")
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.lows = deque()  # (epoch, price), prices increasing
+        self.highs = deque()  # (epoch, price), prices decreasing
+
+    def push(self, epoch, price):
+        while self.lows and self.lows[-1][1] >= price:
+            self.lows.pop()
+        self.lows.append((epoch, price))
+        while self.highs and self.highs[-1][1] <= price:
+            self.highs.pop()
+        self.highs.append((epoch, price))
+        cutoff = epoch - self.seconds
+        while self.lows[0][0] < cutoff:
+            self.lows.popleft()
+        while self.highs[0][0] < cutoff:
+            self.highs.popleft()
+
+    def low(self):
+        return self.lows[0][1]
+
+    def high(self):
+        return self.highs[0][1]
+
+
+# Each indicator turns a tick into one value per direction, and its alerts sit
+# in an AlertIndex keyed by the level that value has to reach, so a tick costs
+# one update of the indicator plus O(log n + k) however many alerts share it.
+class Indicator:
+    def __init__(self):
+        self.alerts = {ABOVE: AlertIndex(), BELOW: AlertIndex()}
+
+    def __len__(self):
+        return len(self.alerts[ABOVE]) + len(self.alerts[BELOW])
+
+    def all_alerts(self):
+        return self.alerts[ABOVE].alerts() + self.alerts[BELOW].alerts()
+
+    def update(self, epoch, price):
+        raise NotImplementedError
+
+    # The level the derived value has to reach for this alert
+    def level(self, alert):
+        return alert.threshold
+
+    def add(self, alert):
+        self.alerts[alert.direction].add(self.level(alert), ABOVE, alert)
+
+    def remove(self, alert):
+        return self.alerts[alert.direction].remove(self.level(alert), ABOVE, alert)
+
+    # Update with a tick and return the alerts it fires
+    def process(self, epoch, price):
+        values = self.update(epoch, price)
+        if values is None:
+            return []
+        up, down = values
+        fired = self.alerts[ABOVE].process_range(up, up) if self.alerts[ABOVE] else []
+        if self.alerts[BELOW]:
+            fired.extend(self.alerts[BELOW].process_range(down, down))
+        return fired
+
+
+# Percentage rise from the window's low and fall from its high
+class MoveIndicator(Indicator):
+    def __init__(self, seconds):
+        super().__init__()
+        self.window = RollingMinMax(seconds)
+
+    def update(self, epoch, price):
+        self.window.push(epoch, price)
+        low, high = self.window.low(), self.window.high()
+        return (price - low) / low * 100 if low else 0.0, (high - price) / high * 100 if high else 0.0
+
+
+# 1 on the tick that crosses the moving average in that direction, else 0;
+# cross alerts are stored at level 1
+class MovingAverageCross(Indicator):
+    def __init__(self, period):
+        super().__init__()
+        self.window = RollingWindow(period)
+        self.side = 0  # sign of price - average on the previous tick
+
+    def level(self, alert):
+        return 1
+
+    def update(self, epoch, price):
+        self.window.push(price)
+        if not self.window.full():
+            return None
+        difference = price - self.window.mean()
+        side = (difference > 0) - (difference < 0)
+        previous, self.side = self.side, side or self.side
+        if not previous or not side or side == previous:
+            return 0, 0
+        return (1, 0) if side > 0 else (0, 1)
+
+
+# Short-window stdev of tick returns as a multiple of the baseline stdev
+class VolatilitySpike(Indicator):
+    def __init__(self, period):
+        super().__init__()
+        self.short = RollingWindow(period)
+        self.long = RollingWindow(period * VOLATILITY_BASELINE)
+        self.last_price = None
+
+    def update(self, epoch, price):
+        last_price, self.last_price = self.last_price, price
+        if not last_price:
+            return None
+        change = (price - last_price) / last_price
+        self.short.push(change)
+        self.long.push(change)
+        if not self.long.full():
+            return None
+        baseline = self.long.stdev()
+        ratio = self.short.stdev() / baseline if baseline else 0.0
+        return ratio, ratio
+
+
+# Evaluated only when a candle closes, against its close, so momentary wicks
+# inside the candle never fire. Alerts keep their own direction in one index.
+class CandleClose(Indicator):
+    def __init__(self, timeframe):
+        super().__init__()
+        self.candles = CandleSeries(timeframe)
+        self.index = AlertIndex()
+
+    def __len__(self):
+        return len(self.index)
+
+    def all_alerts(self):
+        return self.index.alerts()
+
+    def add(self, alert):
+        self.index.add(alert.threshold, alert.direction, alert)
+
+    def remove(self, alert):
+        return self.index.remove(alert.threshold, alert.direction, alert)
+
+    def process(self, epoch, price):
+        closed = self.candles.update(epoch, price)
+        if closed is None:
+            return []
+        return self.index.process(closed[4])
+
+
+INDICATOR_TYPES = {MOVE: MoveIndicator, MA_CROSS: MovingAverageCross, VOLATILITY: VolatilitySpike,
+                   CANDLE_CLOSE: CandleClose}
+
+
+# Every indicator alert of one instrument. Alerts that use the same kind and
+# window share one indicator, which is created with the first of them and
+# dropped with the last.
+class InstrumentIndicators:
+    def __init__(self):
+        self.indicators = {}  # (kind, window) -> Indicator
+
+    def __len__(self):
+        return sum(len(indicator) for indicator in self.indicators.values())
+
+    def alerts(self):
+        return [alert for indicator in self.indicators.values() for alert in indicator.all_alerts()]
+
+    def add(self, alert):
+        key = (alert.kind, alert.window)
+        indicator = self.indicators.get(key)
+        if indicator is None:
+            indicator = self.indicators[key] = INDICATOR_TYPES[alert.kind](alert.window)
+        indicator.add(alert)
+
+    def remove(self, alert):
+        key = (alert.kind, alert.window)
+        indicator = self.indicators.get(key)
+        if indicator is None or not indicator.remove(alert):
+            return False
+        if not indicator:
+            del self.indicators[key]
+        return True
+
+    def process(self, epoch, price):
+        fired = []
+        for key, indicator in list(self.indicators.items()):
+            fired.extend(indicator.process(epoch, price))
+            if not indicator:
+                del self.indicators[key]
+        return fired
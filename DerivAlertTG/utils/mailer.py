@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import smtplib
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+EMAIL_QUEUE_DEPTH = registry.gauge("email_queue_depth", "Alert emails waiting to be sent")
+EMAILS_SENT = registry.counter("emails_sent_total", "Alert emails accepted by the SMTP server")
+EMAIL_FAILURES = registry.counter("email_failures_total", "Alert emails that could not be sent")
+TICK_TO_EMAIL = registry.histogram("tick_to_email_seconds", "Time from receiving a tick to sending its alert email")
+
+
+# One SMTP worker. The connection is opened and logged in once and then reused
+# for every message until the server drops it.
+class SmtpConnection:
+    def __init__(self, host, port, use_ssl, sender, password):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.sender = sender
+        self.password = password
+        self.server = None
+
+    def connect(self):
+        if self.use_ssl:
+            self.server = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+        else:
+            self.server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.password:
+            self.server.login(self.sender, self.password)
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.server = None
+
+    # Send a batch over the open connection, reconnecting once if it was dropped.
+    # Runs in a worker thread so the event loop never waits on the network.
+    def send_batch(self, messages):
+        sent = []
+        for msg in messages:
+            for attempt in range(2):
+                try:
+                    if self.server is None:
+                        self.connect()
+                    self.server.send_message(msg)
+                    sent.append(msg)
+                    break
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError) as e:
+                    self.close()
+                    if attempt:
+                        logger.error(f"Failed to send email to {msg['To']}: {e}")
+                except smtplib.SMTPException as e:
+                    logger.error(f"Failed to send email to {msg['To']}: {e}")
+                    break
+        return sent
+
+
+# Bounded queue of outgoing alert emails drained by a small pool of workers.
+# Each worker keeps its own authenticated connection alive and sends whatever
+# has piled up in one go when many alerts fire together.
+class EmailQueue:
+    def __init__(self, sender, password, host="smtp.gmail.com", port=465, use_ssl=True,
+                 workers=1, maxsize=1000, batch_size=50):
+        self.sender = sender
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.worker_count = workers
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        EMAIL_QUEUE_DEPTH.set_function(self.queue.qsize)
+        self.workers = []
+        self.connections = []
+
+    def start(self):
+        for number in range(self.worker_count):
+            connection = SmtpConnection(self.host, self.port, self.use_ssl, self.sender, self.password)
+            self.connections.append(connection)
+            self.workers.append(asyncio.create_task(self._worker(connection), name=f"email-worker-{number}"))
+
+    # Wait up to timeout seconds for queued emails to go out, then close
+    # every connection. Emails still queued after that count as failed.
+    async def stop(self, timeout=30):
+        finished = True
+        if self.workers:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                finished = False
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+        if not finished:
+            # Give up on what is left; a connection stuck on an unreachable
+            # server would also hang in QUIT, so it is dropped unclosed
+            left = 0
+            while not self.queue.empty():
+                _, _, done = self.queue.get_nowait()
+                if done is not None and not done.done():
+                    done.set_result(False)
+                self.queue.task_done()
+                left += 1
+            EMAIL_FAILURES.inc(left)
+            logger.error(f"Email queue not drained in {timeout}s, dropped {left} queued emails")
+            self.connections.clear()
+            return
+        for connection in self.connections:
+            await asyncio.to_thread(connection.close)
+        self.connections.clear()
+
+    # Queue an email; waits only when the queue is full, or with wait=True
+    # until it was sent, returning whether it was. received_at is the
+    # perf_counter time of the tick that triggered it, for latency metrics.
+    async def send(self, subject, body, receiver_email, received_at=None, wait=False):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = receiver_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        done = asyncio.get_running_loop().create_future() if wait else None
+        await self.queue.put((msg, received_at, done))
+        if done is not None:
+            return await done
+
+    async def _worker(self, connection):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                sent = await asyncio.to_thread(connection.send_batch, [msg for msg, _, _ in batch])
+                logger.info(f"Sent {len(sent)}/{len(batch)} emails.")
+                sent_at = time.perf_counter()
+                sent = set(map(id, sent))
+                for msg, received_at, done in batch:
+                    if id(msg) in sent and received_at is not None:
+                        TICK_TO_EMAIL.observe(sent_at - received_at)
+                    if done is not None and not done.done():
+                        done.set_result(id(msg) in sent)
+                EMAILS_SENT.inc(len(sent))
+                EMAIL_FAILURES.inc(len(batch) - len(sent))
+            except Exception as e:
+                EMAIL_FAILURES.inc(len(batch))
+                logger.error(f"Email worker failed: {e}")
+            finally:
+                for _, _, done in batch:
+                    if done is not None and not done.done():
+                        done.set_result(False)
+                    self.queue.task_done()
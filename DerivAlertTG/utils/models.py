@@ -0,0 +1,103 @@
+from .alert_index import ABOVE
+from .indicators import PRICE, MOVE, MA_CROSS, VOLATILITY, CANDLE_CLOSE
+from .candles import TIMEFRAMES
+
+
+# One alert. kind is "price" for a plain price level, or an indicator kind
+# with its window (seconds for "move" and "close", ticks otherwise). channels
+# lists where it is delivered, None for every channel the user has set up.
+# A recurring price alert has a hysteresis band: after firing it re-arms once
+# the price is back past its level by that much, and notifies at most once
+# per cooldown seconds. One-shot alerts have hysteresis None.
+# __slots__ keeps each alert to a fixed handful of pointers
+# instead of a per-instance dict, so hundreds of thousands fit in one process.
+class Alert:
+    __slots__ = ("id", "chat_id", "instrument", "direction", "threshold", "message", "kind", "window", "channels",
+                 "hysteresis", "cooldown")
+
+    def __init__(self, id, chat_id, instrument, direction, threshold, message, kind=PRICE, window=None,
+                 channels=None, hysteresis=None, cooldown=0):
+        self.id = id
+        self.chat_id = chat_id
+        self.instrument = instrument
+        self.direction = direction
+        self.threshold = threshold
+        self.message = message
+        self.kind = kind
+        self.window = window
+        self.channels = channels
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+
+    def __repr__(self):
+        return f"Alert(#{self.id} {self.instrument} {self.condition()})"
+
+    def condition(self):
+        if self.kind == MOVE:
+            return f"{'rises' if self.direction == ABOVE else 'falls'} {self.threshold}% within {self.window}s"
+        if self.kind == MA_CROSS:
+            return f"crosses {self.direction} its {self.window}-tick average"
+        if self.kind == CANDLE_CLOSE:
+            timeframe = next((name for name, seconds in TIMEFRAMES.items() if seconds == self.window), f"{self.window}s")
+            return f"closes a {timeframe} candle {self.direction} {self.threshold}"
+        if self.kind == VOLATILITY:
+            return f"volatility over {self.window} ticks reaches {self.threshold}x normal"
+        return f"{self.direction} {self.threshold}"
+
+    @property
+    def recurring(self):
+        return self.hysteresis is not None
+
+    def repeats(self):
+        if self.cooldown:
+            return f"repeats after moving back {self.hysteresis}, at most every {self.cooldown:g}s"
+        return f"repeats after moving back {self.hysteresis}"
+
+    def describe(self):
+        line = f"#{self.id} {self.instrument} {self.condition()} - {self.message}"
+        if self.recurring:
+            line += f" ({self.repeats()})"
+        return line
+
+    def to_dict(self):
+        data = {"id": self.id, "instrument": self.instrument, "direction": self.direction,
+                "threshold": self.threshold, "message": self.message}
+        if self.kind != PRICE:
+            data["kind"] = self.kind
+            data["window"] = self.window
+        if self.channels is not None:
+            data["channels"] = list(self.channels)
+        if self.recurring:
+            data["hysteresis"] = self.hysteresis
+            data["cooldown"] = self.cooldown
+        return data
+
+    @classmethod
+    def from_dict(cls, chat_id, data):
+        return cls(data["id"], chat_id, data["instrument"], data.get("direction", ABOVE),
+                   data["threshold"], data.get("message"), data.get("kind", PRICE), data.get("window"),
+                   tuple(data["channels"]) if data.get("channels") is not None else None,
+                   data.get("hysteresis"), data.get("cooldown", 0))
+
+
+# Build the in-memory user from a stored record. Records written before alerts
+# had ids hold a single instrument/alert_price/custom_message; that alert is
+# carried over as alert #1 unless it had already fired.
+def user_from_record(chat_id, record):
+    user = {"chat_id": chat_id, "email": record.get("email"), "webhook": record.get("webhook"),
+            "next_alert_id": record.get("next_alert_id", 1), "alerts": {}}
+    for data in record.get("alerts", ()):
+        alert = Alert.from_dict(chat_id, data)
+        user["alerts"][alert.id] = alert
+    if "instrument" in record and "alert_price" in record and record.get("active", True):
+        alert = Alert(user["next_alert_id"], chat_id, record["instrument"], record.get("direction", ABOVE),
+                      record["alert_price"], record.get("custom_message"))
+        user["alerts"][alert.id] = alert
+        user["next_alert_id"] += 1
+    return user
+
+
+def user_to_record(user):
+    return {"chat_id": user["chat_id"], "email": user["email"], "webhook": user["webhook"],
+            "next_alert_id": user["next_alert_id"],
+            "alerts": [alert.to_dict() for alert in user["alerts"].values()]}
@@ -0,0 +1,240 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import BadRequest, RetryAfter, NetworkError, TelegramError
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TICK_TO_TELEGRAM = registry.histogram("tick_to_telegram_seconds", "Time from receiving a tick to sending its Telegram alert")
+TELEGRAM_SENT = registry.counter("telegram_messages_sent_total", "Messages delivered to Telegram", ["kind"])
+TELEGRAM_FAILURES = registry.counter("telegram_failures_total", "Messages Telegram refused or that kept failing")
+TELEGRAM_RETRY_AFTER = registry.counter("telegram_retry_after_total", "Flood-control RetryAfter responses")
+TELEGRAM_QUEUE_DEPTH = registry.gauge("telegram_queue_depth", "Messages waiting to go out to Telegram", ["kind"])
+
+
+# Token bucket: `rate` tokens per second, holding at most `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    # Seconds until a token is available (0 if one is available now)
+    def delay(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+# Telegram refuses messages over 4096 characters; merged alerts stop short
+# of that, leaving room for the header
+MAX_MESSAGE_LENGTH = 4000
+
+
+# One outgoing message. Alerts for a chat that arrive before it is sent are
+# appended to it, so they go out together.
+class _Outgoing:
+    __slots__ = ("kind", "chat_id", "texts", "length", "received_at", "waiters", "attempts", "markup")
+
+    def __init__(self, kind, chat_id):
+        self.kind = kind  # "alert" or "reply"
+        self.chat_id = chat_id
+        self.texts = []
+        self.length = 0  # characters of the texts and the blank lines between them
+        self.received_at = []
+        self.waiters = []
+        self.attempts = 0
+        self.markup = None  # reply keyboard sent with a reply
+
+    def text(self):
+        if len(self.texts) == 1:
+            return self.texts[0]
+        return f"{len(self.texts)} price alerts:\n\n" + "\n\n".join(self.texts)
+
+
+# Single sender for everything the bot says. It keeps under Telegram's global
+# (about 30 messages/s) and per-chat (about 1 message/s) flood limits with
+# token buckets, and pauses for the time a RetryAfter asks. Alerts for the
+# same chat arriving within coalesce_window are merged into one message, up
+# to max_coalesced alerts or MAX_MESSAGE_LENGTH characters; past that the next
+# alert starts a new message.
+# Alerts always go before conversational replies that are ready at the same
+# time; a chat that is out of tokens is put back rather than holding up others.
+class TelegramDispatcher:
+    def __init__(self, global_rate=25, chat_rate=1, coalesce_window=0.25, max_attempts=3, max_coalesced=50):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}  # chat_id -> TokenBucket
+        self.coalesce_window = coalesce_window
+        self.max_coalesced = max_coalesced
+        self.max_attempts = max_attempts
+        self.bot = None
+        self.alerts = []  # heap of (ready_at, seq, _Outgoing)
+        self.replies = []  # heap of (ready_at, seq, _Outgoing)
+        self.open_alerts = {}  # chat_id -> alert message still accepting more alerts
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.paused_until = 0
+        self.sending = None  # message being sent right now
+        self.worker = None
+        TELEGRAM_QUEUE_DEPTH.labels("alert").set_function(lambda: len(self.alerts))
+        TELEGRAM_QUEUE_DEPTH.labels("reply").set_function(lambda: len(self.replies))
+
+    def start(self, bot):
+        self.bot = bot
+        self.worker = asyncio.create_task(self._run(), name="telegram-dispatcher")
+
+    # Deliver what is already queued (up to timeout seconds), then stop
+    async def stop(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while (self.alerts or self.replies or self.sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.worker is not None:
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+            self.worker = None
+        for queue in (self.alerts, self.replies):
+            for _, _, message in queue:
+                self._finish(message, False)
+            queue.clear()
+        self.open_alerts.clear()
+
+    # Queue an alert and wait until it has been delivered. Returns False if
+    # Telegram refused it.
+    async def notify(self, chat_id, text, received_at=None):
+        message = self.open_alerts.get(chat_id)
+        if message is not None and (len(message.texts) >= self.max_coalesced
+                                    or message.length + 2 + len(text) > MAX_MESSAGE_LENGTH):
+            message = None  # Full: it goes out as it is, and this alert starts the next one
+        if message is None:
+            message = self.open_alerts[chat_id] = _Outgoing("alert", chat_id)
+            self._push(self.alerts, message, time.monotonic() + self.coalesce_window)
+        return await self._add(message, text, received_at)
+
+    # Queue a conversational reply and wait until it has been delivered
+    async def reply(self, chat_id, text, reply_markup=None):
+        message = _Outgoing("reply", chat_id)
+        message.markup = reply_markup
+        self._push(self.replies, message, time.monotonic())
+        return await self._add(message, text, None)
+
+    async def _add(self, message, text, received_at):
+        waiter = asyncio.get_running_loop().create_future()
+        message.length += len(text) + 2 * bool(message.texts)
+        message.texts.append(text)
+        message.received_at.append(received_at)
+        message.waiters.append(waiter)
+        return await waiter
+
+    def _push(self, queue, message, ready_at):
+        heapq.heappush(queue, (ready_at, next(self.sequence), message))
+        self.wakeup.set()
+
+    def _finish(self, message, delivered):
+        for waiter in message.waiters:
+            if not waiter.done():
+                waiter.set_result(delivered)
+
+    # Pop the next message that may be sent now, alerts first, or return how
+    # long to wait for one
+    def _next(self, now):
+        for queue in (self.alerts, self.replies):
+            if queue and queue[0][0] <= now:
+                _, _, message = heapq.heappop(queue)
+                bucket = self.chat_buckets.get(message.chat_id)
+                if bucket is None:
+                    bucket = self.chat_buckets[message.chat_id] = TokenBucket(self.chat_rate)
+                delay = bucket.delay(now)
+                if delay:
+                    self._push(queue, message, now + delay)
+                    return None, 0
+                if queue is self.alerts and self.open_alerts.get(message.chat_id) is message:
+                    del self.open_alerts[message.chat_id]
+                return message, 0
+        waits = [queue[0][0] - now for queue in (self.alerts, self.replies) if queue]
+        return None, min(waits) if waits else None
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            message, wait = self._next(now)
+            if message is None:
+                if wait == 0:
+                    continue
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            delay = self.global_bucket.delay(time.monotonic())
+            if delay:
+                await asyncio.sleep(delay)
+                self.global_bucket.delay(time.monotonic())
+            self.global_bucket.take()
+            self.chat_buckets[message.chat_id].take()
+            self.sending = message
+            try:
+                await self._send(message)
+            finally:
+                self.sending = None
+            self._forget_idle_buckets(now)
+
+    async def _send(self, message):
+        try:
+            await self.bot.send_message(chat_id=message.chat_id, text=message.text(), reply_markup=message.markup)
+        except RetryAfter as e:
+            retry_after = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+            TELEGRAM_RETRY_AFTER.inc()
+            logger.warning(f"Telegram flood control, pausing for {retry_after}s")
+            self.paused_until = time.monotonic() + retry_after
+            self._retry(message)
+            return
+        except BadRequest as e:
+            # A NetworkError subclass, but sending the same message again cannot help
+            logger.error(f"Telegram refused message to {message.chat_id}: {e}")
+            TELEGRAM_FAILURES.inc()
+            self._finish(message, False)
+            return
+        except NetworkError as e:
+            logger.warning(f"Failed to send to {message.chat_id}: {e}")
+            message.attempts += 1
+            if message.attempts < self.max_attempts:
+                self._retry(message)
+                return
+            TELEGRAM_FAILURES.inc()
+            self._finish(message, False)
+            return
+        except TelegramError as e:
+            logger.error(f"Telegram refused message to {message.chat_id}: {e}")
+            TELEGRAM_FAILURES.inc()
+            self._finish(message, False)
+            return
+        sent_at = time.perf_counter()
+        for received_at in message.received_at:
+            if received_at is not None:
+                TICK_TO_TELEGRAM.observe(sent_at - received_at)
+        TELEGRAM_SENT.labels(message.kind).inc()
+        self._finish(message, True)
+
+    def _retry(self, message):
+        self._push(self.alerts if message.kind == "alert" else self.replies, message, time.monotonic())
+
+    # Drop buckets of chats that have been quiet long enough to be full again
+    def _forget_idle_buckets(self, now):
+        if len(self.chat_buckets) < 10000:
+            return
+        idle = [chat_id for chat_id, bucket in self.chat_buckets.items()
+                if now - bucket.updated > bucket.capacity / bucket.rate]
+        for chat_id in idle:
+            del self.chat_buckets[chat_id]
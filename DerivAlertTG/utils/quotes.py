@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import time
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+QUOTE_LOOKUPS = registry.counter("quote_lookups_total", "Last-quote lookups, by where the quote came from", ["source"])
+
+
+class QuoteUnavailable(Exception):
+    pass
+
+
+# Newest quote of every instrument the bot has seen a tick for. It is a hub
+# tap, so instruments with a live subscription are always fresh at no cost.
+# A quote older than max_age seconds is refreshed with a one-off "ticks"
+# request over the shared connection; concurrent lookups of the same
+# instrument share that request.
+class QuoteCache:
+    def __init__(self, hub, max_age=5, timeout=10):
+        self.hub = hub
+        self.max_age = max_age
+        self.timeout = timeout
+        self.quotes = {}  # instrument -> (quote, epoch, monotonic time received)
+        self.fetching = {}  # instrument -> task of the one-off request in flight
+        hub.taps.append(self.record)
+
+    # Hub tap: called with every tick the bot receives
+    def record(self, instrument, tick):
+        if tick.get("backfill"):
+            return
+        self.quotes[instrument] = (tick["quote"], tick["epoch"], time.monotonic())
+
+    # (quote, epoch) no older than max_age. Raises QuoteUnavailable if Deriv
+    # refuses the instrument or cannot be reached.
+    async def get(self, instrument):
+        cached = self.quotes.get(instrument)
+        if cached is not None and time.monotonic() - cached[2] <= self.max_age:
+            QUOTE_LOOKUPS.labels("cache").inc()
+            return cached[0], cached[1]
+        task = self.fetching.get(instrument)
+        if task is None:
+            QUOTE_LOOKUPS.labels("deriv").inc()
+            task = self.fetching[instrument] = asyncio.create_task(self._fetch(instrument))
+            task.add_done_callback(lambda done: self._fetched(instrument, done))
+        else:
+            QUOTE_LOOKUPS.labels("shared").inc()
+        return await asyncio.shield(task)
+
+    def _fetched(self, instrument, task):
+        self.fetching.pop(instrument, None)
+        if not task.cancelled():
+            task.exception()  # Retrieved here too in case every caller gave up
+
+    async def _fetch(self, instrument):
+        try:
+            response = await self.hub.request({"ticks": instrument}, timeout=self.timeout)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            raise QuoteUnavailable("Deriv is not reachable right now") from e
+        if "error" in response:
+            raise QuoteUnavailable(response["error"].get("message"))
+        tick = response["tick"]
+        self.record(instrument, tick)
+        return tick["quote"], tick["epoch"]
@@ -0,0 +1,123 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AlertLimitError(ValueError):
+    pass
+
+
+# Owns every armed alert, keyed by (chat_id, alert_id), in front of the
+# engine. It refuses an alert identical to one the chat already has, caps
+# alerts per chat and in total, and at shutdown stops taking alerts and waits
+# for the notifications the engine has in flight.
+class AlertRegistry:
+    def __init__(self, engine, max_per_chat=50, max_total=200000):
+        self.engine = engine
+        self.max_per_chat = max_per_chat
+        self.max_total = max_total
+        self.on_fire = None  # async callable(alert, price, received_at)
+        self.on_cancel = None  # async callable(alerts, reason)
+        self.alerts = {}  # (chat_id, alert_id) -> Alert
+        self.signatures = {}  # (chat_id, signature) -> Alert
+        self.per_chat = {}  # chat_id -> armed alerts
+        self.closing = False
+        engine.on_fire = self._fired
+        engine.on_cancel = self._cancelled
+
+    def __len__(self):
+        return len(self.alerts)
+
+    # Alerts with the same condition but different repeat settings notify
+    # differently, so they are not duplicates
+    @staticmethod
+    def _signature(alert):
+        return (alert.instrument, alert.kind, alert.direction, alert.threshold, alert.window,
+                alert.hysteresis, alert.cooldown)
+
+    def duplicate_of(self, alert):
+        return self.signatures.get((alert.chat_id, self._signature(alert)))
+
+    # Raise AlertLimitError if the chat, or the bot, cannot take another alert
+    def check_limits(self, chat_id):
+        if self.closing:
+            raise AlertLimitError("The bot is shutting down, please try again shortly.")
+        if self.per_chat.get(chat_id, 0) >= self.max_per_chat:
+            raise AlertLimitError(f"You already have {self.max_per_chat} alerts. Delete one with /delete first.")
+        if len(self.alerts) >= self.max_total:
+            raise AlertLimitError("The bot has reached its alert limit, please try again later.")
+
+    # Arm an alert. Returns the existing alert instead if the chat already has
+    # an identical one; raises AlertLimitError when over a cap.
+    async def add(self, alert):
+        duplicate = self.duplicate_of(alert)
+        if duplicate is not None:
+            return duplicate
+        self.check_limits(alert.chat_id)
+        self._track(alert)
+        try:
+            await self.engine.add_alert(alert.instrument, alert.direction, alert.threshold, alert)
+        except BaseException:
+            self._forget(alert)
+            raise
+        return None
+
+    # Arm stored alerts at startup. Caps are not applied to alerts that were
+    # already accepted; duplicates are skipped and returned.
+    async def add_many(self, alerts, batch_size=50):
+        armed = []
+        duplicates = []
+        for alert in alerts:
+            if self.duplicate_of(alert) is not None:
+                duplicates.append(alert)
+                continue
+            self._track(alert)
+            armed.append((alert.instrument, alert.direction, alert.threshold, alert))
+        await self.engine.add_alerts(armed, batch_size=batch_size)
+        return len(armed), duplicates
+
+    async def remove(self, alert):
+        if self._forget(alert) is None:
+            return False
+        await self.engine.remove_alert(alert.instrument, alert.direction, alert.threshold, alert)
+        return True
+
+    # Stop taking alerts and wait for the fire/cancel callbacks in flight
+    async def drain(self, timeout=30):
+        self.closing = True
+        pending = await self.engine.drain(timeout)
+        if pending:
+            logger.warning(f"{pending} alert notifications did not finish in {timeout}s")
+
+    def _track(self, alert):
+        self.alerts[(alert.chat_id, alert.id)] = alert
+        self.signatures[(alert.chat_id, self._signature(alert))] = alert
+        self.per_chat[alert.chat_id] = self.per_chat.get(alert.chat_id, 0) + 1
+
+    def _forget(self, alert):
+        alert = self.alerts.pop((alert.chat_id, alert.id), None)
+        if alert is None:
+            return None
+        self.signatures.pop((alert.chat_id, self._signature(alert)), None)
+        count = self.per_chat[alert.chat_id] - 1
+        if count:
+            self.per_chat[alert.chat_id] = count
+        else:
+            del self.per_chat[alert.chat_id]
+        return alert
+
+    # A recurring alert stays armed; it is only dropped from here if it was
+    # removed while its tick was being handled
+    async def _fired(self, alert, price, received_at):
+        if alert.recurring:
+            if self.alerts.get((alert.chat_id, alert.id)) is not alert:
+                return
+        elif self._forget(alert) is None:
+            return
+        if self.on_fire is not None:
+            await self.on_fire(alert, price, received_at)
+
+    async def _cancelled(self, alerts, reason):
+        alerts = [alert for alert in alerts if self._forget(alert) is not None]
+        if alerts and self.on_cancel is not None:
+            await self.on_cancel(alerts, reason)
@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+from .models import Alert
+
+logger = logging.getLogger(__name__)
+
+
+# Feed a multiprocessing queue into the event loop from a helper thread, so
+# neither side ever blocks its loop on IPC. Stops once `stopped` is set.
+def _pump(source, loop, handler, stopped):
+    while not stopped.is_set():
+        try:
+            item = source.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        except (EOFError, OSError):
+            break
+        loop.call_soon_threadsafe(handler, item)
+
+
+# ---- Engine worker process ----
+#
+# Each worker owns a partition of the instruments: it keeps its own Deriv
+# connection, decodes the ticks and evaluates the alerts, and only sends back
+# the (chat_id, alert_id) of alerts that fired. Commands from the front end:
+#   ("add", [(chat_id, alert_id, instrument, direction, threshold, kind, window, hysteresis, cooldown), ...])
+#   ("remove", [(chat_id, alert_id), ...])
+#   ("drop", instrument)   hand the instrument over to another worker
+#   ("stop",)
+# and events back:
+#   ("fired", instrument, chat_id, alert_id, price, received_at)
+#   ("cancelled", instrument, [(chat_id, alert_id), ...], reason)
+
+def run_worker(number, url, commands, events, batch_size=50, archive_dir=None):
+    logging.basicConfig(level=logging.INFO, format=f"[engine-{number}] %(levelname)s:%(name)s:%(message)s")
+    asyncio.run(_worker_main(url, commands, events, batch_size, archive_dir))
+
+
+async def _worker_main(url, commands, events, batch_size, archive_dir):
+    from .tick_hub import TickHub
+    from .engine import AlertEngine
+    from .archive import TickRecorder
+
+    hub = TickHub(url)
+    engine = AlertEngine(hub)
+    # Instruments belong to one worker at a time, so workers can share the
+    # archive; around a handover the file lock keeps their appends apart
+    recorder = TickRecorder(archive_dir) if archive_dir else None
+    if recorder is not None:
+        hub.taps.append(recorder.record)
+        recorder.start()
+    alerts = {}  # (chat_id, alert_id) -> Alert
+
+    async def on_fire(alert, price, received_at):
+        if not alert.recurring:
+            alerts.pop((alert.chat_id, alert.id), None)
+        events.put(("fired", alert.instrument, alert.chat_id, alert.id, price, received_at))
+
+    async def on_cancel(cancelled, reason):
+        for alert in cancelled:
+            alerts.pop((alert.chat_id, alert.id), None)
+        if cancelled:
+            events.put(("cancelled", cancelled[0].instrument, [(alert.chat_id, alert.id) for alert in cancelled], reason))
+
+    engine.on_fire = on_fire
+    engine.on_cancel = on_cancel
+
+    inbox = asyncio.Queue()
+    stopped = threading.Event()
+    loop = asyncio.get_running_loop()
+    reader = threading.Thread(target=_pump, args=(commands, loop, inbox.put_nowait, stopped), daemon=True)
+    reader.start()
+    try:
+        while True:
+            command = await inbox.get()
+            kind = command[0]
+            if kind == "add":
+                batch = []
+                for chat_id, alert_id, instrument, direction, threshold, alert_kind, window, *repeat in command[1]:
+                    alert = alerts[(chat_id, alert_id)] = Alert(alert_id, chat_id, instrument, direction, threshold,
+                                                                None, alert_kind, window, None, *repeat)
+                    batch.append((instrument, direction, threshold, alert))
+                await engine.add_alerts(batch, batch_size=batch_size)
+            elif kind == "remove":
+                for key in command[1]:
+                    alert = alerts.pop(tuple(key), None)
+                    if alert is not None:
+                        await engine.remove_alert(alert.instrument, alert.direction, alert.threshold, alert)
+            elif kind == "drop":
+                for key, alert in list(alerts.items()):
+                    if alert.instrument == command[1]:
+                        del alerts[key]
+                        await engine.remove_alert(alert.instrument, alert.direction, alert.threshold, alert)
+                # Write this worker's last ticks now, before the new owner
+                # appends newer ones and these would be dropped as late
+                if recorder is not None:
+                    await recorder.flush([command[1]])
+            elif kind == "stop":
+                break
+    finally:
+        stopped.set()
+        await hub.close()
+        if recorder is not None:
+            await recorder.stop()
+
+
+# ---- Front end ----
+
+class _Worker:
+    def __init__(self, number, process, commands, events, stopped):
+        self.number = number
+        self.process = process
+        self.commands = commands
+        self.events = events
+        self.stopped = stopped  # tells the event pump thread to exit
+        self.instruments = set()
+        self.load = 0  # alerts on the instruments it owns
+
+
+# Drop-in replacement for AlertEngine that runs the tick engine in worker
+# processes. The front end keeps the authoritative set of armed alerts and a
+# coordinator assigns every instrument to the least loaded worker. When a
+# worker is added, instruments are moved to it until the load is even; when
+# one stops or dies, its instruments and their alerts are handed to the
+# survivors. A handed-over alert may briefly be armed on two workers, so a
+# second "fired" for it is ignored.
+class ShardedEngine:
+    def __init__(self, url, workers=2, on_fire=None, batch_size=50, monitor_interval=1, archive_dir=None):
+        self.url = url
+        self.archive_dir = archive_dir
+        self.worker_count = workers
+        self.batch_size = batch_size
+        self.monitor_interval = monitor_interval
+        self.on_fire = on_fire  # async callable(alert, price, received_at)
+        self.on_cancel = None  # async callable(alerts, reason)
+        # Never fork: the front end already runs pump threads, to_thread
+        # workers, the SQLite connection and HTTP pools by the time a worker
+        # is (re)started, and a forked child would inherit their locks mid-use
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = {}  # number -> _Worker
+        self.next_number = 0
+        self.owners = {}  # instrument -> _Worker
+        self.indexes = {}  # instrument -> {(chat_id, alert_id): Alert}
+        self.monitor_task = None
+        self.tasks = set()  # fire/cancel callbacks in flight
+
+    async def start(self):
+        for _ in range(self.worker_count):
+            self.add_worker()
+        self.monitor_task = asyncio.create_task(self._monitor(), name="shard-monitor")
+
+    async def close(self):
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+            await asyncio.gather(self.monitor_task, return_exceptions=True)
+            self.monitor_task = None
+        for worker in list(self.workers.values()):
+            await self.stop_worker(worker.number, rebalance=False)
+
+    # Wait for the fire/cancel callbacks already started, at shutdown
+    async def drain(self, timeout=30):
+        if self.tasks:
+            await asyncio.wait(set(self.tasks), timeout=timeout)
+        return len(self.tasks)
+
+    def instruments(self):
+        return list(self.indexes)
+
+    # Start one more worker process and move instruments onto it
+    def add_worker(self):
+        number = self.next_number
+        self.next_number += 1
+        commands = self.context.Queue()
+        events = self.context.Queue()
+        process = self.context.Process(target=run_worker, args=(number, self.url, commands, events, self.batch_size, self.archive_dir),
+                                       name=f"engine-{number}", daemon=True)
+        process.start()
+        stopped = threading.Event()
+        worker = self.workers[number] = _Worker(number, process, commands, events, stopped)
+        loop = asyncio.get_running_loop()
+        threading.Thread(target=_pump, args=(events, loop, lambda event: self._on_event(worker, event), stopped),
+                         daemon=True).start()
+        logger.info(f"Started engine worker {number} (pid {process.pid})")
+        self._rebalance_onto(worker)
+        return number
+
+    # Stop a worker and hand its instruments to the others
+    async def stop_worker(self, number, rebalance=True):
+        worker = self.workers.pop(number, None)
+        if worker is None:
+            return
+        if worker.process.is_alive():
+            worker.commands.put(("stop",))
+            await asyncio.to_thread(worker.process.join, 10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        worker.stopped.set()
+        logger.info(f"Stopped engine worker {number}")
+        if rebalance:
+            self._reassign(worker)
+
+    async def add_alert(self, instrument, direction, threshold, alert):
+        await self.add_alerts([(instrument, direction, threshold, alert)])
+
+    async def add_alerts(self, alerts, batch_size=None):
+        batches = {}  # worker -> records
+        count = 0
+        for instrument, direction, threshold, alert in alerts:
+            index = self.indexes.setdefault(instrument, {})
+            index[(alert.chat_id, alert.id)] = alert
+            worker = self.owners.get(instrument) or self._assign(instrument)
+            worker.load += 1
+            batches.setdefault(worker, []).append((alert.chat_id, alert.id, instrument, direction, threshold,
+                                                   alert.kind, alert.window, alert.hysteresis, alert.cooldown))
+            count += 1
+        for worker, records in batches.items():
+            worker.commands.put(("add", records))
+        return count
+
+    async def remove_alert(self, instrument, direction, threshold, alert):
+        key = (alert.chat_id, alert.id)
+        alert, owner = self._pop(instrument, key)
+        if alert is None:
+            return False
+        if owner is not None:
+            owner.commands.put(("remove", [key]))
+        return True
+
+    # Forget an armed alert, releasing its instrument once it has none left
+    def _pop(self, instrument, key):
+        index = self.indexes.get(instrument)
+        alert = index.pop(key, None) if index else None
+        if alert is None:
+            return None, None
+        owner = self.owners.get(instrument)
+        if owner is not None:
+            owner.load -= 1
+        if not index:
+            del self.indexes[instrument]
+            if owner is not None:
+                owner.instruments.discard(instrument)
+                del self.owners[instrument]
+        return alert, owner
+
+    def _assign(self, instrument, exclude=None):
+        candidates = [worker for worker in self.workers.values() if worker is not exclude]
+        if not candidates:
+            raise RuntimeError("No engine workers are running")
+        worker = min(candidates, key=lambda candidate: candidate.load)
+        worker.instruments.add(instrument)
+        self.owners[instrument] = worker
+        return worker
+
+    def _records(self, instrument):
+        return [(alert.chat_id, alert.id, instrument, alert.direction, alert.threshold, alert.kind, alert.window,
+                 alert.hysteresis, alert.cooldown)
+                for alert in self.indexes.get(instrument, {}).values()]
+
+    # Move instruments from the busiest workers to a new one until it
+    # carries its share of the alerts
+    def _rebalance_onto(self, target):
+        total = sum(worker.load for worker in self.workers.values())
+        share = total / len(self.workers)
+        for worker in sorted(self.workers.values(), key=lambda worker: -worker.load):
+            if worker is target:
+                continue
+            for instrument in sorted(worker.instruments, key=lambda name: len(self.indexes.get(name, ()))):
+                size = len(self.indexes.get(instrument, ()))
+                if worker.load - size < share or target.load + size > share:
+                    continue
+                self._move(instrument, worker, target)
+
+    def _move(self, instrument, source, target):
+        records = self._records(instrument)
+        source.commands.put(("drop", instrument))
+        source.instruments.discard(instrument)
+        source.load -= len(records)
+        target.instruments.add(instrument)
+        target.load += len(records)
+        self.owners[instrument] = target
+        target.commands.put(("add", records))
+        logger.info(f"Moved {instrument} ({len(records)} alerts) from engine {source.number} to engine {target.number}")
+
+    # Give the instruments of a stopped worker to the least loaded survivors
+    def _reassign(self, dead):
+        instruments = sorted(dead.instruments, key=lambda name: -len(self.indexes.get(name, ())))
+        dead.instruments.clear()
+        for instrument in instruments:
+            self.owners.pop(instrument, None)
+            if not self.workers:
+                logger.error(f"No engine worker left for {instrument}")
+                continue
+            records = self._records(instrument)
+            worker = self._assign(instrument)
+            worker.load += len(records)
+            worker.commands.put(("add", records))
+
+    # Replace workers that exited on their own
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.monitor_interval)
+            for worker in list(self.workers.values()):
+                if not worker.process.is_alive():
+                    logger.error(f"Engine worker {worker.number} exited with code {worker.process.exitcode}")
+                    await self.stop_worker(worker.number)
+                    self.add_worker()
+
+    def _on_event(self, worker, event):
+        kind = event[0]
+        if kind == "fired":
+            _, instrument, chat_id, alert_id, price, received_at = event
+            self._fired(worker, instrument, (chat_id, alert_id), price, received_at)
+        elif kind == "cancelled":
+            _, instrument, keys, reason = event
+            self._cancelled(instrument, keys, reason)
+
+    def _spawn(self, coroutine, name=None):
+        task = asyncio.create_task(coroutine, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _fired(self, worker, instrument, key, price, received_at):
+        alert = self.indexes.get(instrument, {}).get(key)
+        if alert is not None and alert.recurring:
+            # Stays armed on its worker; one that just handed the instrument
+            # over may still report it once, which is ignored
+            if self.owners.get(instrument) is worker and self.on_fire is not None:
+                self._spawn(self.on_fire(alert, price, received_at), f"notify-{alert.chat_id}-{instrument}-{alert.id}")
+            return
+        alert, owner = self._pop(instrument, key)
+        if alert is None:
+            return  # Already fired on the worker that had it before a move
+        if owner is not None and owner is not worker:
+            owner.commands.put(("remove", [key]))
+        if self.on_fire is not None:
+            self._spawn(self.on_fire(alert, price, received_at), f"notify-{alert.chat_id}-{instrument}-{alert.id}")
+
+    def _cancelled(self, instrument, keys, reason):
+        alerts = []
+        for key in keys:
+            alert, _ = self._pop(instrument, tuple(key))
+            if alert is not None:
+                alerts.append(alert)
+        if alerts and self.on_cancel is not None:
+            self._spawn(self.on_cancel(alerts, reason), f"cancel-{instrument}")
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+# Base for the user settings stores. Writes that arrive within commit_delay of
+# each other are committed together in one transaction (group commit), and
+# every caller returns only once its record is durable.
+class UserStore:
+    def __init__(self, commit_delay=0.01):
+        self.commit_delay = commit_delay
+        self.pending = {}  # key -> record, or None for a delete
+        self.committing = {}  # the batch being committed right now
+        self.commit_future = None
+        self.flush_tasks = set()  # running commits, kept here so they are not garbage collected
+        self.commit_lock = asyncio.Lock()
+        self.bytes_written = 0
+
+    def load_all(self):
+        raise NotImplementedError
+
+    # (key, record) pairs one at a time, for stores that can avoid holding
+    # every record at once
+    def items(self):
+        return iter(self.load_all().items())
+
+    def _load(self, key):
+        raise NotImplementedError
+
+    def _commit(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    async def upsert(self, key, record):
+        # Copy now: callers keep mutating their dicts after saving them
+        self.pending[key] = json.loads(json.dumps(record))
+        await self._wait_for_commit()
+
+    # One record, or None. Writes not committed yet are seen too.
+    async def load(self, key):
+        for batch in (self.pending, self.committing):
+            if key in batch:
+                return batch[key]
+        async with self.commit_lock:
+            return await asyncio.to_thread(self._load, key)
+
+    async def delete(self, key):
+        self.pending[key] = None
+        await self._wait_for_commit()
+
+    async def flush(self):
+        if self.commit_future is not None:
+            await self._wait_for_commit()
+
+    async def _wait_for_commit(self):
+        if self.commit_future is None:
+            loop = asyncio.get_running_loop()
+            self.commit_future = loop.create_future()
+            loop.call_later(self.commit_delay, self._start_flush)
+        await asyncio.shield(self.commit_future)
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self._flush())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def _flush(self):
+        batch, self.pending = self.pending, {}
+        future, self.commit_future = self.commit_future, None
+        if future is None:
+            return
+        self.committing = batch
+        try:
+            async with self.commit_lock:
+                await asyncio.to_thread(self._commit, batch)
+        except Exception as e:
+            logger.error(f"Failed to save {len(batch)} user records: {e}")
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+        finally:
+            self.committing = {}
+
+
+# The original user_data.json layout. Each commit rewrites the whole file, but
+# through a temporary file and an atomic rename so a crash never truncates it.
+class JsonFileStore(UserStore):
+    def __init__(self, path, commit_delay=0.01):
+        super().__init__(commit_delay)
+        self.path = path
+        self.records = {}
+
+    def load_all(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.records = json.load(f)
+        return {key: dict(record) for key, record in self.records.items()}
+
+    # The whole file is read at start, so single records come from memory
+    def _load(self, key):
+        return self.records.get(key)
+
+    def _commit(self, batch):
+        for key, record in batch.items():
+            if record is None:
+                self.records.pop(key, None)
+            else:
+                self.records[key] = record
+        data = json.dumps(self.records, indent=4).encode()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.bytes_written += len(data)
+
+
+# SQLite in WAL mode with one row per chat, so a change only writes the
+# records that changed
+class SqliteStore(UserStore):
+    def __init__(self, path, commit_delay=0.01):
+        super().__init__(commit_delay)
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS users (chat_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def load_all(self):
+        return {chat_id: json.loads(data) for chat_id, data in self.db.execute("SELECT chat_id, data FROM users")}
+
+    def items(self):
+        for chat_id, data in self.db.execute("SELECT chat_id, data FROM users"):
+            yield chat_id, json.loads(data)
+
+    def _load(self, key):
+        row = self.db.execute("SELECT data FROM users WHERE chat_id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _commit(self, batch):
+        upserts = []
+        deletes = []
+        for key, record in batch.items():
+            if record is None:
+                deletes.append((key,))
+            else:
+                data = json.dumps(record)
+                upserts.append((key, data))
+                self.bytes_written += len(data)
+        self.db.execute("BEGIN")
+        try:
+            self.db.executemany("INSERT INTO users (chat_id, data) VALUES (?, ?) "
+                                "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data", upserts)
+            self.db.executemany("DELETE FROM users WHERE chat_id = ?", deletes)
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    # Import a legacy user_data.json into an empty database in one transaction
+    def migrate_from_json(self, json_path):
+        if not os.path.exists(json_path):
+            return 0
+        if self.db.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return 0
+        with open(json_path, 'r') as f:
+            records = json.load(f)
+        self._commit(records)
+        logger.info(f"Migrated {len(records)} users from {json_path} to {self.path}")
+        return len(records)
+
+    def close(self):
+        self.db.close()
+
+
+# Pick the backend: "sqlite" (default) imports user_data.json on first start,
+# "json" keeps using the JSON file directly
+def open_store(backend, path, legacy_json_path=None):
+    if backend == "json":
+        return JsonFileStore(path)
+    if backend == "sqlite":
+        store = SqliteStore(path)
+        if legacy_json_path:
+            store.migrate_from_json(legacy_json_path)
+        return store
+    raise ValueError(f"Unknown user store backend: {backend}")
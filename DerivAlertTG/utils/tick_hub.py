@@ -0,0 +1,437 @@
+import asyncio
+import json
+import logging
+import random
+import time
+import websockets
+from .codec import load_codec
+from .metrics import registry, DECODE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+TICKS = registry.counter("deriv_ticks_total", "Ticks received from Deriv", ["instrument"])
+DECODE_SECONDS = registry.histogram("deriv_batch_decode_seconds", "Time spent decoding one batch of Deriv messages",
+                                    buckets=DECODE_BUCKETS)
+BATCH_MESSAGES = registry.histogram("deriv_batch_messages", "Deriv messages taken from the socket in one pass",
+                                    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+CONNECTIONS = registry.gauge("deriv_upstream_connections", "Open websocket connections to Deriv")
+RECONNECTS = registry.counter("deriv_reconnects_total", "Times the Deriv connection was reopened")
+GAP_SECONDS = registry.counter("deriv_gap_seconds_total", "Seconds of ticks missing between consecutive ticks")
+BACKFILLED_TICKS = registry.counter("deriv_backfilled_ticks_total", "Missed ticks fetched with ticks_history")
+SUBSCRIBE_ERRORS = registry.counter("deriv_subscribe_errors_total", "Subscriptions Deriv refused, by error code",
+                                    ["code"])
+
+# Subscribe errors that will not go away by asking again; the instrument's
+# alerts are cancelled. Anything else (MarketIsClosed, RateLimit...) is retried.
+PERMANENT_ERRORS = {"InvalidSymbol", "InputValidationFailed"}
+
+
+# Shares one Deriv websocket between every alert. Each instrument gets a single
+# upstream "ticks" subscription no matter how many alerts watch it, and every
+# tick is fanned out to the callbacks registered for that instrument.
+#
+# The connection is supervised: when it drops it is reopened with jittered
+# exponential backoff and every instrument that still has subscribers is
+# subscribed again. Subscribing never waits for a connection; an instrument
+# registered while Deriv is unreachable is subscribed once it is back. A
+# subscription refused for a passing reason is asked for again every
+# retry_interval seconds. Ticks missed while disconnected (or any other jump in
+# epoch) are fetched with ticks_history and replayed to the subscribers, so a
+# level crossed during an outage still fires.
+#
+# Every message already buffered on the socket is taken in one pass and
+# decoded with the fastest JSON codec installed. If the loop fell behind and
+# one pass holds several ticks of an instrument, subscribers get them
+# conflated into one tick: the latest, plus "low" and "high" over the batch
+# and "batch", every (epoch, quote) in order, for consumers that need each
+# one. Taps still see every tick.
+#
+# Ticks are not logged one by one; every summary_interval seconds one line per
+# instrument reports how many arrived and the latest quote.
+class TickHub:
+    def __init__(self, url, ping_interval=30, gap_threshold=5, min_backoff=1, max_backoff=60, summary_interval=60,
+                 codec=None, max_queue=1024, retry_interval=60):
+        self.url = url
+        self.retry_interval = retry_interval
+        self.codec, self.loads = load_codec(codec)
+        self.max_queue = max_queue  # messages buffered before the socket stops reading
+        self.ping_interval = ping_interval
+        self.summary_interval = summary_interval
+        self.gap_threshold = gap_threshold  # seconds between ticks treated as a gap
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.on_error = None  # callable(instrument, message) for rejected subscriptions
+        self.taps = []  # callables(instrument, tick) that see every tick, e.g. the archive recorder
+        self.websocket = None
+        self.supervisor_task = None
+        self.connected = asyncio.Event()
+        self.req_id = 0
+        self.subscribers = {}  # instrument -> set of callbacks
+        self.subscriptions = {}  # instrument -> Deriv subscription id
+        self.requested = set()  # instruments subscribed (or being subscribed) on this connection
+        self.pending = {}  # req_id -> (instrument, future) waiting for the first tick
+        self.history_requests = {}  # req_id -> instrument being backfilled
+        self.requests = {}  # req_id -> future for a one-off request()
+        self.retries = {}  # instrument -> task asking again for a refused subscription
+        self.last_epochs = {}  # instrument -> epoch of the newest tick seen
+        self.tick_counts = {}  # instrument -> ticks since the last summary
+        self.last_quotes = {}  # instrument -> newest quote
+        self.stats = {"reconnects": 0, "gap_seconds": 0, "backfilled_ticks": 0, "errors": 0, "undecodable": 0}
+
+    def _start(self):
+        if self.supervisor_task is None:
+            self.supervisor_task = asyncio.create_task(self._supervise(), name="tick-hub-supervisor")
+
+    # Start the supervisor if needed and wait until the socket is open
+    async def connect(self):
+        self._start()
+        await self.connected.wait()
+
+    async def close(self):
+        for task in self.retries.values():
+            task.cancel()
+        self.retries.clear()
+        if self.supervisor_task is not None:
+            self.supervisor_task.cancel()
+            await asyncio.gather(self.supervisor_task, return_exceptions=True)
+            self.supervisor_task = None
+        if self.websocket is not None:
+            await self.websocket.close()
+        self._reset_connection()
+
+    # Register a callback for an instrument, opening the upstream subscription
+    # only when it is the first one. Without a connection the supervisor
+    # subscribes it when it connects.
+    async def subscribe(self, instrument, callback):
+        callbacks = self.subscribers.setdefault(instrument, set())
+        callbacks.add(callback)
+        if len(callbacks) > 1:
+            return
+        self._start()
+        if self.websocket is None:
+            return
+        await self._send_subscribe(instrument)
+        logger.info(f"Subscribed to {instrument}")
+
+    # Subscribe many (instrument, callback) pairs at once. Upstream requests go
+    # out batch_size at a time and each batch waits for its first ticks (or
+    # errors) before the next is sent, so a large warm-up stays within Deriv's
+    # request limits without opening extra connections.
+    async def subscribe_many(self, pairs, batch_size=50, timeout=10):
+        new_instruments = []
+        for instrument, callback in pairs:
+            callbacks = self.subscribers.setdefault(instrument, set())
+            callbacks.add(callback)
+            if len(callbacks) == 1:
+                new_instruments.append(instrument)
+        if not new_instruments:
+            return 0
+        self._start()
+        if self.websocket is None:
+            logger.info(f"Deriv not connected yet, {len(new_instruments)} instruments will be subscribed on connect")
+            return len(new_instruments)
+        await self._subscribe_batches(new_instruments, batch_size, timeout)
+        logger.info(f"Subscribed to {len(new_instruments)} instruments")
+        return len(new_instruments)
+
+    # Remove a callback and forget the upstream subscription once nobody is left
+    async def unsubscribe(self, instrument, callback):
+        callbacks = self.subscribers.get(instrument)
+        if not callbacks:
+            return
+        callbacks.discard(callback)
+        if callbacks:
+            return
+        del self.subscribers[instrument]
+        retry = self.retries.pop(instrument, None)
+        if retry is not None:
+            retry.cancel()
+        self.last_epochs.pop(instrument, None)
+        self.requested.discard(instrument)
+        subscription_id = self.subscriptions.pop(instrument, None)
+        if subscription_id is not None:
+            await self._send({"forget": subscription_id})
+            logger.info(f"Unsubscribed from {instrument}")
+
+    # Send a one-off request (active_symbols, a single ticks...) over the shared
+    # connection and return Deriv's response. Raises ConnectionError if the
+    # connection drops first and asyncio.TimeoutError if no answer comes.
+    async def request(self, message, timeout=10):
+        await asyncio.wait_for(self.connect(), timeout)
+        self.req_id += 1
+        req_id = self.req_id
+        response = asyncio.get_running_loop().create_future()
+        self.requests[req_id] = response
+        try:
+            if not await self._send({**message, "req_id": req_id}):
+                raise ConnectionError("Deriv connection closed")
+            return await asyncio.wait_for(response, timeout)
+        finally:
+            self.requests.pop(req_id, None)
+
+    async def _subscribe_batches(self, instruments, batch_size, timeout):
+        for start in range(0, len(instruments), batch_size):
+            acks = [await self._send_subscribe(instrument) for instrument in instruments[start:start + batch_size]]
+            acks = [ack for ack in acks if ack is not None]
+            if not acks:
+                return
+            done, pending = await asyncio.wait(acks, timeout=timeout)
+            if pending:
+                logger.warning(f"{len(pending)} of {len(acks)} subscriptions not confirmed after {timeout}s")
+
+    async def _send(self, message):
+        if self.websocket is None:
+            return False  # Dropped connection; the supervisor resubscribes on reconnect
+        try:
+            await self.websocket.send(json.dumps(message))
+        except websockets.ConnectionClosed:
+            return False
+        return True
+
+    async def _send_subscribe(self, instrument):
+        if instrument in self.requested:
+            return None
+        self.requested.add(instrument)
+        self.req_id += 1
+        ack = asyncio.get_running_loop().create_future()
+        self.pending[self.req_id] = (instrument, ack)
+        if not await self._send({"ticks": instrument, "subscribe": 1, "req_id": self.req_id}):
+            self.pending.pop(self.req_id, None)
+            self.requested.discard(instrument)
+            return None
+        return ack
+
+    async def _request_history(self, instrument, start, end):
+        self.req_id += 1
+        self.history_requests[self.req_id] = instrument
+        await self._send({"ticks_history": instrument, "start": start, "end": end, "style": "ticks",
+                          "count": 5000, "req_id": self.req_id})
+
+    def _resolve(self, req_id, error=None):
+        instrument, ack = self.pending.pop(req_id, (None, None))
+        if ack is not None and not ack.done():
+            ack.set_result(error)
+        return instrument
+
+    def _reset_connection(self):
+        self.websocket = None
+        self.connected.clear()
+        self.subscriptions.clear()
+        self.requested.clear()
+        self.last_quotes.clear()
+        self.history_requests.clear()
+        for response in self.requests.values():
+            if not response.done():
+                response.set_exception(ConnectionError("Deriv connection closed"))
+        self.requests.clear()
+        for req_id in list(self.pending):
+            self._resolve(req_id, "disconnected")
+
+    # Hand an instrument's ticks from one batch, oldest first, to the taps one
+    # by one and to the subscribers as one (conflated) tick. A failing tap or
+    # subscriber is logged and skipped, so it cannot stop the feed for others.
+    def _fan_out(self, instrument, ticks):
+        for tap in self.taps:
+            for tick in ticks:
+                try:
+                    tap(instrument, tick)
+                except Exception:
+                    logger.exception(f"Tick tap {tap!r} failed on {instrument}")
+        if len(ticks) == 1:
+            tick = ticks[0]
+        else:
+            quotes = [tick["quote"] for tick in ticks]
+            tick = dict(ticks[-1], low=min(quotes), high=max(quotes),
+                        batch=[(tick["epoch"], tick["quote"]) for tick in ticks])
+        for callback in list(self.subscribers.get(instrument, ())):
+            try:
+                callback(tick)
+            except Exception:
+                logger.exception(f"Tick subscriber {callback!r} failed on {instrument}")
+
+    # Decode raw messages, skipping (and logging) any that cannot be read
+    def _decode(self, messages):
+        loads = self.loads
+        decoded = []
+        for message in messages:
+            try:
+                decoded.append(loads(message))
+            except Exception:
+                self.stats["undecodable"] += 1
+                logger.exception(f"Cannot decode Deriv message: {message[:200]!r}")
+        return decoded
+
+    def _dispatch_batch(self, messages, received_at=None):
+        ticks = {}  # instrument -> ticks in this batch
+        for data in messages:
+            tick = self._dispatch(data, received_at)
+            if tick is not None:
+                batch = ticks.get(tick["symbol"])
+                if batch is None:
+                    ticks[tick["symbol"]] = [tick]
+                else:
+                    batch.append(tick)
+        for instrument, batch in ticks.items():
+            self._fan_out(instrument, batch)
+
+    # Handle one decoded message; a tick to pass on is returned rather than
+    # fanned out, so a batch can be conflated
+    def _dispatch(self, data, received_at=None):
+        response = self.requests.pop(data.get("req_id"), None)
+        if response is not None:
+            if not response.done():
+                response.set_result(data)
+            return
+
+        if "error" in data:
+            self.stats["errors"] += 1
+            message = data["error"].get("message")
+            code = data["error"].get("code")
+            instrument = self._resolve(data.get("req_id"), data["error"])
+            if instrument is None:
+                instrument = self.history_requests.pop(data.get("req_id"), None)
+            logger.error(f"Deriv error for {instrument or data.get('echo_req')}: {code} {message}")
+            if instrument is not None and data.get("msg_type") == "tick":
+                SUBSCRIBE_ERRORS.labels(code or "unknown").inc()
+                self.requested.discard(instrument)
+                if code not in PERMANENT_ERRORS:
+                    self._retry_later(instrument)
+                elif self.on_error is not None:
+                    self.on_error(instrument, message)
+            return
+
+        if data.get("msg_type") == "history":
+            self._backfill(data)
+            return
+
+        tick = data.get("tick")
+        if tick is None:
+            return
+        instrument = tick["symbol"]
+        if instrument not in self.subscriptions:
+            self._resolve(data.get("req_id"))
+            subscription_id = data.get("subscription", {}).get("id")
+            if instrument not in self.subscribers:
+                # Last subscriber left before the first tick told us the id
+                if subscription_id is not None:
+                    self.requested.discard(instrument)
+                    asyncio.create_task(self._send({"forget": subscription_id}))
+                return
+            self.subscriptions[instrument] = subscription_id
+
+        epoch = tick["epoch"]
+        last_epoch = self.last_epochs.get(instrument)
+        if last_epoch is not None and epoch - last_epoch > self.gap_threshold:
+            self.stats["gap_seconds"] += epoch - last_epoch
+            GAP_SECONDS.inc(epoch - last_epoch)
+            logger.warning(f"Gap of {epoch - last_epoch}s in {instrument} ticks, backfilling")
+            asyncio.create_task(self._request_history(instrument, last_epoch + 1, epoch - 1))
+        if last_epoch is None or epoch > last_epoch:
+            self.last_epochs[instrument] = epoch
+
+        TICKS.labels(instrument).inc()
+        self.tick_counts[instrument] = self.tick_counts.get(instrument, 0) + 1
+        self.last_quotes[instrument] = tick["quote"]
+        tick["received_at"] = received_at
+        return tick
+
+    def _retry_later(self, instrument):
+        if instrument in self.subscribers and instrument not in self.retries:
+            self.retries[instrument] = asyncio.create_task(self._retry_subscribe(instrument),
+                                                           name=f"tick-hub-retry-{instrument}")
+
+    async def _retry_subscribe(self, instrument):
+        try:
+            await asyncio.sleep(self.retry_interval)
+        finally:
+            self.retries.pop(instrument, None)
+        if instrument in self.subscribers and self.websocket is not None:
+            logger.info(f"Retrying the {instrument} subscription")
+            await self._send_subscribe(instrument)
+
+    # Replay ticks fetched for a gap to the instrument's subscribers
+    def _backfill(self, data):
+        instrument = self.history_requests.pop(data.get("req_id"), None)
+        if instrument is None or instrument not in self.subscribers:
+            return
+        history = data.get("history", {})
+        prices = history.get("prices", [])
+        times = history.get("times", [])
+        if prices:
+            self._fan_out(instrument, [{"symbol": instrument, "epoch": epoch, "quote": quote, "backfill": True}
+                                       for epoch, quote in zip(times, prices)])
+        self.stats["backfilled_ticks"] += len(prices)
+        BACKFILLED_TICKS.inc(len(prices))
+        logger.info(f"Backfilled {len(prices)} {instrument} ticks")
+
+    def _log_summary(self):
+        counts, self.tick_counts = self.tick_counts, {}
+        for instrument, count in sorted(counts.items()):
+            logger.info(f"{instrument}: {count} ticks in the last {self.summary_interval}s, "
+                        f"last price {self.last_quotes.get(instrument)}")
+
+    async def _summarize(self):
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            self._log_summary()
+
+    # Deriv drops connections that stay silent, so ping at the API level too
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await self._send({"ping": 1})
+
+    async def _supervise(self):
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(self.url, ping_interval=self.ping_interval,
+                                              max_queue=self.max_queue) as websocket:
+                    self.websocket = websocket
+                    self.connected.set()
+                    CONNECTIONS.inc()
+                    logger.info(f"Connected to {self.url}")
+                    if not hasattr(websocket, "messages"):
+                        logger.warning("This websockets client has no message buffer to drain; "
+                                       "Deriv messages are handled one at a time (requirements pin websockets 13)")
+                    attempt = 0
+                    keepalive = asyncio.create_task(self._keepalive(), name="tick-hub-keepalive")
+                    summary = asyncio.create_task(self._summarize(), name="tick-hub-summary")
+                    resubscribe = asyncio.create_task(self._subscribe_batches(list(self.subscribers), 50, 10),
+                                                      name="tick-hub-resubscribe")
+                    try:
+                        async for message in websocket:
+                            received_at = time.perf_counter()
+                            messages = [message]
+                            # Messages already buffered come back from recv() without waiting.
+                            # `messages` is the legacy client's receive deque (websockets < 14,
+                            # pinned in requirements.txt); the asyncio client from 14 has no
+                            # public equivalent, and there this loop does nothing.
+                            while getattr(websocket, "messages", None):
+                                messages.append(await websocket.recv())
+                            messages = self._decode(messages)
+                            DECODE_SECONDS.observe(time.perf_counter() - received_at)
+                            BATCH_MESSAGES.observe(len(messages))
+                            self._dispatch_batch(messages, received_at)
+                    finally:
+                        CONNECTIONS.dec()
+                        keepalive.cancel()
+                        summary.cancel()
+                        resubscribe.cancel()
+                logger.error("Deriv connection closed by server")
+            except asyncio.CancelledError:
+                raise
+            except (websockets.WebSocketException, OSError) as e:
+                logger.error(f"Deriv connection failed: {e}")
+            except Exception:
+                # A bug must not end the feed for good: log it and reconnect
+                logger.exception("Tick hub supervisor failed, reconnecting")
+            finally:
+                self._reset_connection()
+
+            self.stats["reconnects"] += 1
+            RECONNECTS.inc()
+            delay = min(self.max_backoff, self.min_backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+            attempt += 1
+            logger.info(f"Reconnecting to Deriv in {delay:.1f}s")
+            await asyncio.sleep(delay)
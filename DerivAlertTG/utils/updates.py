@@ -0,0 +1,149 @@
+import asyncio
+import hmac
+import json
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_REQUESTS = registry.counter("webhook_requests_total", "Webhook requests by response status", ["status"])
+UPDATES_WAITING = registry.gauge("updates_waiting", "Updates waiting for an earlier update from the same chat")
+
+
+# Handles updates from different chats concurrently, at most `workers` at a
+# time, but one at a time per chat, in the order they arrived, so the
+# ConversationHandler state of a chat always sees its messages in sequence.
+# The per-chat lock is taken before a worker slot, so a chat sending a burst
+# of messages waits on its own lock instead of filling every slot.
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, workers=16, max_pending=1024):
+        super().__init__(max_pending)
+        self.workers = workers
+        self.slots = None
+        self.chats = {}  # chat_id -> [lock, updates holding or waiting for it]
+
+    async def initialize(self):
+        self.slots = asyncio.Semaphore(self.workers)
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self.slots:
+                await coroutine
+            return
+        entry = self.chats.get(chat.id)
+        if entry is None:
+            entry = self.chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        UPDATES_WAITING.inc()
+        try:
+            async with entry[0]:
+                UPDATES_WAITING.dec()
+                async with self.slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.chats[chat.id]
+
+
+# Read one HTTP/1.1 request. Returns (method, path, headers, body), or None
+# when the client closed the connection.
+async def read_request(reader, max_body=1 << 20):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) < 2:
+        raise ValueError("Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > max_body:
+        raise ValueError("Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return parts[0], parts[1], headers, body
+
+
+def write_response(writer, status, body=b"", content_type="text/plain", keep_alive=True):
+    writer.write(f"HTTP/1.1 {status}\r\n"
+                 f"Content-Type: {content_type}\r\n"
+                 f"Content-Length: {len(body)}\r\n"
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body)
+
+
+# Receives updates that Telegram POSTs to the webhook and puts them on the
+# application's update queue. Requests without the secret token set with
+# setWebhook are refused, and the server will not run without one: anyone who
+# can reach the port could otherwise inject updates. Connections are kept
+# alive, as Telegram reuses them.
+class WebhookServer:
+    def __init__(self, application, path="/telegram", secret_token=None, host="127.0.0.1", port=8443):
+        if not secret_token:
+            raise ValueError("WebhookServer needs a secret token")
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Listening for webhook updates on http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def _authorized(self, headers):
+        received = headers.get("x-telegram-bot-api-secret-token", "")
+        return hmac.compare_digest(received.encode(), self.secret_token.encode())
+
+    async def _respond(self, method, path, headers, body):
+        if path.split("?")[0] != self.path:
+            return "404 Not Found"
+        if method != "POST":
+            return "405 Method Not Allowed"
+        if not self._authorized(headers):
+            return "403 Forbidden"
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed update: {e}")
+            return "400 Bad Request"
+        await self.application.update_queue.put(update)
+        return "200 OK"
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await asyncio.wait_for(read_request(reader), timeout=60)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status = await self._respond(method, path, headers, body)
+                WEBHOOK_REQUESTS.labels(status.split()[0]).inc()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                write_response(writer, status, keep_alive=keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except ValueError as e:
+            write_response(writer, "400 Bad Request", str(e).encode(), keep_alive=False)
+        finally:
+            writer.close()
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from .metrics import registry
+from .models import user_from_record
+
+USER_CACHE_LOOKUPS = registry.counter("user_cache_lookups_total", "User lookups, by whether they were resident",
+                                      ["result"])
+USER_CACHE_EVICTIONS = registry.counter("user_cache_evictions_total", "Users dropped from memory")
+USER_CACHE_RESIDENT = registry.gauge("user_cache_resident_users", "Users held in memory", ["state"])
+USER_CACHE_BYTES = registry.gauge("user_cache_resident_bytes", "Estimated memory of the evictable users")
+
+# Rough cost of a resident user, measured with tracemalloc
+USER_BYTES = 400
+ALERT_BYTES = 200
+
+
+def user_size(user):
+    return USER_BYTES + len(user["email"] or "") + len(user["webhook"] or "") + ALERT_BYTES * len(user["alerts"])
+
+
+# The users the bot keeps in memory. Users with alerts are always resident,
+# since the engine may fire one at any moment. Everyone else is loaded from the
+# store when they talk to the bot and kept in an LRU that holds at most
+# max_bytes (estimated) of them; the least recently used are dropped first.
+# Dropping is always safe because every change is saved before a handler ends.
+class UserCache:
+    def __init__(self, store, max_bytes=64 * 1024 * 1024):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.pinned = {}  # chat_id -> user with alerts
+        self.recent = OrderedDict()  # chat_id -> user without alerts, least recently used first
+        self.sizes = {}  # chat_id -> estimated size, for users in recent
+        self.recent_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        USER_CACHE_RESIDENT.labels("pinned").set_function(lambda: len(self.pinned))
+        USER_CACHE_RESIDENT.labels("recent").set_function(lambda: len(self.recent))
+        USER_CACHE_BYTES.set_function(lambda: self.recent_bytes)
+
+    def __len__(self):
+        return len(self.pinned) + len(self.recent)
+
+    # Read every stored user once and keep the ones with alerts
+    def load_pinned(self):
+        for chat_id, record in self.store.items():
+            user = user_from_record(chat_id, record)
+            if user["alerts"]:
+                self.pinned[chat_id] = user
+        return len(self.pinned)
+
+    def with_alerts(self):
+        return list(self.pinned.values())
+
+    # A user already in memory, without loading
+    def resident(self, chat_id):
+        user = self.pinned.get(chat_id)
+        if user is None:
+            user = self.recent.get(chat_id)
+        return user
+
+    # A user from memory or the store, or None if the chat is unknown
+    async def get(self, chat_id):
+        user = self.pinned.get(chat_id)
+        if user is None:
+            user = self.recent.get(chat_id)
+            if user is not None:
+                self.recent.move_to_end(chat_id)
+        if user is not None:
+            self.stats["hits"] += 1
+            USER_CACHE_LOOKUPS.labels("hit").inc()
+            return user
+        self.stats["misses"] += 1
+        USER_CACHE_LOOKUPS.labels("miss").inc()
+        record = await self.store.load(chat_id)
+        if record is None:
+            return None
+        # Another lookup may have loaded it while this one waited on the store
+        user = self.resident(chat_id) or user_from_record(chat_id, record)
+        self.update(user)
+        return user
+
+    async def get_or_create(self, chat_id):
+        user = await self.get(chat_id)
+        if user is None:
+            user = {"chat_id": chat_id, "email": None, "webhook": None, "next_alert_id": 1, "alerts": {}}
+            self.update(user)
+        return user
+
+    # Account for a user that was added or changed: pin it if it has alerts,
+    # otherwise (re)size it in the LRU and evict down to the budget
+    def update(self, user):
+        chat_id = user["chat_id"]
+        if user["alerts"]:
+            self._unlink(chat_id)
+            self.pinned[chat_id] = user
+            return
+        self.pinned.pop(chat_id, None)
+        self._unlink(chat_id)
+        size = user_size(user)
+        self.recent[chat_id] = user
+        self.sizes[chat_id] = size
+        self.recent_bytes += size
+        self._evict()
+
+    def _unlink(self, chat_id):
+        if self.recent.pop(chat_id, None) is not None:
+            self.recent_bytes -= self.sizes.pop(chat_id)
+
+    def _evict(self):
+        while self.recent_bytes > self.max_bytes and len(self.recent) > 1:
+            chat_id, user = self.recent.popitem(last=False)
+            self.recent_bytes -= self.sizes.pop(chat_id)
+            if user["alerts"]:
+                # Got an alert since it was last accounted for: keep it
+                self.pinned[chat_id] = user
+                continue
+            self.stats["evictions"] += 1
+            USER_CACHE_EVICTIONS.inc()